@@ -0,0 +1,961 @@
+import os
+import sys
+import time
+import json
+import multiprocessing
+import random
+import argparse
+import resource
+import tempfile
+import threading
+import statistics
+import subprocess
+import tracemalloc
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from html import escape
+from html.parser import HTMLParser
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+import numpy as np
+from selenium.common.exceptions import NoSuchElementException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+
+import naukri
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), mode='r', encoding='utf-8') as file:
+        return file.read()
+
+
+class StubPortal:
+    # Local HTTP server standing in for the job portal. routes maps a path to a
+    # function taking the request handler and returning (status, headers, body);
+    # every request is counted and can be delayed to simulate network latency.
+
+    def __init__(self, routes=None, delay=0.0, host='127.0.0.1', port=0):
+        self.routes = dict(routes or {})
+        self.delay = delay
+        self.requests = Counter()
+        portal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                portal._handle(self)
+
+            def do_POST(self):
+                portal._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host = host
+        self.port = self.server.server_address[1]
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def _handle(self, handler):
+        path = handler.path.split('?', 1)[0]
+        self.requests[path] += 1
+        route = self.routes.get(path)
+        if route is None:
+            route = next((route for prefix, route in self.routes.items()
+                          if prefix.endswith('*') and path.startswith(prefix[:-1])), None)
+        if self.delay:
+            time.sleep(self.delay)
+        if route is None:
+            status, headers, body = 404, {'Content-Type': 'text/plain'}, b'not found'
+        else:
+            status, headers, body = route(handler)
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        handler.send_response(status)
+        for name, value in headers.items():
+            handler.send_header(name, value)
+        handler.send_header('Content-Length', str(len(body)))
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def html_route(body):
+    return lambda handler: (200, {'Content-Type': 'text/html; charset=utf-8'}, body)
+
+
+def static_route(content_type, size):
+    payload = b'\0' * size
+    return lambda handler: (200, {'Content-Type': content_type, 'Cache-Control': 'no-store'}, payload)
+
+
+def heavy_search_page(third_party_url, images=40, fonts=4):
+    # The recorded search results page plus the images, fonts and trackers a live page pulls in
+    page = read_fixture('search_results.html')
+    extras = [f'<img src="/img/{index}.png">' for index in range(images)]
+    font_faces = ''.join(f"@font-face {{ font-family: f{index}; src: url('/font/{index}.woff2'); }} "
+                         f"body {{ font-family: f{index}; }}" for index in range(fonts))
+    extras.append(f'<style>{font_faces}</style>')
+    extras.append(f'<script src="{third_party_url}/tracker.js"></script>')
+    extras.append(f'<img src="{third_party_url}/pixel.gif">')
+    return page.replace('</body>', '\n'.join(extras) + '\n</body>')
+
+
+def bench_page_load(args):
+    # Loads the same heavy results page with the default and the fast browser
+    # profile and compares the time until the job tuples can be read
+    portal = StubPortal(delay=args.delay)
+    # The same server under another host name plays the third-party ad/analytics domain
+    third_party_url = f"http://localhost:{portal.port}"
+    portal.routes.update({
+        '/senior-data-engineer-jobs': html_route(heavy_search_page(third_party_url, args.images)),
+        '/img/*': static_route('image/png', 20000),
+        '/font/*': static_route('font/woff2', 30000),
+        '/tracker.js': static_route('application/javascript', 50000),
+        '/pixel.gif': static_route('image/gif', 50),
+    })
+    page_url = f"{portal.url}/senior-data-engineer-jobs"
+    results = {}
+    with portal:
+        for profile in args.profiles:
+            blocked_urls = naukri.FAST_PROFILE_BLOCKED_URLS + [f"*localhost:{portal.port}*"]
+            driver = naukri.configure_driver(profile, blocked_urls=blocked_urls)
+            try:
+                timings = []
+                portal.requests.clear()
+                for _ in range(args.runs):
+                    driver.delete_all_cookies()
+                    started = time.perf_counter()
+                    driver.get(page_url)
+                    WebDriverWait(driver, 60).until(
+                        EC.presence_of_all_elements_located((By.CLASS_NAME, naukri.JOB_TUPLE_CLASS)))
+                    timings.append(time.perf_counter() - started)
+                results[profile] = (timings, sum(portal.requests.values()) / args.runs)
+            finally:
+                driver.quit()
+
+    print(f"Page load over {args.runs} runs, {args.images} images, {args.delay * 1000:.0f} ms per request:")
+    print(f"{'profile':>10} {'median s':>10} {'mean s':>10} {'max s':>10} {'requests/page':>14}")
+    for profile, (timings, requests_per_page) in results.items():
+        print(f"{profile:>10} {statistics.median(timings):>10.3f} {statistics.mean(timings):>10.3f} "
+              f"{max(timings):>10.3f} {requests_per_page:>14.1f}")
+
+
+STUB_LOGIN_COOKIE = 'nauk_at=stub-session-token'
+STUB_ANONYMOUS_HOME = """<!DOCTYPE html>
+<html><body>
+<a id="login_Layer" href="#" onclick="document.getElementById('login-form').style.display = 'block'; return false;">Login</a>
+<div id="login-form" style="display: none">
+  <div><label>Email ID / Username</label><input type="text"></div>
+  <div><label>Password</label><input type="password"></div>
+  <button onclick="fetch('/login', {method: 'POST'}).then(() => {
+      document.cookie = 'nauk_at=stub-session-token; path=/; max-age=86400';
+      localStorage.setItem('profile', 'stub');
+      location.reload();
+  })">Login</button>
+</div>
+</body></html>
+"""
+STUB_LOGGED_IN_HOME = """<!DOCTYPE html>
+<html><body><div class="nI-gNb-drawer__icon">Welcome back</div></body></html>
+"""
+
+
+def stub_home(handler):
+    logged_in = STUB_LOGIN_COOKIE in (handler.headers.get('Cookie') or '')
+    return 200, {'Content-Type': 'text/html; charset=utf-8'}, STUB_LOGGED_IN_HOME if logged_in else STUB_ANONYMOUS_HOME
+
+
+def bench_session(args):
+    # Logs in to a stub portal once, then starts fresh browsers that restore the
+    # saved session, counting the login requests and the time each start takes
+    session_path = os.path.join(naukri.CHROME_CACHE_DIR, 'bench-session.bin')
+    if os.path.exists(session_path):
+        os.remove(session_path)
+    portal = StubPortal(routes={
+        '/': stub_home,
+        '/login': lambda handler: (200, {'Content-Type': 'application/json'}, '{}'),
+    }, delay=args.delay)
+    print(f"{'start':>8} {'seconds':>10} {'login requests':>15} {'logged in':>10}")
+    with portal:
+        for run in range(1, args.runs + 1):
+            driver = naukri.configure_driver(args.profile)
+            try:
+                portal.requests.clear()
+                manager = naukri.SessionManager(portal.url + '/', 'bench-user', 'bench-password', path=session_path)
+                started = time.perf_counter()
+                manager.ensure_login(driver)
+                elapsed = time.perf_counter() - started
+                driver.get(portal.url + '/')
+                logged_in = manager.is_logged_in(driver)
+                print(f"{run:>8} {elapsed:>10.2f} {portal.requests['/login']:>15} {str(logged_in):>10}")
+                if run > 1 and (portal.requests['/login'] or not logged_in):
+                    raise RuntimeError(f"start {run} did not restore the saved session")
+            finally:
+                driver.quit()
+    if os.path.exists(session_path):
+        os.remove(session_path)
+
+
+FAKE_PORTAL_URL = 'https://www.naukri.com'
+CORPUS_SIZES = [100, 10000, 100000]
+SEARCH_PAGE_SIZE = 20
+COMPANY_PAGE_SIZE = 20
+OFFLINE_BENCHMARKS = ['collection', 'collect_company_jobs', 'find_apply_type', 'filter_lead_positions',
+                      'rank_lead_positions']
+OFFLINE_RESULTS_PATH = os.path.join('.naukri_cache', 'bench_offline.json')
+REGRESSION_TOLERANCE = 0.2
+
+SYNTHETIC_LEVELS = ['', 'Senior ', 'Lead ', 'Principal ', 'Staff ', 'Associate ', 'Junior ']
+SYNTHETIC_ROLES = ['Data Engineer', 'GenAI Engineer', 'Machine Learning Engineer', 'Data Scientist',
+                   'Backend Developer', 'Analytics Engineer', 'Platform Engineer', 'Data Architect', 'NLP Engineer',
+                   'QA Automation Engineer', 'Business Analyst', 'DevOps Engineer']
+SYNTHETIC_SUFFIXES = ['', ' - Team Lead', ' (Python)', ' - Cloud Platforms', ' II', ' - Remote', ' & Architect']
+
+JOB_TUPLE_TEMPLATE = """  <div class="srp-jobtuple-wrapper" data-job-id="{job_id}">
+    <div class="cust-job-tuple layout-wrapper lay-2 sjw__tuple ">
+      <div class="row1">
+        <h2><a class="title " title="{job_position}" href="{job_href}" target="_blank">{job_position}</a></h2>
+      </div>
+      <div class="row2">
+        <span class=" comp-dtls-wrap">
+          <a class=" comp-name mw-25" title="{company_name}" href="{company_href}" target="_blank">{company_name}</a>
+        </span>
+      </div>
+    </div>
+  </div>
+"""
+JOB_TUPLES_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>{title} - Naukri.com</title></head>
+<body>
+<div class="styles_job-listing-container__OCfZC">
+{tuples}</div>
+</body>
+</html>
+"""
+
+
+def synthetic_corpus(size, seed=0):
+    # size job titles built from common title parts, COMPANY_PAGE_SIZE per
+    # company; the same seed always gives the same corpus
+    rng = random.Random(seed)
+    jobs = []
+    for index in range(size):
+        job_position = rng.choice(SYNTHETIC_LEVELS) + rng.choice(SYNTHETIC_ROLES) + rng.choice(SYNTHETIC_SUFFIXES)
+        company_index = index // COMPANY_PAGE_SIZE
+        job_id = str(900000000000 + index)
+        slug = '-'.join(''.join(c if c.isalnum() else ' ' for c in job_position.lower()).split())
+        jobs.append({
+            'job_id': job_id,
+            'job_position': job_position,
+            'job_href': f"{FAKE_PORTAL_URL}/job-listings-{slug}-synthetic-{company_index}-{job_id}",
+            'company_name': f"Synthetic Company {company_index}",
+            'company_href': f"{FAKE_PORTAL_URL}/synthetic-company-{company_index}-jobs-careers-{company_index}",
+        })
+    return jobs
+
+
+def job_tuples_page(title, jobs):
+    # A results page in the markup of the recorded search and company pages
+    tuples = ''.join(JOB_TUPLE_TEMPLATE.format(**{key: escape(value) for key, value in job.items()}) for job in jobs)
+    return JOB_TUPLES_PAGE_TEMPLATE.format(title=escape(title), tuples=tuples)
+
+
+def search_pages(corpus):
+    pages = {}
+    for start in range(0, len(corpus), SEARCH_PAGE_SIZE):
+        page_number = start // SEARCH_PAGE_SIZE + 1
+        path = '/synthetic-jobs' if page_number == 1 else f"/synthetic-jobs-{page_number}"
+        pages[path] = job_tuples_page('Synthetic Jobs', corpus[start:start + SEARCH_PAGE_SIZE])
+    return pages
+
+
+def company_pages(corpus):
+    jobs_by_company = {}
+    for job in corpus:
+        jobs_by_company.setdefault(job['company_href'], []).append(job)
+    return {urlparse(company_href).path: job_tuples_page(jobs[0]['company_name'], jobs)
+            for company_href, jobs in jobs_by_company.items()}
+
+
+class FakeElement:
+    # Just enough of a WebElement for the lookups the scraper makes
+
+    def __init__(self, tag_name, attrs, parent=None):
+        self.tag_name = tag_name
+        self.attrs = dict(attrs)
+        self.classes = set((self.attrs.get('class') or '').split())
+        self.parent = parent
+        self.children = []
+        self.text_parts = []
+
+    @property
+    def text(self):
+        return ' '.join(' '.join(element.text_parts) for element in self._iter() if element.text_parts).strip()
+
+    def get_attribute(self, name):
+        return self.attrs.get(name)
+
+    def is_displayed(self):
+        return True
+
+    def click(self):
+        pass
+
+    def _iter(self):
+        stack = [self]
+        while stack:
+            element = stack.pop()
+            yield element
+            stack.extend(reversed(element.children))
+
+    def _matches(self, by, value):
+        if by == By.CLASS_NAME:
+            return value in self.classes
+        if by == By.ID:
+            return self.attrs.get('id') == value
+        if by == By.TAG_NAME:
+            return self.tag_name == value
+        if by == By.CSS_SELECTOR:
+            # Descendant chains of class selectors such as ".container .button"
+            chain = []
+            for part in value.split():
+                if not part.startswith('.'):
+                    raise NotImplementedError(f"Unsupported CSS selector {value!r}")
+                chain.append(set(part.split('.')[1:]))
+            if not chain[-1] <= self.classes:
+                return False
+            remaining = chain[:-1]
+            ancestor = self.parent
+            while remaining and ancestor is not None:
+                if remaining[-1] <= ancestor.classes:
+                    remaining.pop()
+                ancestor = ancestor.parent
+            return not remaining
+        raise NotImplementedError(f"Unsupported locator {by!r}")
+
+    def find_elements(self, by, value):
+        return [element for element in self._iter() if element is not self and element._matches(by, value)]
+
+    def find_element(self, by, value):
+        elements = self.find_elements(by, value)
+        if not elements:
+            raise NoSuchElementException(f"No element for {by}={value}")
+        return elements[0]
+
+
+class FakeDocumentParser(HTMLParser):
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.root = FakeElement('#document', {})
+        self._open = [self.root]
+
+    def handle_starttag(self, tag, attrs):
+        element = FakeElement(tag, attrs, self._open[-1])
+        self._open[-1].children.append(element)
+        if tag not in naukri._VOID_TAGS:
+            self._open.append(element)
+
+    def handle_endtag(self, tag):
+        if not any(element.tag_name == tag for element in self._open[1:]):
+            return
+        while len(self._open) > 1:
+            if self._open.pop().tag_name == tag:
+                break
+
+    def handle_data(self, data):
+        if data.strip():
+            self._open[-1].text_parts.append(data.strip())
+
+
+class FakeWebDriver:
+    # Stands in for Chrome: get() serves recorded or generated HTML from routes
+    # (path -> html, paths ending in '*' match by prefix) after the simulated
+    # latency, and element lookups run against a parsed copy of the page. The
+    # parsing is counted in the timings, so results compare runs of this
+    # harness with each other, not with a real browser.
+
+    def __init__(self, routes, latency=0.0):
+        self.routes = routes
+        self.latency = latency
+        self.current_url = 'about:blank'
+        self.page_source = '<html></html>'
+        self.pages_served = 0
+        self._document = None
+        self._document_source = None
+
+    def get(self, url):
+        if self.latency:
+            time.sleep(self.latency)
+        path = urlparse(url).path
+        page = self.routes.get(path)
+        if page is None:
+            page = next((page for prefix, page in self.routes.items()
+                         if prefix.endswith('*') and path.startswith(prefix[:-1])), '<html><body></body></html>')
+        self.current_url = url
+        self.page_source = page
+        self.pages_served += 1
+
+    def _root(self):
+        # Consecutive loads of the same recorded page reuse its parsed copy
+        if self._document_source is not self.page_source:
+            parser = FakeDocumentParser()
+            parser.feed(self.page_source)
+            parser.close()
+            self._document, self._document_source = parser.root, self.page_source
+        return self._document
+
+    def find_elements(self, by, value):
+        return self._root().find_elements(by, value)
+
+    def find_element(self, by, value):
+        return self._root().find_element(by, value)
+
+    def execute_script(self, script, *args):
+        if 'navigator.userAgent' in script:
+            return 'FakeWebDriver'
+        if 'readyState' in script:
+            return ['complete', 0]
+        return None
+
+    def get_cookies(self):
+        return []
+
+    def add_cookie(self, cookie):
+        pass
+
+    def delete_all_cookies(self):
+        pass
+
+    def quit(self):
+        pass
+
+
+@contextmanager
+def offline_collection(corpus, latency):
+    pages = search_pages(corpus)
+    driver = FakeWebDriver(pages, latency)
+    # Page 1 only; search_jobs finds the others through pagination
+    yield (lambda: naukri.search_jobs(driver, [FAKE_PORTAL_URL + '/synthetic-jobs'], max_pages=len(pages))), len(corpus)
+
+
+@contextmanager
+def offline_collect_company_jobs(corpus, latency):
+    pages = company_pages(corpus)
+    driver = FakeWebDriver(pages, latency)
+    yield (lambda: naukri.visit_pages(driver, [FAKE_PORTAL_URL + path for path in pages],
+                                      naukri._collect_company_page)), len(corpus)
+
+
+@contextmanager
+def _offline_store(name):
+    store = naukri.JobStore(f"{name}.db")
+    try:
+        yield store
+    finally:
+        store.close()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(f"{name}.db{suffix}"):
+                os.remove(f"{name}.db{suffix}")
+
+
+@contextmanager
+def offline_find_apply_type(corpus, latency):
+    driver = FakeWebDriver({'/job-listings-*': read_fixture('job_page.html')}, latency)
+    with _offline_store('find_apply_type') as store:
+        store.add_search_jobs([(job['company_name'], job['job_position'], job['job_href'], job['company_href'])
+                               for job in corpus])
+        yield (lambda: naukri.find_apply_type(driver, store)), len(corpus)
+
+
+@contextmanager
+def offline_filter_lead_positions(corpus, latency):
+    with _offline_store('filter_lead_positions') as store:
+        store.add_company_jobs([(job['company_name'], job['job_position'], job['job_href']) for job in corpus])
+        yield (lambda: naukri.filter_lead_positions(store)), len(corpus)
+
+
+@contextmanager
+def offline_rank_lead_positions(corpus, latency):
+    # Scores without the embedding cache so every run pays for inference;
+    # the model itself is loaded before the timed part
+    engine = naukri._similarity_engine
+    if engine is None or engine.cache is not None:
+        engine = naukri._similarity_engine = naukri.SimilarityEngine(cache=None)
+    engine.model
+    with _offline_store('rank_lead_positions') as store:
+        store.add_company_jobs([(job['company_name'], job['job_position'], job['job_href']) for job in corpus])
+        lead_count = len(store.lead_jobs())
+        yield (lambda: naukri.rank_lead_positions(store)), lead_count
+
+
+OFFLINE_CASES = {
+    'collection': offline_collection,
+    'collect_company_jobs': offline_collect_company_jobs,
+    'find_apply_type': offline_find_apply_type,
+    'filter_lead_positions': offline_filter_lead_positions,
+    'rank_lead_positions': offline_rank_lead_positions,
+}
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def unpaced_governor(concurrency=10 ** 6):
+    return naukri.RequestGovernor(rate=10 ** 9, max_rate=10 ** 9, burst=10 ** 9, concurrency=concurrency,
+                                  max_concurrency=concurrency, retries=0, adaptive=False)
+
+
+def run_offline_case(name, corpus, latency, memory=True):
+    with OFFLINE_CASES[name](corpus, latency) as (run, items):
+        started = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - started
+    result = {
+        'items': items,
+        'seconds': round(seconds, 4),
+        'items_per_second': round(items / seconds, 2) if seconds else None,
+        'peak_mb': None,
+    }
+    if memory:
+        # A second run under tracemalloc, which slows Python code down too much to time
+        with OFFLINE_CASES[name](corpus, latency) as (run, items):
+            tracemalloc.start()
+            try:
+                run()
+                result['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+            finally:
+                tracemalloc.stop()
+    result['max_rss_mb'] = round(_max_rss_mb(), 1)
+    return result
+
+
+def load_offline_results(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, mode='r') as file:
+            return json.load(file)
+    except Exception as e:
+        print(f"Error while reading saved benchmark results {path}: {e}")
+        return None
+
+
+def find_regressions(previous, current, tolerance=REGRESSION_TOLERANCE):
+    regressions = []
+    for key, result in current.items():
+        before = previous.get(key)
+        if not before:
+            continue
+        if before['items_per_second'] and result['items_per_second'] is not None \
+                and result['items_per_second'] < before['items_per_second'] * (1 - tolerance):
+            regressions.append(f"{key}: {before['items_per_second']:.1f} -> {result['items_per_second']:.1f} items/s")
+        if before.get('peak_mb') and result['peak_mb'] is not None \
+                and result['peak_mb'] > before['peak_mb'] * (1 + tolerance):
+            regressions.append(f"{key}: peak memory {before['peak_mb']:.1f} -> {result['peak_mb']:.1f} MB")
+    return regressions
+
+
+def bench_offline(args):
+    # Runs the scraping and ranking stages end to end on synthetic corpora
+    # served by a fake WebDriver, compares with the saved results and saves
+    # the new ones unless they regressed
+    results_path = os.path.abspath(args.results)
+    saved = load_offline_results(results_path)
+    # The fake WebDriver has no portal to protect; pacing would only measure the governor's rate
+    naukri.governor = unpaced_governor()
+    results = {}
+    print(f"{'benchmark':>22} {'size':>7} {'items':>7} {'seconds':>9} {'items/s':>10} {'peak MB':>8} "
+          f"{'max RSS MB':>11}")
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='naukri-bench-') as scratch_dir:
+        # Stages write their CSVs and job stores to the working directory
+        os.chdir(scratch_dir)
+        try:
+            for size in args.sizes:
+                corpus = synthetic_corpus(size)
+                for name in args.benchmarks:
+                    result = run_offline_case(name, corpus, args.latency, memory=not args.no_memory)
+                    results[f"{name}/{size}"] = result
+                    peak_mb = f"{result['peak_mb']:.1f}" if result['peak_mb'] is not None else '-'
+                    print(f"{name:>22} {size:>7} {result['items']:>7} {result['seconds']:>9.3f} "
+                          f"{result['items_per_second'] or 0:>10.1f} {peak_mb:>8} {result['max_rss_mb']:>11.1f}")
+        finally:
+            os.chdir(working_dir)
+
+    regressions = []
+    if saved is not None:
+        if saved.get('latency') != args.latency:
+            print(f"Saved results used {saved.get('latency')}s latency, not comparing with them")
+            saved = None
+        else:
+            regressions = find_regressions(saved['results'], results, args.tolerance)
+    if regressions:
+        print(f"Regressions against {results_path} (saved {saved['saved_at']}):")
+        for regression in regressions:
+            print(f"    {regression}")
+    elif saved is not None:
+        print(f"No regressions against {results_path} (saved {saved['saved_at']})")
+
+    if not regressions or args.update_baseline:
+        # Benchmarks that were not part of this run keep their saved results
+        merged = dict(saved['results']) if saved is not None else {}
+        merged.update(results)
+        os.makedirs(os.path.dirname(results_path), exist_ok=True)
+        with open(results_path, mode='w') as file:
+            json.dump({'saved_at': datetime.now().isoformat(timespec='seconds'), 'latency': args.latency,
+                       'python': sys.version.split()[0], 'results': merged}, file, indent=2)
+        print(f"Results saved to {results_path}")
+    if regressions:
+        sys.exit(1)
+
+
+def bench_scoring(args):
+    # Scores the same synthetic job titles with 1, 2, ... scoring workers and
+    # shows how throughput scales. Worker start-up and model loading happen
+    # before the timed part.
+    titles = [job['job_position'] for job in synthetic_corpus(args.size)]
+    print(f"Scoring {len(titles)} job titles against {naukri.RANK_KEYWORDS} on {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'threads/worker':>15} {'seconds':>9} {'titles/s':>10} {'speedup':>8} {'efficiency':>11}")
+    baseline = None
+    for workers in args.workers:
+        engine = naukri.SimilarityEngine(cache=None, workers=workers)
+        try:
+            if workers > 1:
+                engine._pool = naukri.ScoringPool(workers, engine.model_name, engine.batch_size,
+                                                  shard_size=args.shard_size)
+                engine._pool.warm_up()
+                threads = engine._pool.threads_per_worker
+            else:
+                engine.model
+                import torch
+                threads = torch.get_num_threads() if hasattr(torch, 'get_num_threads') else '-'
+            timings = []
+            for _ in range(args.runs):
+                started = time.perf_counter()
+                engine.score(naukri.RANK_KEYWORDS, titles)
+                timings.append(time.perf_counter() - started)
+        finally:
+            engine.close()
+        seconds = statistics.median(timings)
+        # Speedup and efficiency are relative to the first worker count, normally 1
+        if baseline is None:
+            baseline = (workers, seconds)
+        speedup = baseline[1] / seconds
+        print(f"{workers:>8} {threads:>15} {seconds:>9.2f} {len(titles) / seconds:>10.1f} "
+              f"{speedup:>7.2f}x {speedup / (workers / baseline[0]):>10.0%}")
+
+
+def _current_rss_mb():
+    try:
+        with open('/proc/self/statm', mode='r') as file:
+            return int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        return _max_rss_mb()
+
+
+def _measure_backend(model_name, backend, titles, batch_size):
+    # Runs in a fresh process so the memory numbers belong to this backend alone
+    rss_before = _current_rss_mb()
+    started = time.perf_counter()
+    engine = naukri.SimilarityEngine(model_name, batch_size, cache=None, workers=1, backend=backend)
+    model = engine.model
+    load_seconds = time.perf_counter() - started
+    rss_loaded = _current_rss_mb()
+    model.encode(titles[:batch_size], batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+    latencies = []
+    for start in range(0, len(titles), batch_size):
+        started = time.perf_counter()
+        model.encode(titles[start:start + batch_size], batch_size=batch_size, convert_to_numpy=True,
+                     show_progress_bar=False)
+        latencies.append(time.perf_counter() - started)
+    score_matrix = engine.score(naukri.RANK_KEYWORDS, titles)
+    keyword_count = len(naukri.RANK_KEYWORDS)
+    latencies.sort()
+    return {
+        'load_seconds': load_seconds,
+        'titles_per_second': len(titles) / sum(latencies),
+        'batch_p50_ms': latencies[len(latencies) // 2] * 1000,
+        'batch_p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        'model_mb': rss_loaded - rss_before,
+        'max_rss_mb': _max_rss_mb(),
+        'fit_scores': [sum(score_matrix[keyword][job]['combined_fit_score'] for keyword in range(keyword_count))
+                       / keyword_count for job in range(len(titles))],
+        'passes_threshold': [any(score_matrix[keyword][job]['relevance_score'] > naukri.RANK_SCORE_THRESHOLD
+                                 for keyword in range(keyword_count)) for job in range(len(titles))],
+    }
+
+
+def _ranks(scores):
+    ranks = np.empty(len(scores))
+    ranks[np.argsort(-np.asarray(scores), kind='stable')] = np.arange(len(scores))
+    return ranks
+
+
+def bench_backends(args):
+    # Encodes a fixed set of job titles with each embedding backend, each in
+    # its own process, and compares speed, memory and the resulting ranking
+    # with the fp32 torch backend
+    titles = sorted({job['job_position'] for job in synthetic_corpus(args.size)})
+    backends = ['torch'] + [backend for backend in args.backends if backend != 'torch']
+    model_name = args.model_dir or naukri.SIMILARITY_MODEL_NAME
+    print(f"Comparing embedding backends on {len(titles)} distinct job titles, batch size {args.batch_size}")
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for backend in backends:
+        with context.Pool(1) as pool:
+            results[backend] = pool.apply(_measure_backend, (model_name, backend, titles, args.batch_size))
+
+    baseline = results['torch']
+    top_k = min(args.top_k, len(titles))
+    baseline_ranks = _ranks(baseline['fit_scores'])
+    baseline_top = set(np.argsort(-np.asarray(baseline['fit_scores']), kind='stable')[:top_k])
+    print(f"{'backend':>11} {'load s':>7} {'titles/s':>9} {'batch p50 ms':>13} {'batch p95 ms':>13} "
+          f"{'model MB':>9} {'max RSS MB':>11} {'spearman':>9} {f'top-{top_k}':>7} {'max diff':>9} {'flips':>6}")
+    for backend, result in results.items():
+        ranks = _ranks(result['fit_scores'])
+        spearman = np.corrcoef(baseline_ranks, ranks)[0, 1] if len(titles) > 1 else 1.0
+        top = set(np.argsort(-np.asarray(result['fit_scores']), kind='stable')[:top_k])
+        max_diff = float(np.max(np.abs(np.asarray(result['fit_scores']) - np.asarray(baseline['fit_scores']))))
+        # Titles that moved across the rank threshold and would be kept or dropped differently
+        flips = sum(a != b for a, b in zip(result['passes_threshold'], baseline['passes_threshold']))
+        print(f"{backend:>11} {result['load_seconds']:>7.1f} {result['titles_per_second']:>9.1f} "
+              f"{result['batch_p50_ms']:>13.1f} {result['batch_p95_ms']:>13.1f} {result['model_mb']:>9.0f} "
+              f"{result['max_rss_mb']:>11.0f} {spearman:>9.4f} {len(top & baseline_top) / top_k:>7.0%} "
+              f"{max_diff:>9.4f} {flips:>6}")
+
+
+class RateLimitedRoute:
+    # Serves a small job page, but once more than `limit` requests arrived in
+    # the last second it answers 429 (mode 429) or takes `slow_delay` seconds
+    # longer (mode slow), like a portal protecting itself
+
+    def __init__(self, limit, mode='429', slow_delay=2.0, retry_after=None):
+        self.limit = limit
+        self.mode = mode
+        self.slow_delay = slow_delay
+        self.retry_after = retry_after
+        self.arrivals = deque()
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, handler):
+        with self._lock:
+            now = time.monotonic()
+            self.arrivals.append(now)
+            while self.arrivals[0] < now - 1.0:
+                self.arrivals.popleft()
+            over_limit = len(self.arrivals) > self.limit
+            if over_limit:
+                self.throttled += 1
+        if over_limit and self.mode == '429':
+            headers = {'Content-Type': 'text/plain'}
+            if self.retry_after is not None:
+                headers['Retry-After'] = str(self.retry_after)
+            return 429, headers, 'Too Many Requests'
+        if over_limit:
+            time.sleep(self.slow_delay)
+        return 200, {'Content-Type': 'text/html; charset=utf-8'}, read_fixture('job_page.html')
+
+
+def bench_governor(args):
+    # Fetches the same pages from a stub portal that throttles past --limit
+    # requests/s, once at a fixed concurrency with no pacing (how HTTP fetches
+    # ran before the governor) and once under the adaptive request governor
+    strategies = {
+        'fixed': lambda: unpaced_governor(args.concurrency),
+        'governed': lambda: naukri.RequestGovernor(max_concurrency=args.concurrency,
+                                                   slow_response=args.slow_response),
+    }
+    print(f"Fetching {args.pages} pages from a stub portal that throttles ({args.mode}) past {args.limit} req/s")
+    print(f"{'strategy':>9} {'ok':>5} {'failed':>7} {'throttled':>10} {'seconds':>8} {'ok pages/s':>11} "
+          f"{'p95 s':>6} {'final rate':>11} {'final conc':>11}")
+    original_governor = naukri.governor
+    try:
+        for name in args.strategies:
+            route = RateLimitedRoute(args.limit, args.mode, args.slow_delay, args.retry_after)
+            with StubPortal({'/job-listings-*': route}) as portal:
+                naukri.metrics = naukri.Metrics()
+                naukri.governor = strategies[name]()
+                urls = [f"{portal.url}/job-listings-{index}" for index in range(args.pages)]
+                started = time.perf_counter()
+                results = naukri.fetch_pages_over_http(urls, [], lambda html, url: len(html),
+                                                       concurrency=args.concurrency, timeout=args.slow_delay * 4,
+                                                       operation='page_http')
+                seconds = time.perf_counter() - started
+            ok = sum(result is not None for result in results)
+            stats = naukri.metrics.summary()['operations'].get('page_http', {})
+            final_rate, final_concurrency = '-', '-'
+            if naukri.governor.adaptive:
+                final_rate = f"{naukri.governor.rate:.2f}"
+                final_concurrency = f"{naukri.governor.concurrency:.1f}"
+            print(f"{name:>9} {ok:>5} {len(results) - ok:>7} {route.throttled:>10} {seconds:>8.1f} "
+                  f"{ok / seconds:>11.1f} {stats.get('p95_seconds') or 0:>6} {final_rate:>11} {final_concurrency:>11}")
+    finally:
+        naukri.governor = original_governor
+
+
+# Modules the ranking stage imports lazily; naukri.py imported all of them at
+# the top before it had subcommands
+RANK_MODULES = ['torch', 'sentence_transformers', 'sklearn.feature_extraction.text']
+STARTUP_STAGE_MODULES = {'rank': RANK_MODULES, 'all': RANK_MODULES}
+# Runs in a fresh interpreter: imports naukri, builds the CLI parser, then
+# imports what the command's stages import. Prints timings and max RSS as JSON.
+STARTUP_PROBE = '''
+import importlib, json, resource, sys, time
+command, eager, modules = sys.argv[1], sys.argv[2] == 'eager', json.loads(sys.argv[3])
+started = time.perf_counter()
+missing = []
+def load(names):
+    for name in names:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            missing.append(name)
+if eager:
+    load(modules)
+import naukri
+naukri.build_parser()
+imported = time.perf_counter()
+loaded_at_import = [name for name in modules if name in sys.modules]
+if not eager:
+    load(modules)
+finished = time.perf_counter()
+print(json.dumps({'import_seconds': imported - started, 'stage_import_seconds': finished - imported,
+                  'total_seconds': finished - started, 'loaded_at_import': loaded_at_import, 'missing': missing,
+                  'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+'''
+
+
+def _probe_startup(command, eager, modules):
+    env = dict(os.environ)
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [package_dir, env.get('PYTHONPATH')]))
+    process = subprocess.run([sys.executable, '-c', STARTUP_PROBE, command, 'eager' if eager else 'lazy',
+                              json.dumps(modules)], env=env, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'no output')
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def bench_startup(args):
+    # Start-up cost of every subcommand in a fresh interpreter: importing
+    # naukri, plus the ML modules its stages import. The eager row is what
+    # every command paid when naukri imported them at the top.
+    rows = [(command, False) for command in args.commands] + [('eager', True)]
+    print(f"Start-up per subcommand, median of {args.runs} fresh interpreters")
+    print(f"{'command':>11} {'import ms':>10} {'stage imports ms':>17} {'total ms':>9} {'max RSS MB':>11}  ML at import")
+    for command, eager in rows:
+        modules = RANK_MODULES if eager else STARTUP_STAGE_MODULES.get(command, [])
+        try:
+            results = [_probe_startup(command, eager, modules) for _ in range(args.runs)]
+        except RuntimeError as e:
+            print(f"{command:>11} failed: {e}")
+            continue
+        median = {key: statistics.median(result[key] for result in results)
+                  for key in ['import_seconds', 'stage_import_seconds', 'total_seconds', 'max_rss_mb']}
+        loaded = ', '.join(results[0]['loaded_at_import']) or 'none'
+        print(f"{command:>11} {median['import_seconds'] * 1000:>10.0f} {median['stage_import_seconds'] * 1000:>17.0f} "
+              f"{median['total_seconds'] * 1000:>9.0f} {median['max_rss_mb']:>11.0f}  {loaded}")
+        if results[0]['missing']:
+            print(f"{'':>11} not installed: {', '.join(results[0]['missing'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks against local stub pages')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    page_load = subparsers.add_parser('page-load', help='Compare browser profiles on a heavy results page')
+    page_load.add_argument('--profiles', nargs='+', default=['default', 'fast'])
+    page_load.add_argument('--runs', type=int, default=5)
+    page_load.add_argument('--images', type=int, default=40)
+    page_load.add_argument('--delay', type=float, default=0.05, help='Seconds added to every response')
+    page_load.set_defaults(run=bench_page_load)
+
+    session = subparsers.add_parser('session', help='Show that saved login sessions skip the login flow')
+    session.add_argument('--profile', default='fast')
+    session.add_argument('--runs', type=int, default=3)
+    session.add_argument('--delay', type=float, default=0.05, help='Seconds added to every response')
+    session.set_defaults(run=bench_session)
+
+    offline = subparsers.add_parser('offline', help='Benchmark the scraping and ranking stages on a fake WebDriver')
+    offline.add_argument('--benchmarks', nargs='+', choices=OFFLINE_BENCHMARKS, default=OFFLINE_BENCHMARKS)
+    offline.add_argument('--sizes', nargs='+', type=int, default=CORPUS_SIZES, help='Synthetic corpus sizes in job titles')
+    offline.add_argument('--latency', type=float, default=0.0, help='Seconds the fake WebDriver adds to every page load')
+    offline.add_argument('--no-memory', action='store_true', help='Skip the second, traced run that measures peak memory')
+    offline.add_argument('--results', default=OFFLINE_RESULTS_PATH,
+                         help='Saved results to compare against and update')
+    offline.add_argument('--tolerance', type=float, default=REGRESSION_TOLERANCE,
+                         help='Relative throughput drop or memory growth reported as a regression')
+    offline.add_argument('--update-baseline', action='store_true', help='Save the results even when they regressed')
+    offline.set_defaults(run=bench_offline)
+
+    scoring = subparsers.add_parser('scoring', help='Show how ranking throughput scales with scoring workers')
+    scoring.add_argument('--size', type=int, default=10000, help='Synthetic job titles to score')
+    scoring.add_argument('--workers', nargs='+', type=int,
+                         default=sorted({1, 2, 4, os.cpu_count() or 1} & set(range(1, (os.cpu_count() or 1) + 1))))
+    scoring.add_argument('--shard-size', type=int, default=naukri.SCORING_SHARD_SIZE)
+    scoring.add_argument('--runs', type=int, default=3)
+    scoring.set_defaults(run=bench_scoring)
+
+    backends = subparsers.add_parser('backends', help='Compare embedding backends with the fp32 torch model')
+    backends.add_argument('--backends', nargs='+', choices=naukri.EMBEDDING_BACKENDS, default=naukri.EMBEDDING_BACKENDS)
+    backends.add_argument('--model-dir', default=None, help='Local sentence-transformers model directory')
+    backends.add_argument('--size', type=int, default=2000, help='Synthetic job titles to draw the distinct titles from')
+    backends.add_argument('--batch-size', type=int, default=naukri.ENCODE_BATCH_SIZE)
+    backends.add_argument('--top-k', type=int, default=50, help='Size of the top of the ranking compared')
+    backends.set_defaults(run=bench_backends)
+
+    governor = subparsers.add_parser('governor', help='Compare fixed concurrency with the adaptive request governor '
+                                                      'against a stub portal that throttles')
+    governor.add_argument('--strategies', nargs='+', choices=['fixed', 'governed'], default=['fixed', 'governed'])
+    governor.add_argument('--pages', type=int, default=300)
+    governor.add_argument('--limit', type=float, default=10.0, help='Requests/s the stub portal serves normally')
+    governor.add_argument('--mode', choices=['429', 'slow'], default='429',
+                          help='Answer 429 past the limit, or answer slowly')
+    governor.add_argument('--slow-delay', type=float, default=2.0, help='Extra seconds per response in slow mode')
+    governor.add_argument('--slow-response', type=float, default=1.0,
+                          help='Response time the governor treats as congestion')
+    governor.add_argument('--retry-after', type=int, default=None, help='Retry-After seconds sent with each 429')
+    governor.add_argument('--concurrency', type=int, default=16, help='HTTP concurrency; the governor stays below it')
+    governor.set_defaults(run=bench_governor)
+
+    startup = subparsers.add_parser('startup', help='Measure import time and memory of each naukri.py subcommand')
+    startup.add_argument('--commands', nargs='+', choices=naukri.COMMANDS, default=naukri.COMMANDS)
+    startup.add_argument('--runs', type=int, default=5)
+    startup.set_defaults(run=bench_startup)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
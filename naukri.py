@@ -2,20 +2,608 @@ import os
 import sys
 import time
 import argparse
+import asyncio
 import csv
-from datetime import datetime
+import sqlite3
+import queue
+import threading
+import json
+import random
+import re
+import base64
+import hashlib
+import logging
+import multiprocessing
+import concurrent.futures
+import cProfile
+import pstats
+import functools
+import shutil
+from contextlib import contextmanager
+from collections import Counter, deque
+from datetime import datetime, timedelta
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlparse, urlunparse, quote_plus
+import numpy as np
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import StaleElementReferenceException, TimeoutException, NoSuchElementException, ElementClickInterceptedException
-from sentence_transformers import SentenceTransformer, util
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity as sklearn_cosine_similarity
-import torch
+from selenium.common.exceptions import WebDriverException, StaleElementReferenceException, TimeoutException, NoSuchElementException, ElementClickInterceptedException
+# torch, sentence_transformers and sklearn take seconds and hundreds of MB to
+# import, so they are imported inside the ranking code that needs them and the
+# browser-only subcommands never load them
+
+
+RUN_REPORT_PATH = 'naukri_run_report.json'
+PROMETHEUS_TEXTFILE_PATH = 'naukri.prom'
+METRICS_EXPORT_INTERVAL = 15  # seconds between live rewrites of the Prometheus textfile
+LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+PAGE_OPERATIONS = ['page_load', 'apply_type_http', 'company_http']  # counted towards pages/sec
+PROFILE_STAGES = ['search_jobs', 'navigate_to_company_sites', 'rank_lead_positions', 'find_apply_type',
+                  'filter_simple_apply_jobs']
+
+logger = logging.getLogger('naukri')
+
+
+class Metrics:
+    # Per-operation latency histograms, counts and error counts for one run,
+    # written out as a JSON run report and a Prometheus textfile at the end
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._operations = {}
+        self._gauges = {}
+        self._export_stop = None
+
+    def _operation(self, operation):
+        stats = self._operations.get(operation)
+        if stats is None:
+            stats = {'count': 0, 'errors': 0, 'total': 0.0, 'min': None, 'max': 0.0,
+                     'buckets': [0] * len(self.buckets)}
+            self._operations[operation] = stats
+        return stats
+
+    def observe(self, operation, seconds, error=False):
+        with self._lock:
+            stats = self._operation(operation)
+            stats['count'] += 1
+            stats['total'] += seconds
+            stats['min'] = seconds if stats['min'] is None else min(stats['min'], seconds)
+            stats['max'] = max(stats['max'], seconds)
+            if error:
+                stats['errors'] += 1
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    stats['buckets'][index] += 1
+                    break
+
+    def set_gauge(self, name, value, help_text='', kind='gauge'):
+        # Current value of something that is not a latency, e.g. the request
+        # rate; name may carry Prometheus labels
+        with self._lock:
+            self._gauges[name] = (value, help_text, kind)
+
+    def error(self, operation):
+        # An error that was handled inside the operation rather than raised out of it
+        with self._lock:
+            self._operation(operation)['errors'] += 1
 
+    @contextmanager
+    def timer(self, operation):
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(operation, time.perf_counter() - started, error=True)
+            raise
+        self.observe(operation, time.perf_counter() - started)
+
+    def _quantile(self, stats, quantile):
+        # Upper bound of the bucket holding the quantile
+        target = quantile * stats['count']
+        seen = 0
+        for bound, bucket_count in zip(self.buckets, stats['buckets']):
+            seen += bucket_count
+            if seen >= target:
+                return bound
+        return stats['max']
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        with self._lock:
+            operations = {name: dict(stats, buckets=list(stats['buckets']))
+                          for name, stats in self._operations.items()}
+            gauges = {name: value for name, (value, _, _) in self._gauges.items()}
+        report = {
+            'started_at': datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'duration_seconds': round(elapsed, 3),
+            'operations': {},
+        }
+        for name, stats in sorted(operations.items()):
+            calls = stats['count']
+            report['operations'][name] = {
+                'count': calls,
+                'errors': stats['errors'],
+                'error_rate': round(stats['errors'] / calls, 4) if calls else None,
+                'total_seconds': round(stats['total'], 3),
+                'mean_seconds': round(stats['total'] / calls, 4) if calls else None,
+                'min_seconds': round(stats['min'], 4) if stats['min'] is not None else None,
+                'max_seconds': round(stats['max'], 4),
+                'p50_seconds': self._quantile(stats, 0.5) if calls else None,
+                'p95_seconds': self._quantile(stats, 0.95) if calls else None,
+                'per_second': round(calls / elapsed, 3) if elapsed else None,
+                'histogram': dict(zip([str(bound) for bound in self.buckets] + ['+Inf'],
+                                      stats['buckets'] + [calls - sum(stats['buckets'])])),
+            }
+        page_loads = sum(report['operations'].get(name, {}).get('count', 0) for name in PAGE_OPERATIONS)
+        report['pages_per_second'] = round(page_loads / elapsed, 3) if elapsed else None
+        report['gauges'] = {name: round(value, 3) for name, value in sorted(gauges.items())}
+        return report
+
+    def write_json(self, path=RUN_REPORT_PATH):
+        summary = self.summary()
+        try:
+            with open(path, mode='w') as file:
+                json.dump(summary, file, indent=2)
+            print(f"Run report written to {path}")
+        except OSError as e:
+            print(f"Error while writing run report: {e}")
+        return summary
+
+    def write_prometheus(self, path=PROMETHEUS_TEXTFILE_PATH, quiet=False):
+        summary = self.summary()
+        lines = [
+            '# HELP naukri_operation_seconds Latency of scraper operations.',
+            '# TYPE naukri_operation_seconds histogram',
+        ]
+        with self._lock:
+            operations = {name: dict(stats, buckets=list(stats['buckets']))
+                          for name, stats in self._operations.items()}
+            gauges = dict(self._gauges)
+        for name, stats in sorted(operations.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, stats['buckets']):
+                cumulative += bucket_count
+                lines.append(f'naukri_operation_seconds_bucket{{operation="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'naukri_operation_seconds_bucket{{operation="{name}",le="+Inf"}} {stats["count"]}')
+            lines.append(f'naukri_operation_seconds_sum{{operation="{name}"}} {stats["total"]:.6f}')
+            lines.append(f'naukri_operation_seconds_count{{operation="{name}"}} {stats["count"]}')
+        lines += ['# HELP naukri_operation_errors_total Errors per scraper operation.',
+                  '# TYPE naukri_operation_errors_total counter']
+        lines += [f'naukri_operation_errors_total{{operation="{name}"}} {stats["errors"]}'
+                  for name, stats in sorted(operations.items())]
+        lines += ['# HELP naukri_pages_per_second Pages loaded per second over the run.',
+                  '# TYPE naukri_pages_per_second gauge',
+                  f'naukri_pages_per_second {summary["pages_per_second"] or 0}',
+                  '# HELP naukri_run_duration_seconds Wall-clock duration of the run.',
+                  '# TYPE naukri_run_duration_seconds gauge',
+                  f'naukri_run_duration_seconds {summary["duration_seconds"]}']
+        described = set()
+        for name, (value, help_text, kind) in sorted(gauges.items()):
+            base_name = name.split('{', 1)[0]
+            if base_name not in described:
+                described.add(base_name)
+                lines += [f'# HELP naukri_{base_name} {help_text}', f'# TYPE naukri_{base_name} {kind}']
+            lines.append(f'naukri_{name} {value:g}')
+        # Written atomically so a textfile collector never reads half a file
+        temp_path = path + '.tmp'
+        try:
+            with open(temp_path, mode='w') as file:
+                file.write('\n'.join(lines) + '\n')
+            os.replace(temp_path, path)
+            if not quiet:
+                print(f"Prometheus metrics written to {path}")
+        except OSError as e:
+            print(f"Error while writing Prometheus metrics: {e}")
+
+    def start_export(self, path=PROMETHEUS_TEXTFILE_PATH, interval=METRICS_EXPORT_INTERVAL):
+        # Rewrites the Prometheus textfile every interval seconds while the run
+        # goes on, so a scraper sees live values rather than only the final ones
+        self._export_stop = threading.Event()
+
+        def export():
+            while not self._export_stop.wait(interval):
+                self.write_prometheus(path, quiet=True)
+        threading.Thread(target=export, name='metrics-export', daemon=True).start()
+
+    def stop_export(self):
+        if self._export_stop is not None:
+            self._export_stop.set()
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"Run took {summary['duration_seconds']:.1f}s, {summary['pages_per_second'] or 0:.2f} pages/s")
+        print(f"{'operation':>28} {'count':>6} {'errors':>7} {'mean s':>8} {'p95 s':>7} {'total s':>8}")
+        for name, stats in summary['operations'].items():
+            if not stats['count']:
+                continue
+            print(f"{name:>28} {stats['count']:>6} {stats['errors']:>7} {stats['mean_seconds']:>8.3f} "
+                  f"{stats['p95_seconds']:>7} {stats['total_seconds']:>8.1f}")
+
+
+metrics = Metrics()
+profiled_stages = set()
+
+
+def timed(operation):
+    # Records every call of the decorated function under operation, and runs it
+    # under cProfile when the operation was picked with --profile
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with metrics.timer(operation):
+                if operation not in profiled_stages:
+                    return function(*args, **kwargs)
+                profiler = cProfile.Profile()
+                try:
+                    return profiler.runcall(function, *args, **kwargs)
+                finally:
+                    profile_path = f"profile_{operation}.prof"
+                    profiler.dump_stats(profile_path)
+                    print(f"cProfile stats for {operation} written to {profile_path}")
+                    pstats.Stats(profiler).sort_stats('cumulative').print_stats(20)
+        return wrapper
+    return decorator
+
+
+GOVERNOR_RATE = 2.0  # requests/s to start from; raised while responses stay healthy
+GOVERNOR_MIN_RATE = 0.2
+GOVERNOR_MAX_RATE = 20.0
+GOVERNOR_BURST = 4  # requests the token bucket lets through back to back
+GOVERNOR_CONCURRENCY = 2
+GOVERNOR_MAX_CONCURRENCY = 16
+GOVERNOR_DECREASE = 0.5  # rate and concurrency are multiplied by this on throttling, errors and slow responses
+GOVERNOR_SLOW_RESPONSE = 10.0  # seconds
+GOVERNOR_BACKOFF_BASE = 1.0
+GOVERNOR_BACKOFF_MAX = 60.0
+GOVERNOR_RETRIES = 3
+GOVERNOR_POLL = 0.05
+THROTTLE_STATUSES = {429, 503}
+# Lower-case text of the block and rate limit pages served instead of the requested page
+THROTTLE_PAGE_MARKERS = ['too many requests', 'access denied', 'unusual traffic', 'are you a robot']
+PAGE_STATUS_SCRIPT = """
+    const navigation = performance.getEntriesByType('navigation')[0];
+    return [navigation ? navigation.responseStatus || 0 : 0, document.title,
+            document.body ? document.body.innerText.slice(0, 500) : ''];
+"""
+
+
+def classify_response(status, text=''):
+    # 'throttled' for rate limit and block pages, 'error' for server errors, 'ok' otherwise
+    if status in THROTTLE_STATUSES:
+        return 'throttled'
+    text = (text or '')[:2000].lower()
+    if any(marker in text for marker in THROTTLE_PAGE_MARKERS):
+        return 'throttled'
+    if status >= 500:
+        return 'error'
+    return 'ok'
+
+
+def page_outcome(driver):
+    # Status of the page the browser just loaded; Chrome reports the HTTP
+    # status of the navigation through the Navigation Timing entry
+    try:
+        status, title, text = driver.execute_script(PAGE_STATUS_SCRIPT)
+    except (WebDriverException, TypeError, ValueError):
+        return 'ok'
+    return classify_response(status or 0, f"{title}\n{text}")
+
+
+class RequestGovernor:
+    # Paces every request to the portal, from the browsers and the HTTP client.
+    # A token bucket caps the request rate and a limit caps the requests in
+    # flight. Both grow additively while responses are healthy (by about one
+    # request/s per second at full speed) and are halved when a response is
+    # throttled, fails or is slow; requests that started before the last cut do
+    # not cut again. A throttled response also pauses all requests for a
+    # jittered, exponentially growing backoff, or for its Retry-After.
+
+    def __init__(self, rate=GOVERNOR_RATE, min_rate=GOVERNOR_MIN_RATE, max_rate=GOVERNOR_MAX_RATE,
+                 burst=GOVERNOR_BURST, concurrency=GOVERNOR_CONCURRENCY, max_concurrency=GOVERNOR_MAX_CONCURRENCY,
+                 retries=GOVERNOR_RETRIES, slow_response=GOVERNOR_SLOW_RESPONSE, adaptive=True):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.slow_response = slow_response
+        self.adaptive = adaptive
+        self.tokens = burst
+        self.refilled_at = time.monotonic()
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.throttle_streak = 0
+        self.outcomes = Counter()
+        self._lock = threading.Lock()
+        self._publish()
+
+    @staticmethod
+    def backoff_delay(attempt):
+        # Full jitter: anywhere between 0 and the exponential backoff
+        return random.uniform(0, min(GOVERNOR_BACKOFF_MAX, GOVERNOR_BACKOFF_BASE * 2 ** attempt))
+
+    def _reserve(self):
+        # Takes a request slot and a token and returns the start time, or
+        # returns how long to wait before trying again
+        with self._lock:
+            now = time.monotonic()
+            if now < self.paused_until:
+                return self.paused_until - now, None
+            if self.in_flight >= max(1, int(self.concurrency)):
+                return GOVERNOR_POLL, None
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+            self.refilled_at = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate, None
+            self.tokens -= 1
+            self.in_flight += 1
+            return 0, now
+
+    def acquire(self):
+        started = time.perf_counter()
+        while True:
+            wait, ticket = self._reserve()
+            if ticket is not None:
+                metrics.observe('governor_wait', time.perf_counter() - started)
+                return ticket
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        started = time.perf_counter()
+        while True:
+            wait, ticket = self._reserve()
+            if ticket is not None:
+                metrics.observe('governor_wait', time.perf_counter() - started)
+                return ticket
+            await asyncio.sleep(wait)
+
+    def release(self, ticket, outcome, retry_after=None):
+        # outcome is 'ok', 'throttled' or 'error'; a slow 'ok' counts as congestion too
+        now = time.monotonic()
+        change = None
+        with self._lock:
+            self.in_flight -= 1
+            if outcome == 'ok' and now - ticket > self.slow_response:
+                outcome = 'slow'
+            self.outcomes[outcome] += 1
+            if not self.adaptive:
+                pass
+            elif outcome == 'ok':
+                self.throttle_streak = 0
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+            else:
+                if ticket >= self.last_decrease:
+                    change = (self.rate, self.concurrency)
+                    self.rate = max(self.min_rate, self.rate * GOVERNOR_DECREASE)
+                    self.concurrency = max(1, self.concurrency * GOVERNOR_DECREASE)
+                    self.last_decrease = now
+                if outcome == 'throttled':
+                    pause = retry_after if retry_after is not None else self.backoff_delay(self.throttle_streak)
+                    self.throttle_streak += 1
+                    if now + pause > self.paused_until:
+                        self.paused_until = now + pause
+                        # Start again from an empty bucket rather than a burst
+                        self.tokens = 0
+        if change is not None:
+            logger.info("Request governor: %s response, rate %.2f -> %.2f req/s, concurrency %.1f -> %.1f%s",
+                        outcome, change[0], self.rate, change[1], self.concurrency,
+                        f", pausing {self.paused_until - now:.1f}s" if outcome == 'throttled' else '')
+        self._publish()
+        return outcome
+
+    def call(self, request, check=None, retry_on=()):
+        # Runs request() under the governor. check() classifies the result;
+        # throttled and failed attempts, and exceptions in retry_on, are retried
+        # with backoff. Returns the result of the last attempt.
+        for attempt in range(self.retries + 1):
+            ticket = self.acquire()
+            try:
+                result = request()
+            except retry_on as e:
+                self.release(ticket, 'error')
+                if attempt == self.retries:
+                    raise
+                print(f"Request failed ({e.__class__.__name__}), retrying")
+                time.sleep(self.backoff_delay(attempt))
+                continue
+            except BaseException:
+                self.release(ticket, 'error')
+                raise
+            outcome = self.release(ticket, check() if check is not None else 'ok')
+            if outcome in ('ok', 'slow') or attempt == self.retries:
+                return result
+            print(f"Request {outcome}, retrying")
+            if outcome == 'error':
+                time.sleep(self.backoff_delay(attempt))
+            # A throttled attempt waits out the pause in acquire()
+
+    def _publish(self):
+        metrics.set_gauge('request_rate', self.rate, 'Requests/s the request governor allows.')
+        metrics.set_gauge('request_concurrency', self.concurrency, 'Requests the governor allows in flight.')
+        metrics.set_gauge('requests_in_flight', self.in_flight, 'Requests in flight.')
+        metrics.set_gauge('request_paused_seconds', max(0.0, self.paused_until - time.monotonic()),
+                          'Seconds left in the current throttling pause.')
+        for outcome in ['ok', 'slow', 'throttled', 'error']:
+            metrics.set_gauge(f'governed_requests_total{{outcome="{outcome}"}}', self.outcomes[outcome],
+                              'Requests by governor outcome.', kind='counter')
+
+
+governor = RequestGovernor()
+
+
+def load_page(driver, url):
+    # Every browser page load goes through the request governor
+    def get():
+        with metrics.timer('page_load'):
+            driver.get(url)
+    governor.call(get, check=lambda: page_outcome(driver), retry_on=(TimeoutException,))
+
+
+def reload_page(driver):
+    def refresh():
+        with metrics.timer('page_load'):
+            driver.refresh()
+    governor.call(refresh, check=lambda: page_outcome(driver), retry_on=(TimeoutException,))
+
+
+WAIT_DEFAULT_TIMEOUT = 30
+WAIT_MIN_BUDGET = 2.0
+WAIT_BUDGET_FACTOR = 3.0
+WAIT_MIN_SAMPLES = 5
+WAIT_HISTORY = 200
+WAIT_POLL_FREQUENCY = 0.1
+WAIT_BUDGETS_PATH = os.path.join('.naukri_cache', 'wait_latencies.json')
+
+
+class WaitEngine:
+    # Every wait in the scraper goes through here. Waits poll a readiness
+    # condition instead of sleeping a fixed time, and each one records how long
+    # it took per page type. Optional waits (for things that may legitimately
+    # never appear) give up after a budget learned from those latencies instead
+    # of the full default timeout.
+
+    def __init__(self, default_timeout=WAIT_DEFAULT_TIMEOUT, path=WAIT_BUDGETS_PATH):
+        self.default_timeout = default_timeout
+        self.path = path
+        self._lock = threading.Lock()
+        self._latencies = {}  # page type -> recent successful wait times
+        self._waits = Counter()
+        self._timeouts = Counter()
+        self._waited = Counter()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, mode='r') as file:
+                for page_type, latencies in json.load(file).items():
+                    self._latencies[page_type] = deque(latencies, maxlen=WAIT_HISTORY)
+        except Exception as e:
+            print(f"Error while loading wait latencies, starting fresh: {e}")
 
-def configure_driver():
+    def save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with self._lock:
+                latencies = {page_type: list(values) for page_type, values in self._latencies.items()}
+            with open(self.path, mode='w') as file:
+                json.dump(latencies, file)
+        except Exception as e:
+            print(f"Error while saving wait latencies: {e}")
+
+    def budget(self, page_type):
+        # A few times the slowest recent wait of this page type, within sane bounds
+        with self._lock:
+            latencies = sorted(self._latencies.get(page_type, ()))
+        if len(latencies) < WAIT_MIN_SAMPLES:
+            return self.default_timeout
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        return min(self.default_timeout, max(WAIT_MIN_BUDGET, p95 * WAIT_BUDGET_FACTOR))
+
+    def _record(self, page_type, elapsed, timed_out):
+        with self._lock:
+            self._waits[page_type] += 1
+            self._waited[page_type] += elapsed
+            if timed_out:
+                self._timeouts[page_type] += 1
+            else:
+                self._latencies.setdefault(page_type, deque(maxlen=WAIT_HISTORY)).append(elapsed)
+        metrics.observe(f"wait:{page_type}", elapsed, error=timed_out)
+
+    def until(self, driver, page_type, condition, optional=False, timeout=None):
+        # Waits for condition(driver) to return something truthy and returns it.
+        # Required waits raise TimeoutException after the full timeout; optional
+        # ones return None after the learned budget.
+        if timeout is None:
+            timeout = self.budget(page_type) if optional else self.default_timeout
+        started = time.perf_counter()
+        try:
+            result = WebDriverWait(driver, timeout, poll_frequency=WAIT_POLL_FREQUENCY).until(condition)
+        except TimeoutException:
+            self._record(page_type, time.perf_counter() - started, timed_out=True)
+            if optional:
+                return None
+            raise
+        self._record(page_type, time.perf_counter() - started, timed_out=False)
+        return result
+
+    def report(self):
+        with self._lock:
+            page_types = sorted(self._waits)
+        if not page_types:
+            return
+        print(f"{'wait':>24} {'count':>6} {'mean s':>8} {'total s':>8} {'timeouts':>9} {'budget s':>9}")
+        for page_type in page_types:
+            print(f"{page_type:>24} {self._waits[page_type]:>6} "
+                  f"{self._waited[page_type] / self._waits[page_type]:>8.2f} {self._waited[page_type]:>8.1f} "
+                  f"{self._timeouts[page_type]:>9} {self.budget(page_type):>9.1f}")
+
+
+def any_of(*conditions):
+    # Truthy as soon as one of the conditions is
+    def condition(driver):
+        for candidate in conditions:
+            try:
+                result = candidate(driver)
+            except (NoSuchElementException, StaleElementReferenceException):
+                result = False
+            if result:
+                return result
+        return False
+    return condition
+
+
+def network_idle(idle_time=0.5):
+    # The document has loaded and no new resource request has started for
+    # idle_time seconds, judged from the Resource Timing entries
+    state = {'count': None, 'since': None}
+
+    def condition(driver):
+        ready_state, resource_count = driver.execute_script(
+            "return [document.readyState, performance.getEntriesByType('resource').length];")
+        now = time.perf_counter()
+        if ready_state == 'loading' or resource_count != state['count']:
+            state['count'], state['since'] = resource_count, now
+            return False
+        return now - state['since'] >= idle_time
+    return condition
+
+
+def element_absent(locator):
+    return lambda driver: not driver.find_elements(*locator)
+
+
+waits = WaitEngine()
+
+
+BROWSER_PROFILE = 'default'
+CHROME_CACHE_DIR = os.path.join('.naukri_cache', 'chrome')
+# URL patterns the fast profile never downloads: images, media, fonts and third-party ad/analytics hosts
+FAST_PROFILE_BLOCKED_URLS = [
+    '*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico', '*.bmp',
+    '*.mp4', '*.webm', '*.mp3', '*.m3u8',
+    '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot',
+    '*doubleclick.net*', '*googlesyndication.com*', '*googletagmanager.com*', '*google-analytics.com*',
+    '*googleadservices.com*', '*facebook.net*', '*connect.facebook.com*', '*hotjar.com*', '*clarity.ms*',
+    '*taboola.com*', '*criteo.com*', '*amazon-adsystem.com*', '*moengage.com*', '*bing.com/bat*',
+]
+
+
+def configure_driver(profile=None, blocked_urls=None, cache_name='main'):
+    # cache_name picks the disk cache directory of the fast profile; browsers
+    # running at the same time need different names
+    profile = profile or BROWSER_PROFILE
     options = webdriver.ChromeOptions()
     # Uncomment options below if needed
     # options.add_argument('--window-size=800,600')
@@ -24,37 +612,59 @@ def configure_driver():
     # options.add_argument('--disable-gpu')
     # options.add_argument('--disable-infobars')
     # options.add_argument('--disable-extensions')
-    return webdriver.Chrome(options=options)
+    if profile == 'fast':
+        options.add_argument('--headless=new')
+        options.add_argument('--window-size=1366,768')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--disable-extensions')
+        # Each browser of a run gets its own cache directory, reused by the same browser next run
+        cache_dir = os.path.abspath(os.path.join(CHROME_CACHE_DIR, f'chrome-{cache_name}'))
+        options.add_argument(f'--disk-cache-dir={cache_dir}')
+        # Hand the page over once the DOM is ready instead of waiting for every subresource
+        options.page_load_strategy = 'eager'
+        options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+    elif profile != 'default':
+        raise ValueError(f"Unknown browser profile: {profile}")
+    driver = webdriver.Chrome(options=options)
+    if profile == 'fast':
+        block_heavy_resources(driver, FAST_PROFILE_BLOCKED_URLS if blocked_urls is None else blocked_urls)
+    return driver
+
+
+def block_heavy_resources(driver, blocked_urls):
+    # Requests matching blocked_urls fail inside the browser before they reach the network
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': list(blocked_urls)})
+    # Headless Chrome announces itself in the user agent; present the regular one
+    user_agent = driver.execute_script("return navigator.userAgent").replace('HeadlessChrome', 'Chrome')
+    driver.execute_cdp_cmd('Network.setUserAgentOverride', {'userAgent': user_agent})
 
 
 def login(driver, job_portal_url, username, password):
     print("start login")
     if job_portal_url is not None:
-        driver.get(job_portal_url)
+        load_page(driver, job_portal_url)
         try:
-            # Log in process with retries
+            # Log in process with retries, backing off before each reload
             for attempt in range(3):
                 try:
-                    WebDriverWait(driver, 30).until(
-                        EC.element_to_be_clickable((By.ID, 'login_Layer'))
-                    ).click()
+                    waits.until(driver, 'login', EC.element_to_be_clickable((By.ID, 'login_Layer'))).click()
                     break
                 except (TimeoutException, ElementClickInterceptedException):
                     print(f"Attempt {attempt + 1}: Login button click failed, retrying...")
-                    driver.refresh()
+                    time.sleep(governor.backoff_delay(attempt))
+                    reload_page(driver)
                     continue
 
             # Wait for email input and enter username
-            email_input = WebDriverWait(driver, 30).until(
-                EC.visibility_of_element_located(
+            email_input = waits.until(driver, 'login', EC.visibility_of_element_located(
                     (By.XPATH, "//label[contains(text(), 'Email ID / Username')]/following-sibling::input"))
             )
             email_input.clear()
             email_input.send_keys(username)
 
             # Wait for password input and enter password
-            password_input = WebDriverWait(driver, 30).until(
-                EC.visibility_of_element_located(
+            password_input = waits.until(driver, 'login', EC.visibility_of_element_located(
                     (By.XPATH, "//label[contains(text(), 'Password')]/following-sibling::input"))
             )
             password_input.clear()
@@ -62,13 +672,15 @@ def login(driver, job_portal_url, username, password):
 
             # Click login button
             login_button = driver.find_element(By.XPATH, "//button[contains(text(), 'Login')]")
-            WebDriverWait(driver, 30).until(EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Login')]")))
+            waits.until(driver, 'login', EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Login')]")))
             login_button.click()
 
-            # Wait for the login to complete
-            #time.sleep(2)  # Give some time for login to fully complete
-            print("Login successful")
-            time.sleep(5)
+            # Wait for the login to complete: the login button is gone and the redirects have settled
+            if waits.until(driver, 'login-complete', EC.all_of(element_absent((By.ID, 'login_Layer')), network_idle()),
+                           optional=True):
+                print("Login successful")
+            else:
+                print("Login not confirmed by the page, continuing")
         except TimeoutException as e:
             print("Login timeout error:", e)
             sys.exit(1)
@@ -80,57 +692,502 @@ def login(driver, job_portal_url, username, password):
             sys.exit(1)
 
 
-def search_jobs(driver, jobs_urls):
-    print("start search")
-    all_job_links = []
-    for counter, jobs_url in enumerate(jobs_urls, start=1):
+SESSION_CACHE_PATH = os.path.join('.naukri_cache', 'session.bin')
+SESSION_KDF_ITERATIONS = 390000
+# Only rendered in the header of a logged-in page
+LOGGED_IN_MARKER = (By.CLASS_NAME, 'nI-gNb-drawer__icon')
+
+
+class SessionManager:
+    # Saves the cookies and local storage of a logged-in browser to a file
+    # encrypted with a key derived from the login credentials, and restores them
+    # into new browsers so the login flow only runs when the session expired.
+
+    def __init__(self, job_portal_url, username, password, path=SESSION_CACHE_PATH):
+        self.job_portal_url = job_portal_url
+        self.username = username
+        self.password = password
+        self.path = path
+
+    def _fernet(self, salt):
+        from cryptography.fernet import Fernet
+        key = hashlib.pbkdf2_hmac('sha256', f"{self.username}:{self.password}".encode('utf-8'), salt,
+                                  SESSION_KDF_ITERATIONS)
+        return Fernet(base64.urlsafe_b64encode(key))
+
+    def save(self, driver):
+        try:
+            session = {
+                'saved_at': time.time(),
+                'cookies': driver.get_cookies(),
+                'local_storage': driver.execute_script("return Object.assign({}, window.localStorage);"),
+            }
+            salt = os.urandom(16)
+            token = self._fernet(salt).encrypt(json.dumps(session).encode('utf-8'))
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            temp_path = self.path + '.tmp'
+            with open(temp_path, mode='wb') as file:
+                file.write(salt + token)
+            os.chmod(temp_path, 0o600)
+            os.replace(temp_path, self.path)
+            print(f"Login session saved to {self.path}")
+        except ImportError:
+            print("cryptography is not installed, login session not saved")
+        except Exception as e:
+            print(f"Error while saving login session: {e}")
+
+    def load(self):
+        # Returns the saved session, or None when there is none, it cannot be
+        # decrypted with these credentials, or every cookie in it has expired
+        if not os.path.exists(self.path):
+            return None
         try:
-            # Open each pre-configured jobs URL
-            if jobs_url is not None:
-                driver.get(jobs_url)
-                print(f"Jobs page loaded successfully for URL: {jobs_url}")
-                print(f"Page {counter} loaded")
-                time.sleep(1)
-                job_links = collection(driver)
-                all_job_links.extend(job_links)
-                time.sleep(2)
+            with open(self.path, mode='rb') as file:
+                data = file.read()
+            session = json.loads(self._fernet(data[:16]).decrypt(data[16:]))
+        except ImportError:
+            print("cryptography is not installed, ignoring the saved login session")
+            return None
         except Exception as e:
-            print(f"Error while navigating to jobs page {jobs_url}:", e)
-    print("All collected job links:", all_job_links)
+            print(f"Saved login session is unreadable, logging in again: {e!r}")
+            return None
+        now = time.time()
+        if not any(cookie.get('expiry') is None or cookie['expiry'] > now for cookie in session['cookies']):
+            print("Saved login session has expired")
+            return None
+        return session
+
+    def restore(self, driver, session):
+        # Loads the portal once with the saved state and reports whether it is logged in
+        load_page(driver, self.job_portal_url)
+        now = time.time()
+        for cookie in session['cookies']:
+            if cookie.get('expiry') is not None and cookie['expiry'] <= now:
+                continue
+            try:
+                driver.add_cookie(cookie)
+            except WebDriverException as e:
+                print(f"Could not restore cookie {cookie.get('name')}: {e}")
+        if session.get('local_storage'):
+            driver.execute_script(
+                "for (const [key, value] of Object.entries(arguments[0])) { window.localStorage.setItem(key, value); }",
+                session['local_storage'])
+        reload_page(driver)
+        return self.is_logged_in(driver)
+
+    @staticmethod
+    def is_logged_in(driver):
+        # Waits for whichever renders first: the logged-in header, or the
+        # login_Layer button that is only shown to visitors who are not logged in
+        marker = waits.until(driver, 'session-restore', any_of(
+            EC.presence_of_element_located(LOGGED_IN_MARKER),
+            EC.presence_of_element_located((By.ID, 'login_Layer'))), optional=True)
+        return bool(marker) and marker.get_attribute('id') != 'login_Layer'
+
+    def ensure_login(self, driver):
+        session = self.load()
+        if session is not None:
+            if self.restore(driver, session):
+                print("Restored saved login session")
+                return
+            print("Saved login session is no longer valid, logging in again")
+        login(driver, self.job_portal_url, self.username, self.password)
+        self.save(driver)
+
+
+DRIVER_POOL_SIZE = 1
+DRIVER_POOL_MAX_RESTARTS = 3
+
+
+def export_session_cookies(driver):
+    return driver.get_cookies()
+
+
+def import_session_cookies(driver, job_portal_url, cookies):
+    # Cookies can only be set for the domain that is currently loaded
+    load_page(driver, job_portal_url)
+    for cookie in cookies:
+        try:
+            driver.add_cookie(cookie)
+        except WebDriverException as e:
+            print(f"Could not copy cookie {cookie.get('name')}: {e}")
+    reload_page(driver)
+
+
+class DriverPool:
+    # A fixed set of logged-in browsers that work through a queue of pages.
+    # Each worker thread owns one driver; a driver that dies is replaced and
+    # the page it was working on is retried on the new one.
+
+    def __init__(self, size, job_portal_url, cookies=None, credentials=None, driver_factory=None,
+                 max_restarts=DRIVER_POOL_MAX_RESTARTS, name='pool'):
+        self.size = size
+        self.job_portal_url = job_portal_url
+        self.cookies = cookies
+        self.credentials = credentials
+        self.driver_factory = driver_factory
+        # Each slot keeps its browser cache directory across restarts and runs
+        self.name = name
+        self.max_restarts = max_restarts
+        self.drivers = [None] * size
+        self.restarts = [0] * size
+
+    def _start_driver(self, slot):
+        if self.driver_factory is None:
+            driver = configure_driver(cache_name=f"{self.name}-{slot}")
+        else:
+            driver = self.driver_factory()
+        if self.cookies is not None:
+            import_session_cookies(driver, self.job_portal_url, self.cookies)
+        elif self.credentials is not None:
+            login(driver, self.job_portal_url, *self.credentials)
+        self.drivers[slot] = driver
+        return driver
+
+    def _get_driver(self, slot):
+        return self.drivers[slot] or self._start_driver(slot)
+
+    def _restart_driver(self, slot):
+        self.restarts[slot] += 1
+        print(f"Restarting pool driver {slot} (restart {self.restarts[slot]})")
+        self._quit_driver(slot)
+        return self._start_driver(slot)
+
+    def _quit_driver(self, slot):
+        driver = self.drivers[slot]
+        self.drivers[slot] = None
+        if driver is not None:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+
+    @staticmethod
+    def _is_alive(driver):
+        try:
+            driver.current_url
+            return True
+        except WebDriverException:
+            return False
+
+    def run(self, slot, task, item, error_message="Error while visiting"):
+        # Runs task(driver, item) on the driver in slot, restarting a crashed
+        # driver and retrying. Returns None when the task failed; raises when the
+        # driver is dead and the slot used up its restarts, or no working driver
+        # can be started for the slot.
+        driver = self._get_driver(slot)
+        while True:
+            try:
+                return task(driver, item)
+            except Exception as e:
+                print(f"{error_message} {item}:", e)
+                if not isinstance(e, WebDriverException) or self._is_alive(driver):
+                    return None
+                if self.restarts[slot] >= self.max_restarts:
+                    raise
+                driver = self._restart_driver(slot)
+
+    def _worker(self, slot, work_queue, results, task, error_message, dead_slots):
+        while True:
+            try:
+                index, item = work_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = self.run(slot, task, item, error_message)
+            except Exception as e:
+                print(f"Pool driver {slot} is unavailable: {e}")
+                # Leave the page to the other workers
+                dead_slots.add(slot)
+                work_queue.put((index, item))
+                return
+
+    def run_workers(self, worker, work_queue, slots):
+        # Runs worker(slot, dead_slots) in a thread per slot until the queue is
+        # empty. A slot that gives up puts its item back, possibly after the
+        # others found the queue empty and left, so the live slots go again
+        # until nothing is left or no slot is.
+        dead_slots = set()
+        while True:
+            live_slots = [slot for slot in slots if slot not in dead_slots]
+            if work_queue.empty() or not live_slots:
+                break
+            workers = [threading.Thread(target=worker, args=(slot, dead_slots), daemon=True) for slot in live_slots]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+        if not work_queue.empty():
+            print(f"{work_queue.qsize()} items left undone, no pool driver is available")
+
+    def map(self, task, items, concurrency=None, error_message="Error while visiting"):
+        # Runs task(driver, item) for every item and returns the results in item
+        # order; items whose task failed get None
+        items = list(items)
+        results = [None] * len(items)
+        if not items:
+            return results
+        work_queue = queue.Queue()
+        for index, item in enumerate(items):
+            work_queue.put((index, item))
+        worker_count = min(concurrency or self.size, self.size, len(items))
+        self.run_workers(lambda slot, dead_slots: self._worker(slot, work_queue, results, task, error_message,
+                                                               dead_slots),
+                         work_queue, range(worker_count))
+        return results
+
+    def close(self):
+        for slot in range(self.size):
+            self._quit_driver(slot)
+
+
+def visit_pages(driver, items, task, pool=None, error_message="Error while visiting"):
+    # Runs task(driver, item) for every item, through the pool when there is one
+    if pool is not None:
+        return pool.map(task, items, error_message=error_message)
+    results = []
+    for item in items:
+        try:
+            results.append(task(driver, item))
+        except Exception as e:
+            print(f"{error_message} {item}:", e)
+            results.append(None)
+    return results
+
+
+SEARCH_MAX_PAGES = 5
+SEARCH_PAGE_CONCURRENCY = 3
+_SEARCH_PAGE_SUFFIX = re.compile(r'(?<=-jobs)-(\d+)$')
+
+
+def search_query_url(query, job_portal_url='https://www.naukri.com'):
+    # 'senior data engineer' -> https://www.naukri.com/senior-data-engineer-jobs?k=senior+data+engineer
+    slug = '-'.join(re.findall(r'[a-z0-9]+', query.lower()))
+    return f"{job_portal_url.rstrip('/')}/{slug}-jobs?k={quote_plus(query)}"
+
+
+def search_page_url(jobs_url, page_number):
+    # Page N of a search lives at .../<slug>-jobs-N with the same query string
+    parts = urlparse(jobs_url)
+    path = _SEARCH_PAGE_SUFFIX.sub('', parts.path)
+    if page_number > 1:
+        path = f"{path}-{page_number}"
+    return urlunparse(parts._replace(path=path))
+
+
+def search_start_page(jobs_url):
+    match = _SEARCH_PAGE_SUFFIX.search(urlparse(jobs_url).path)
+    return int(match.group(1)) if match else 1
+
+
+def iter_search_pages(driver, jobs_url, pool=None, max_pages=SEARCH_MAX_PAGES, concurrency=SEARCH_PAGE_CONCURRENCY,
+                      seen_job_ids=None):
+    # Yields the new job links of each results page of a search, starting at
+    # the page jobs_url points to. With a pool, up to `concurrency` pages are
+    # loaded at once. Stops at the first page without job tuples or with only
+    # job IDs this search has seen already (the portal repeats its last page),
+    # or after max_pages. seen_job_ids, shared between searches, only keeps
+    # jobs another search yielded out of the output.
+    seen_job_ids = set() if seen_job_ids is None else seen_job_ids
+    search_job_ids = set()
+    batch_size = max(1, min(concurrency, pool.size)) if pool is not None else 1
+    first_page = search_start_page(jobs_url)
+    last_page = first_page + max_pages - 1
+    page_number = first_page
+    while page_number <= last_page:
+        page_numbers = list(range(page_number, min(last_page, page_number + batch_size - 1) + 1))
+        page_urls = [search_page_url(jobs_url, number) for number in page_numbers]
+        results = visit_pages(driver, page_urls, _collect_search_page, pool,
+                              error_message="Error while navigating to jobs page")
+        for number, page_url, page_jobs in zip(page_numbers, page_urls, results):
+            if page_jobs is None:
+                # Failed pages are skipped, they say nothing about where the results end
+                continue
+            page_job_ids = {job_id for job_id, _ in page_jobs}
+            if not page_job_ids - search_job_ids:
+                reason = 'has no job tuples' if not page_jobs else 'only repeats jobs already seen'
+                print(f"Stopping pagination at page {number}, {page_url} {reason}")
+                return
+            search_job_ids |= page_job_ids
+            job_links = []
+            for job_id, job_link in page_jobs:
+                if job_id not in seen_job_ids:
+                    seen_job_ids.add(job_id)
+                    job_links.append(job_link)
+            print(f"Page {number}: {len(job_links)} new jobs of {len(page_jobs)}")
+            if job_links:
+                yield job_links
+        page_number += len(page_numbers)
+
+
+@timed('search_jobs')
+def search_jobs(driver, jobs_urls, pool=None, max_pages=SEARCH_MAX_PAGES, concurrency=SEARCH_PAGE_CONCURRENCY):
+    print("start search")
+    all_job_links = []
+    # Job IDs are shared between the searches so overlapping ones only add new jobs
+    seen_job_ids = set()
+    for jobs_url in jobs_urls:
+        if jobs_url is None:
+            continue
+        for job_links in iter_search_pages(driver, jobs_url, pool, max_pages, concurrency, seen_job_ids):
+            all_job_links.extend(job_links)
+    logger.debug("All collected job links: %s", all_job_links)
     return all_job_links
 
 
-def collection(driver):
-    print("Collecting data from the page...")
+@timed('search_page')
+def _collect_search_page(driver, jobs_url):
+    # (job ID, job link) pairs of one page of a paginated search. The page may
+    # be past the end of the results, so its tuples are only waited for up to
+    # the learned budget.
+    load_page(driver, jobs_url)
+    logger.info("Jobs page loaded successfully for URL: %s", jobs_url)
+    return collection(driver, with_job_ids=True, optional=True)
+
+
+JOB_TUPLE_CLASS = 'srp-jobtuple-wrapper'
+_VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+              'track', 'wbr'}
+
+
+class ElementStackParser(HTMLParser):
+    # Keeps the stack of open elements of a page, each with the role the
+    # subclass gave it in start_element, and calls close_element as elements
+    # close. Void tags never open, and a stray end tag cannot unbalance the stack.
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._stack = []  # (tag, role) for every open element
+
+    def _in_role(self, role):
+        return any(open_role == role for _, open_role in self._stack)
+
+    def start_element(self, tag, attrs, classes):
+        # Returns the role of the new element, None for none
+        return None
+
+    def close_element(self, tag, role):
+        pass
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        role = self.start_element(tag, attrs, (attrs.get('class') or '').split())
+        if tag not in _VOID_TAGS:
+            self._stack.append((tag, role))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        # Pop up to the matching open tag
+        if not any(open_tag == tag for open_tag, _ in self._stack):
+            return
+        while self._stack:
+            open_tag, role = self._stack.pop()
+            self.close_element(open_tag, role)
+            if open_tag == tag:
+                break
+
+
+class JobTupleParser(ElementStackParser):
+    # Pulls every srp-jobtuple-wrapper out of a results page in one pass:
+    # data-job-id, the title link (text and href) and the comp-name element
+    # inside comp-dtls-wrap (text and href).
+
+    def __init__(self):
+        super().__init__()
+        self.jobs = []
+        self._job = None
+        self._title_text = []
+        self._company_text = []
+
+    def start_element(self, tag, attrs, classes):
+        role = None
+        if JOB_TUPLE_CLASS in classes:
+            role = 'tuple'
+            self._job = {'job_id': attrs.get('data-job-id'), 'job_position': None, 'job_href': None,
+                         'company_name': None, 'company_href': None}
+            self._title_text = []
+            self._company_text = []
+        elif self._job is not None:
+            if tag == 'a' and 'title' in classes and self._job['job_href'] is None:
+                role = 'title'
+                self._job['job_href'] = attrs.get('href')
+            elif 'comp-dtls-wrap' in classes:
+                role = 'comp_wrap'
+            elif 'comp-name' in classes and self._in_role('comp_wrap') and self._job['company_name'] is None:
+                role = 'comp_name'
+                self._job['company_href'] = attrs.get('href')
+        return role
+
+    def handle_data(self, data):
+        if self._job is None:
+            return
+        if self._in_role('title'):
+            self._title_text.append(data)
+        elif self._in_role('comp_name'):
+            self._company_text.append(data)
+
+    def close_element(self, tag, role):
+        if role == 'title':
+            self._job['job_position'] = ' '.join(''.join(self._title_text).split())
+        elif role == 'comp_name':
+            self._job['company_name'] = ' '.join(''.join(self._company_text).split())
+        elif role == 'tuple':
+            self.jobs.append(self._job)
+            self._job = None
+
+
+@timed('parse_job_tuples')
+def parse_job_tuples(html, base_url=None):
+    # Returns one dict per job tuple on a search results or company page;
+    # relative links are resolved against base_url when it is given
+    parser = JobTupleParser()
+    parser.feed(html)
+    parser.close()
+    if base_url:
+        _resolve_job_links(parser.jobs, base_url)
+    return parser.jobs
+
+
+def _resolve_job_links(jobs, base_url):
+    for job in jobs:
+        for key in ('job_href', 'company_href'):
+            if job[key]:
+                job[key] = urljoin(base_url, job[key])
+
+
+def _read_job_tuples(driver, page_type, optional=False):
+    # One wait plus one page_source round trip instead of several WebDriver calls per tuple
+    waits.until(driver, page_type, EC.presence_of_all_elements_located((By.CLASS_NAME, JOB_TUPLE_CLASS)),
+                optional=optional)
+    jobs = parse_job_tuples(driver.page_source)
+    if any(job[key] and not urlparse(job[key]).scheme for job in jobs for key in ('job_href', 'company_href')):
+        # get_attribute('href') used to return absolute links, so resolve the relative ones
+        _resolve_job_links(jobs, driver.current_url)
+    return jobs
+
+
+@timed('collection')
+def collection(driver, with_job_ids=False, optional=False):
+    # (company, position, job link, company link) tuples of the results page,
+    # or (job ID, tuple) pairs with_job_ids; the job link stands in for a missing ID
+    logger.info("Collecting data from the page...")
     job_links = []
     try:
-        # Wait for job elements to be present
-        WebDriverWait(driver, 30).until(
-            EC.presence_of_all_elements_located((By.CLASS_NAME, 'srp-jobtuple-wrapper'))
-        )
-        # Find all job elements by class name 'srp-jobtuple-wrapper'
-        job_elements = driver.find_elements(By.CLASS_NAME, 'srp-jobtuple-wrapper')
-        print("element start")
-        for counter, job_element in enumerate(job_elements, start=0):
-            print(job_element)
-            print(f"element counter:{counter} ")
-            job_id = job_element.get_attribute('data-job-id')
-            job_details = job_element.find_element(By.CLASS_NAME, 'cust-job-tuple.layout-wrapper.lay-2.sjw__tuple ')
-            # Extract data from row1
-            row1 = job_details.find_element(By.CLASS_NAME, 'row1')
-            job_title_element = row1.find_element(By.XPATH, ".//a[@class='title ']")
-            job_href = job_title_element.get_attribute('href')
-            job_position = job_title_element.text
-            # Extract data from row2
-            row2 = job_details.find_element(By.CLASS_NAME, 'row2')
-            company_details = row2.find_element(By.CLASS_NAME, 'comp-dtls-wrap')
-            company_name_element = company_details.find_element(By.CLASS_NAME, 'comp-name')
-            company_name = company_name_element.text
-            company_href = company_name_element.get_attribute('href')
-            job_links.append((company_name, job_position, job_href, company_href))
-            print(f"Company: {company_name}, Job Position: {job_position}, Job Link: {job_href}, Company Link: {company_href}")
-        print("element END")
+        jobs = _read_job_tuples(driver, 'search-results', optional=optional)
+        for counter, job in enumerate(jobs, start=0):
+            if not job['job_href'] or job['company_name'] is None:
+                logger.debug("element counter:%d is missing the title or company, skipping it", counter)
+                continue
+            job_link = (job['company_name'], job['job_position'], job['job_href'], job['company_href'])
+            job_links.append((job['job_id'] or job['job_href'], job_link) if with_job_ids else job_link)
+            logger.debug("Company: %s, Job Position: %s, Job Link: %s, Company Link: %s",
+                         job['company_name'], job['job_position'], job['job_href'], job['company_href'])
     except NoSuchElementException as e:
+        metrics.error('collection')
         print("Error while collecting job data:", e)
     return job_links
 
@@ -157,249 +1214,1664 @@ def write_company_jobs_to_csv(company_job_links):
     print(f"Company job links written to {csv_filename}")
 
 
-def navigate_to_company_sites(driver, csv_filename):
+JOB_STORE_PATH = 'naukri_jobs.db'
+COMPANY_RECHECK_AFTER = timedelta(hours=20)
+APPLY_TYPE_RECHECK_AFTER = timedelta(days=3)
+SCORE_RECHECK_AFTER = None  # scores only change with the model or keywords
+# Search results seen this recently belong to the current run. Each subcommand
+# runs in its own process, so `expand` after `scrape` finds the scraped jobs this way.
+CURRENT_RUN_WINDOW = timedelta(hours=20)
+
+
+def _timestamp(moment=None):
+    return (moment or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def job_list_fingerprint(job_urls):
+    # Order-independent digest of a company's job list, to tell an unchanged page from a changed one
+    return hashlib.sha1('\n'.join(sorted(set(job_urls))).encode('utf-8')).hexdigest()
+
+
+def _stale_before(recheck_after):
+    # Rows last handled before this timestamp are handled again; None never goes stale
+    if recheck_after is None:
+        return ''
+    return _timestamp(datetime.now() - recheck_after)
+
+
+class JobStore:
+    # Local SQLite store of every job seen, keyed by job URL. Each stage reads
+    # only the rows it has not handled yet (or handled too long ago) and writes
+    # its results back with a timestamp, so a daily run only pays for new jobs.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_url TEXT PRIMARY KEY,
+            company_name TEXT,
+            job_position TEXT,
+            company_url TEXT,
+            from_search INTEGER NOT NULL DEFAULT 0,
+            from_company INTEGER NOT NULL DEFAULT 0,
+            first_seen TEXT NOT NULL,
+            last_seen TEXT NOT NULL,
+            apply_type TEXT,
+            apply_type_checked_at TEXT,
+            genai_score REAL,
+            data_score REAL,
+            fit_score REAL,
+            scored_at TEXT,
+            apply_status TEXT,
+            applied_at TEXT,
+            job_description TEXT,
+            prefilter_cutoff REAL,
+            match_text_changed_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_company_url ON jobs (company_url);
+        CREATE INDEX IF NOT EXISTS idx_jobs_last_seen ON jobs (last_seen);
+        CREATE INDEX IF NOT EXISTS idx_jobs_apply ON jobs (from_search, apply_type_checked_at);
+        CREATE INDEX IF NOT EXISTS idx_jobs_scored ON jobs (from_company, scored_at);
+        CREATE TABLE IF NOT EXISTS companies (
+            company_url TEXT PRIMARY KEY,
+            expanded_at TEXT NOT NULL,
+            job_urls TEXT,
+            fingerprint TEXT
+        );
+    """
+    # Columns added after the first release, for stores created before them
+    MIGRATIONS = [
+        ('companies', 'job_urls', 'TEXT'),
+        ('companies', 'fingerprint', 'TEXT'),
+        ('jobs', 'job_description', 'TEXT'),
+        ('jobs', 'prefilter_cutoff', 'REAL'),
+        ('jobs', 'match_text_changed_at', 'TEXT'),
+    ]
+    # Indexes on migrated columns, created once the columns exist
+    INDEXES = """
+        CREATE INDEX IF NOT EXISTS idx_jobs_match_text_changed ON jobs (match_text_changed_at);
+    """
+
+    def __init__(self, path=JOB_STORE_PATH, seen_since=None):
+        # seen_since is a '%Y-%m-%d %H:%M:%S' timestamp, or a prefix of one such as a date
+        self.path = path
+        # The streaming pipeline calls in from several threads, so every access takes the lock
+        self._lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(self.SCHEMA)
+        self._migrate()
+        self.connection.executescript(self.INDEXES)
+        self.seen_since = seen_since or _stale_before(CURRENT_RUN_WINDOW)
+
+    def _migrate(self):
+        for table, column, column_type in self.MIGRATIONS:
+            columns = {row['name'] for row in self._rows(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                with self.connection:
+                    self.connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+                    if (table, column) == ('jobs', 'prefilter_cutoff'):
+                        # Rows the cascade dropped used to be stamped as scored without scores
+                        self.connection.execute("UPDATE jobs SET scored_at = NULL WHERE fit_score IS NULL")
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def _rows(self, query, parameters=()):
+        with self._lock:
+            return [dict(row) for row in self.connection.execute(query, parameters)]
+
+    def _write(self, query, parameter_rows):
+        with self._lock, self.connection:
+            self.connection.executemany(query, parameter_rows)
+
+    def _select_job_urls(self, job_urls, condition='1', parameters=()):
+        # The subset of job_urls stored with rows matching condition
+        selected = set()
+        job_urls = list(job_urls)
+        for start in range(0, len(job_urls), 500):
+            chunk = job_urls[start:start + 500]
+            placeholders = ','.join('?' * len(chunk))
+            selected.update(row['job_url'] for row in self._rows(
+                f"SELECT job_url FROM jobs WHERE job_url IN ({placeholders}) AND {condition}",
+                tuple(chunk) + tuple(parameters)))
+        return selected
+
+    def add_search_jobs(self, job_links):
+        # job_links are (company_name, job_position, job_url, company_url) tuples
+        return self._upsert_jobs([(company_name, job_position, job_url, company_url, 1, 0)
+                                  for company_name, job_position, job_url, company_url in job_links])
+
+    def add_company_jobs(self, company_job_links):
+        # company_job_links are (company_name, job_position, job_url) tuples
+        return self._upsert_jobs([(company_name, job_position, job_url, None, 0, 1)
+                                  for company_name, job_position, job_url in company_job_links])
+
+    def _upsert_jobs(self, rows):
+        now = _timestamp()
+        known = self._select_job_urls([row[2] for row in rows])
+        self._write("""
+                INSERT INTO jobs (company_name, job_position, job_url, company_url, from_search, from_company,
+                                  first_seen, last_seen, match_text_changed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (job_url) DO UPDATE SET
+                    match_text_changed_at = CASE
+                        WHEN jobs.company_name IS NOT excluded.company_name
+                          OR jobs.job_position IS NOT excluded.job_position
+                        THEN excluded.match_text_changed_at ELSE jobs.match_text_changed_at END,
+                    company_name = excluded.company_name,
+                    job_position = excluded.job_position,
+                    company_url = COALESCE(excluded.company_url, jobs.company_url),
+                    from_search = MAX(jobs.from_search, excluded.from_search),
+                    from_company = MAX(jobs.from_company, excluded.from_company),
+                    last_seen = excluded.last_seen
+            """, [row + (now, now, now) for row in rows if row[2]])
+        new_urls = {row[2] for row in rows if row[2]} - known
+        print(f"Job store: {len(new_urls)} new jobs, {len(rows) - len(new_urls)} already known")
+        return len(new_urls)
+
+    def companies_to_expand(self, recheck_after=COMPANY_RECHECK_AFTER):
+        # Companies of search results of the current run that were not expanded recently
+        return [row['company_url'] for row in self._rows("""
+            SELECT DISTINCT jobs.company_url FROM jobs
+            LEFT JOIN companies ON companies.company_url = jobs.company_url
+            WHERE jobs.from_search = 1 AND jobs.company_url IS NOT NULL AND jobs.last_seen >= ?
+              AND (companies.expanded_at IS NULL OR companies.expanded_at < ?)
+        """, (self.seen_since, _stale_before(recheck_after)))]
+
+    def fresh_companies(self, recheck_after=COMPANY_RECHECK_AFTER):
+        # Companies of search results of the current run that were expanded recently,
+        # with the job URLs cached at that expansion
+        return {row['company_url']: json.loads(row['job_urls'] or '[]') for row in self._rows("""
+            SELECT DISTINCT companies.company_url, companies.job_urls FROM jobs
+            JOIN companies ON companies.company_url = jobs.company_url
+            WHERE jobs.from_search = 1 AND jobs.last_seen >= ? AND companies.expanded_at >= ?
+        """, (self.seen_since, _stale_before(recheck_after)))}
+
+    def company_needs_expansion(self, company_url, recheck_after=COMPANY_RECHECK_AFTER):
+        rows = self._rows("SELECT expanded_at FROM companies WHERE company_url = ?", (company_url,))
+        return not rows or rows[0]['expanded_at'] < _stale_before(recheck_after)
+
+    def cached_company_job_urls(self, company_url):
+        rows = self._rows("SELECT job_urls FROM companies WHERE company_url = ?", (company_url,))
+        return json.loads(rows[0]['job_urls'] or '[]') if rows else []
+
+    def company_fingerprints(self, company_urls):
+        fingerprints = {}
+        company_urls = list(company_urls)
+        for start in range(0, len(company_urls), 500):
+            chunk = company_urls[start:start + 500]
+            fingerprints.update((row['company_url'], row['fingerprint']) for row in self._rows(
+                f"SELECT company_url, fingerprint FROM companies WHERE company_url IN ({','.join('?' * len(chunk))})",
+                tuple(chunk)))
+        return fingerprints
+
+    def record_company_jobs(self, company_job_urls):
+        # company_job_urls maps each expanded company URL to the job URLs on its page
+        now = _timestamp()
+        self._write("""
+            INSERT INTO companies (company_url, expanded_at, job_urls, fingerprint) VALUES (?, ?, ?, ?)
+            ON CONFLICT (company_url) DO UPDATE SET
+                expanded_at = excluded.expanded_at,
+                job_urls = excluded.job_urls,
+                fingerprint = excluded.fingerprint
+        """, [(company_url, now, json.dumps(job_urls), job_list_fingerprint(job_urls))
+              for company_url, job_urls in company_job_urls.items()])
+
+    def touch_jobs(self, job_urls):
+        # Marks cached jobs as seen this run without rewriting them
+        now = _timestamp()
+        self._write("UPDATE jobs SET last_seen = ? WHERE job_url = ?", [(now, job_url) for job_url in job_urls])
+
+    @staticmethod
+    def _unscored_condition(recheck_after, lexical_cutoff):
+        # Rows the cascade dropped at some cutoff stay unscored; a cascade run at
+        # that cutoff or a higher one skips them, a lower cutoff or a run without
+        # the cascade looks at them again
+        condition = "(scored_at IS NULL OR scored_at < ?)"
+        params = (_stale_before(recheck_after),)
+        if lexical_cutoff is not None:
+            condition += " AND (prefilter_cutoff IS NULL OR prefilter_cutoff > ?)"
+            params += (lexical_cutoff,)
+        return condition, params
+
+    def lead_jobs(self, recheck_after=SCORE_RECHECK_AFTER, only_unscored=True, lexical_cutoff=None):
+        # Company-page jobs with 'lead' in the title, keyed like the old LEAD CSV
+        query = """
+            SELECT company_name AS "Company Name", job_position AS "Job Position", job_url AS "Company Job URL"
+            FROM jobs WHERE from_company = 1 AND instr(lower(job_position), 'lead') > 0
+        """
+        if not only_unscored:
+            return self._rows(query)
+        condition, params = self._unscored_condition(recheck_after, lexical_cutoff)
+        return self._rows(query + " AND " + condition, params)
+
+    def record_scores(self, scored_rows, prefiltered_rows=(), lexical_cutoff=None):
+        # prefiltered_rows fell under lexical_cutoff in the cascade and have no model scores
+        now = _timestamp()
+        self._write("""
+            UPDATE jobs SET genai_score = ?, data_score = ?, fit_score = ?, scored_at = ?, prefilter_cutoff = NULL
+            WHERE job_url = ?
+        """, [(row['GenAI Score'], row['Data Score'], row['Fit Score'], now, row['Company Job URL'])
+              for row in scored_rows])
+        self._write("UPDATE jobs SET prefilter_cutoff = ? WHERE job_url = ?",
+                    [(lexical_cutoff, row['Company Job URL']) for row in prefiltered_rows])
+
+    def unscored_job_urls(self, job_urls, recheck_after=SCORE_RECHECK_AFTER, lexical_cutoff=None):
+        return self._select_job_urls(job_urls, *self._unscored_condition(recheck_after, lexical_cutoff))
+
+    def ranked_lead_jobs(self):
+        # Scored jobs of the current run, whether scored now or reused from an earlier run
+        return self._rows("""
+            SELECT company_name AS "Company Name", job_position AS "Job Position", job_url AS "Company Job URL",
+                   genai_score AS "GenAI Score", data_score AS "Data Score", fit_score AS "Fit Score"
+            FROM jobs WHERE fit_score IS NOT NULL AND last_seen >= ? ORDER BY fit_score DESC
+        """, (self.seen_since,))
+
+    def jobs_needing_apply_type(self, recheck_after=APPLY_TYPE_RECHECK_AFTER):
+        # Search results still listed recently, not applied to yet, whose apply type is unknown or old
+        stale_before = _stale_before(recheck_after)
+        return self._rows("""
+            SELECT company_name AS "Company Name", job_position AS "Job Position", job_url AS "Job URL"
+            FROM jobs WHERE from_search = 1 AND apply_status IS NULL AND last_seen >= ?
+              AND (apply_type_checked_at IS NULL OR apply_type_checked_at < ?)
+        """, (stale_before, stale_before))
+
+    def job_urls_needing_apply_type(self, job_urls, recheck_after=APPLY_TYPE_RECHECK_AFTER):
+        return self._select_job_urls(job_urls, "apply_status IS NULL AND (apply_type_checked_at IS NULL "
+                                               "OR apply_type_checked_at < ?)", (_stale_before(recheck_after),))
+
+    def record_apply_types(self, job_url, apply_types):
+        # A page can have several apply containers; the first recognised type wins
+        apply_type = next((apply_type for apply_type in apply_types if apply_type), '')
+        self._write("UPDATE jobs SET apply_type = ?, apply_type_checked_at = ? WHERE job_url = ?",
+                    [(apply_type, _timestamp(), job_url)])
+
+    def record_job_description(self, job_url, job_description):
+        self._write("""
+            UPDATE jobs SET job_description = ?, match_text_changed_at = ?
+            WHERE job_url = ? AND job_description IS NOT ?
+        """, [(job_description, _timestamp(), job_url, job_description)])
+
+    def jobs_for_matching(self, changed_since=None):
+        # Jobs whose title, company or description changed at or after changed_since; all jobs without it
+        query = "SELECT job_url, company_name, job_position, job_description FROM jobs"
+        if changed_since is None:
+            return self._rows(query)
+        return self._rows(query + " WHERE match_text_changed_at >= ?", (changed_since,))
+
+    def jobs_by_url(self, job_urls):
+        rows = {}
+        job_urls = list(job_urls)
+        for start in range(0, len(job_urls), 500):
+            chunk = job_urls[start:start + 500]
+            rows.update((row['job_url'], row) for row in self._rows(
+                f"SELECT * FROM jobs WHERE job_url IN ({','.join('?' * len(chunk))})", tuple(chunk)))
+        return rows
+
+    def simple_apply_jobs(self):
+        # SIMPLE APPLY jobs of the current run that were never applied to. A
+        # failed attempt is retried only once the job has been listed again
+        # since, so expired listings are not visited on every run.
+        return self._rows("""
+            SELECT company_name AS "Company Name", job_position AS "Job Position", apply_type AS "Apply Type",
+                   job_url AS "Job URL"
+            FROM jobs WHERE apply_type = 'SIMPLE APPLY' AND last_seen >= ?
+              AND (apply_status IS NULL OR (apply_status = 'FAILED' AND applied_at < last_seen))
+        """, (self.seen_since,))
+
+    def parked_apply_jobs(self):
+        # Jobs whose apply opened the chatbot and still wait for a human to answer it
+        return self._rows("""
+            SELECT company_name AS "Company Name", job_position AS "Job Position", apply_type AS "Apply Type",
+                   job_url AS "Job URL"
+            FROM jobs WHERE apply_status = 'CHAT WINDOW' ORDER BY applied_at
+        """)
+
+    def record_apply_status(self, job_url, status):
+        self._write("UPDATE jobs SET apply_status = ?, applied_at = ? WHERE job_url = ?",
+                    [(status, _timestamp(), job_url)])
+
+    def export_csvs(self):
+        # Writes the dated CSVs the stages used to hand to each other, for the jobs of the current run
+        seen_this_run = (self.seen_since,)
+        write_to_csv([(row['company_name'], row['job_position'], row['job_url'], row['company_url'])
+                      for row in self._rows("SELECT * FROM jobs WHERE from_search = 1 AND last_seen >= ?",
+                                            seen_this_run)])
+        company_rows = self._rows("SELECT * FROM jobs WHERE from_company = 1 AND last_seen >= ?", seen_this_run)
+        write_company_jobs_to_csv([(row['company_name'], row['job_position'], row['job_url'])
+                                   for row in company_rows])
+        company_job_urls = {row['job_url'] for row in company_rows}
+        write_lead_jobs_to_csv([row for row in self.lead_jobs(only_unscored=False)
+                                if row['Company Job URL'] in company_job_urls])
+        write_apply_types_to_csv(self._rows("""
+            SELECT company_name AS "Company Name", job_position AS "Job Position", apply_type AS "Apply Type",
+                   job_url AS "Job URL"
+            FROM jobs WHERE from_search = 1 AND last_seen >= ? AND apply_type_checked_at IS NOT NULL
+        """, seen_this_run))
+
+
+def write_lead_jobs_to_csv(lead_rows):
+    date_str = datetime.now().strftime('%Y-%m-%d')
+    csv_filename = f"NAUKRI_LEAD_job_links_{date_str}.csv"
+    with open(csv_filename, mode='w', newline='', encoding='ISO-8859-1') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Company Name', 'Job Position', 'Company Job URL'])
+        for row in lead_rows:
+            writer.writerow([row['Company Name'], row['Job Position'], row['Company Job URL']])
+    print(f"Filtered lead positions written to {csv_filename}")
+
+
+def write_apply_types_to_csv(apply_rows):
+    date_str = datetime.now().strftime('%Y-%m-%d')
+    csv_filename = f"NAUKRI_APPLY_0_job_links_{date_str}.csv"
+    with open(csv_filename, mode='w', newline='', encoding='ISO-8859-1') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Company Name', 'Job Position', 'Apply Type', 'Job URL'])
+        for row in apply_rows:
+            writer.writerow([row['Company Name'], row['Job Position'], row['Apply Type'], row['Job URL']])
+    print(f"Apply types written to {csv_filename}")
+
+
+HTTP_COMPANY_CONCURRENCY = 8
+
+
+@timed('navigate_to_company_sites')
+def navigate_to_company_sites(driver, store, pool=None, http=False, http_concurrency=HTTP_COMPANY_CONCURRENCY):
+    # Expands each company of this run's search results once. Companies
+    # expanded within COMPANY_RECHECK_AFTER are not visited; their cached job
+    # lists count as seen this run. Older ones are visited again (over plain
+    # HTTP first with http=True), and when their job list is unchanged the
+    # jobs are only touched instead of rewritten.
     print("Navigating to company sites...")
     all_company_job_links = []
     try:
-        with open(csv_filename, mode='r') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                company_url = row['Company URL']
-                print(f"Navigating to Company URL: {company_url}")
-                if company_url is not None:
-                    driver.get(company_url)
-                    time.sleep(2)  # Pause to allow the page to load properly
-                    company_job_links = collect_company_jobs(driver)
-                    all_company_job_links.extend(company_job_links)
-        write_company_jobs_to_csv(all_company_job_links)
-    except FileNotFoundError as e:
-        print(f"CSV file not found: {csv_filename}")
+        cached_companies = store.fresh_companies()
+        if cached_companies:
+            cached_job_urls = {job_url for job_urls in cached_companies.values() for job_url in job_urls}
+            store.touch_jobs(cached_job_urls)
+            print(f"{len(cached_companies)} companies were expanded recently, "
+                  f"reusing their {len(cached_job_urls)} cached jobs")
+
+        company_urls = store.companies_to_expand()
+        print(f"{len(company_urls)} company sites to visit")
+        if http and company_urls:
+            results = fetch_pages_over_http(company_urls, export_session_cookies(driver), _company_jobs_from_html,
+                                            user_agent=driver.execute_script("return navigator.userAgent"),
+                                            concurrency=http_concurrency, operation='company_http')
+        else:
+            results = [None] * len(company_urls)
+        # Company pages whose raw HTML had no job tuples are rendered in a browser
+        browser_indexes = [index for index, company_job_links in enumerate(results) if company_job_links is None]
+        if http:
+            print(f"Company jobs read over HTTP for {len(company_urls) - len(browser_indexes)} of "
+                  f"{len(company_urls)} companies, falling back to the browser for {len(browser_indexes)}")
+        browser_results = visit_pages(driver, [company_urls[index] for index in browser_indexes],
+                                      _collect_company_page, pool,
+                                      error_message="Error while navigating to company site")
+        for index, company_job_links in zip(browser_indexes, browser_results):
+            results[index] = company_job_links
+
+        fingerprints = store.company_fingerprints(company_urls)
+        expanded = {}
+        changed_job_links = []
+        unchanged = 0
+        for company_url, company_job_links in zip(company_urls, results):
+            # Companies whose page failed to load stay due and are retried next run
+            if company_job_links is None:
+                continue
+            job_urls = [job_url for _, _, job_url in company_job_links]
+            expanded[company_url] = job_urls
+            all_company_job_links.extend(company_job_links)
+            if fingerprints.get(company_url) == job_list_fingerprint(job_urls):
+                unchanged += 1
+                store.touch_jobs(job_urls)
+            else:
+                changed_job_links.extend(company_job_links)
+        if unchanged:
+            print(f"{unchanged} companies have the same jobs as at their last expansion")
+
+        # A job listed under several companies is kept once
+        all_company_job_links = list({job_link[2]: job_link for job_link in all_company_job_links}.values())
+        store.add_company_jobs(list({job_link[2]: job_link for job_link in changed_job_links}.values()))
+        store.record_company_jobs(expanded)
     except Exception as e:
+        metrics.error('navigate_to_company_sites')
         print(f"Error while navigating to company sites: {e}")
+    return all_company_job_links
+
+
+@timed('company_page')
+def _collect_company_page(driver, company_url):
+    logger.info("Navigating to Company URL: %s", company_url)
+    load_page(driver, company_url)
+    return collect_company_jobs(driver)
+
+
+def _company_job_links(jobs):
+    company_job_links = []
+    for counter, job in enumerate(jobs, start=0):
+        if not job['job_href'] or job['company_name'] is None:
+            logger.debug("element counter:%d is missing the title or company, skipping it", counter)
+            continue
+        company_job_links.append((job['company_name'], job['job_position'], job['job_href']))
+        logger.debug("Company: %s, Job Position: %s, Job Link: %s",
+                     job['company_name'], job['job_position'], job['job_href'])
+    return company_job_links
+
+
+def _company_jobs_from_html(html, company_url):
+    # Company jobs from a raw company page, or None when the tuples are only
+    # rendered by JavaScript and the browser has to read the page
+    jobs = parse_job_tuples(html, base_url=company_url)
+    return _company_job_links(jobs) if jobs else None
 
 
+@timed('collect_company_jobs')
 def collect_company_jobs(driver):
-    print("Collecting job data from the company page...")
+    logger.info("Collecting job data from the company page...")
     company_job_links = []
     try:
-        # Wait for job elements to be present
-        WebDriverWait(driver, 30).until(
-            EC.presence_of_all_elements_located((By.CLASS_NAME, 'srp-jobtuple-wrapper'))  # Updated class name for job listings
-        )
-        # Find all job elements by class name 'srp-jobtuple-wrapper'
-        job_elements = driver.find_elements(By.CLASS_NAME, 'srp-jobtuple-wrapper')
-        print("Company jobs element start")
-        for counter, job_element in enumerate(job_elements, start=0):
-            print(job_element)
-            print(f"element counter:{counter} ")
-            job_id = job_element.get_attribute('data-job-id')
-            # Extract data from job listing
-            job_title_element = job_element.find_element(By.XPATH, ".//a[contains(@class, 'title ')]")
-            job_href = job_title_element.get_attribute('href')
-            job_position = job_title_element.text
-            company_details = job_element.find_element(By.CLASS_NAME, 'comp-dtls-wrap')
-            company_name_element = company_details.find_element(By.CLASS_NAME, 'comp-name')
-            company_name = company_name_element.text
-            company_job_links.append((company_name, job_position, job_href))
-            print(f"Company: {company_name}, Job Position: {job_position}, Job Link: {job_href}")
-        print("Company jobs element END")
+        company_job_links = _company_job_links(_read_job_tuples(driver, 'company-jobs'))
     except NoSuchElementException as e:
+        metrics.error('collect_company_jobs')
         print("Error while collecting company job data:", e)
     return company_job_links
 
 
-def filter_lead_positions():
-    date_str = datetime.now().strftime('%Y-%m-%d')
-    input_filename = f"NAUKRI_COMPANY_job_links_{date_str}.csv"
-    output_filename = f"NAUKRI_LEAD_job_links_{date_str}.csv"
+def filter_lead_positions(store, lexical_cutoff=None):
+    # Lead positions from company pages that have not been scored yet; with a
+    # cascade lexical_cutoff, not counting those it already dropped
+    lead_rows = store.lead_jobs(lexical_cutoff=lexical_cutoff)
+    print(f"{len(lead_rows)} lead positions to score")
+    return lead_rows
+
+RANK_KEYWORDS = ['GenAI', 'Data']
+RANK_SCORE_THRESHOLD = 50
+CASCADE_LEXICAL_CUTOFF = 0.05
+CASCADE_TOP_K = None
+CASCADE_RECALL_CUTOFFS = [0.0, 0.05, 0.1, 0.2, 0.3, 0.5]
+
+
+def lexical_prefilter_scores(keywords, job_positions):
+    # Cheap per-job score: best mean of TF-IDF and Jaccard over all keywords
+    tfidf_matrix, jaccard_matrix = LexicalScorer(keywords, job_positions).score()
+    return (tfidf_matrix, jaccard_matrix), ((tfidf_matrix + jaccard_matrix) / 2).max(axis=0)
+
+
+def select_cascade_candidates(lexical_scores, lexical_cutoff=CASCADE_LEXICAL_CUTOFF, top_k=CASCADE_TOP_K):
+    # Indices of the jobs worth sending to the embedding model, in input order
+    candidates = np.flatnonzero(lexical_scores > lexical_cutoff)
+    if top_k is not None and len(candidates) > top_k:
+        best_first = candidates[np.argsort(-lexical_scores[candidates], kind='stable')]
+        candidates = np.sort(best_first[:top_k])
+    return candidates.tolist()
+
+
+def score_lead_positions(rows, keywords=RANK_KEYWORDS, cascade=False, lexical_cutoff=CASCADE_LEXICAL_CUTOFF,
+                         top_k=CASCADE_TOP_K, prefiltered_rows=None):
+    # Returns the scored rows, best combined_fit_score first. In cascade mode
+    # the rows under lexical_cutoff are appended to prefiltered_rows when given;
+    # rows only cut by top_k are not, they may make it another time.
+    job_positions = [row['Job Position'] or '' for row in rows]
+    lexical_matrices, lexical_scores = lexical_prefilter_scores(keywords, job_positions)
+    if cascade:
+        candidates = select_cascade_candidates(lexical_scores, lexical_cutoff, top_k)
+        print(f"Cascade: {len(candidates)} of {len(rows)} job positions passed the lexical prefilter")
+        if prefiltered_rows is not None:
+            prefiltered_rows.extend(rows[index] for index in np.flatnonzero(lexical_scores <= lexical_cutoff))
+    else:
+        candidates = list(range(len(rows)))
+
+    print(f"Scoring {len(candidates)} job positions against {keywords}")
+    tfidf_matrix, jaccard_matrix = lexical_matrices
+    score_matrix = get_similarity_engine().score(
+        keywords, [job_positions[index] for index in candidates],
+        lexical_scores=(tfidf_matrix[:, candidates], jaccard_matrix[:, candidates]))
+
+    scored_rows = []
+    for candidate_index, row_index in enumerate(candidates):
+        row = dict(rows[row_index])
+        # Assign the calculated scores to the row
+        for keyword_index, keyword in enumerate(keywords):
+            row[f'{keyword} Score'] = score_matrix[keyword_index][candidate_index]['relevance_score']
+        row['Lexical Score'] = float(lexical_scores[row_index])
+        row['Fit Score'] = sum(score_matrix[keyword_index][candidate_index]['combined_fit_score']
+                               for keyword_index in range(len(keywords))) / len(keywords)
+        scored_rows.append(row)
+
+    # Rank on the weighted combined fit score averaged over the keywords
+    return sorted(scored_rows, key=lambda x: x['Fit Score'], reverse=True)
+
+
+def _passes_rank_threshold(row, keywords=RANK_KEYWORDS):
+    return any(row[f'{keyword} Score'] > RANK_SCORE_THRESHOLD for keyword in keywords)
+
+
+@timed('rank_lead_positions')
+def rank_lead_positions(store, cascade=False, lexical_cutoff=CASCADE_LEXICAL_CUTOFF, top_k=CASCADE_TOP_K):
+    try:
+        rows = filter_lead_positions(store, lexical_cutoff if cascade else None)
+        score_and_record_leads(store, rows, cascade=cascade, lexical_cutoff=lexical_cutoff, top_k=top_k)
+        write_ranked_lead_positions(store)
+    except ValueError as e:
+        metrics.error('rank_lead_positions')
+        print(e)
+    except Exception as e:
+        metrics.error('rank_lead_positions')
+        print(f"Error while ranking lead positions: {e}")
+
+
+def score_and_record_leads(store, rows, cascade=False, lexical_cutoff=CASCADE_LEXICAL_CUTOFF, top_k=CASCADE_TOP_K):
+    # Scores lead rows and saves the results; returns the scored rows, best first
+    if not rows:
+        return []
+    prefiltered_rows = []
     try:
-        with open(input_filename, mode='r', encoding='ISO-8859-1') as infile, open(output_filename, mode='w', newline='', encoding='ISO-8859-1') as outfile:
-            reader = csv.DictReader(infile)
-            writer = csv.writer(outfile)
-            writer.writerow(['Company Name', 'Job Position', 'Company Job URL'])
-            for row in reader:
-                if 'lead' in row['Job Position'].lower():
-                    writer.writerow([row['Company Name'], row['Job Position'], row['Company Job URL']])
-        print(f"Filtered lead positions written to {output_filename}")
-    except FileNotFoundError as e:
-        print(f"CSV file not found: {input_filename}")
+        scored_jobs = score_lead_positions(rows, cascade=cascade, lexical_cutoff=lexical_cutoff, top_k=top_k,
+                                           prefiltered_rows=prefiltered_rows)
     except Exception as e:
-        print(f"Error while filtering lead positions: {e}")
+        raise ValueError(f"Error calculating similarity for keywords {RANK_KEYWORDS}: {e}")
+    store.record_scores(scored_jobs, prefiltered_rows, lexical_cutoff)
+    return scored_jobs
+
 
-def rank_lead_positions():
+def write_ranked_lead_positions(store):
     date_str = datetime.now().strftime('%Y-%m-%d')
-    date_time_str = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    input_filename = f"NAUKRI_LEAD_job_links_{date_str}.csv"
     output_filename = f"NAUKRI_RANKED_LEAD_job_links_{date_str}.csv"
-    try:
-        with open(input_filename, mode='r', encoding='ISO-8859-1') as infile, open(output_filename, mode='w', newline='',encoding='ISO-8859-1') as outfile:
-            reader = csv.DictReader(infile)
-            # Validate if expected headers are present
-            expected_headers = {'Company Name', 'Job Position', 'Company Job URL'}
-            if not expected_headers.issubset(reader.fieldnames):
-                raise ValueError(f"Input CSV is missing one or more expected columns: {expected_headers}")
+    # Every scored lead of the current run, including the ones whose scores were reused
+    ranked_jobs = store.ranked_lead_jobs()
 
-            writer = csv.writer(outfile)
-            writer.writerow(['Rank', 'Company Name', 'Job Position', 'Job URL', 'GenAI Score', 'Data Score'])
-            ranked_jobs = []
+    with open(output_filename, mode='w', newline='', encoding='ISO-8859-1') as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(['Rank', 'Company Name', 'Job Position', 'Job URL', 'GenAI Score', 'Data Score',
+                         'Fit Score'])
 
+        # Write sorted jobs to the output file with rank
+        for rank, row in enumerate(ranked_jobs, start=1):
+            if _passes_rank_threshold(row):
+                writer.writerow([
+                    rank, row['Company Name'], row['Job Position'], row['Company Job URL'],
+                    row['GenAI Score'], row['Data Score'], row['Fit Score']
+                ])
 
-            for row in reader:
-                try:
-                    job_position = row['Job Position']
-                    print(f"job position {job_position}")
-                    # Calculate similarity scores
-                    similarity_scores_list = []
-                    for keyword in ['GenAI', 'Data']:
-                        scores = calculate_similarity_scores(keyword, job_position)
-                        if "error" in scores:
-                            raise ValueError(
-                                f"Error calculating similarity for keyword '{keyword}' in job '{job_position}': {scores['error']}")
-                        similarity_scores_list.append(scores['relevance_score'])
-
-                    # Assign the calculated scores to the row
-                    #row['Lead Score'] = similarity_scores_list[0]
-                    #row['GenAI Score'] = similarity_scores_list[1]
-                    #row['AI Score'] = similarity_scores_list[2]
-                    #row['Data Score'] = similarity_scores_list[3]
-                    row['GenAI Score'] = similarity_scores_list[0]
-                    row['Data Score'] = similarity_scores_list[1]
-
-                    ranked_jobs.append(row)
-                except KeyError as e:
-                    print(f"Missing expected column in row: {e}")
-                except ValueError as e:
-                    print(e)
-                except Exception as e:
-                    print(f"Unexpected error processing row: {e}")
-
-            # Sort the jobs based on the average of scores or a chosen score
-            ranked_jobs = sorted(ranked_jobs, key=lambda x: (
-                                                                     x['GenAI Score'] + x['Data Score']
-                                                            ) / 2, reverse=True)
-
-            # Write sorted jobs to the output file with rank
-            for rank, row in enumerate(ranked_jobs, start=1):
-                if row['GenAI Score'] > 50 or row['Data Score'] > 50 :
-                    writer.writerow([
-                        rank, row['Company Name'], row['Job Position'], row['Company Job URL'],
-                        row['GenAI Score'], row['Data Score']
-                    ])
-
-        print(f"Ranked lead positions written to {output_filename}")
-
-    except FileNotFoundError as e:
-        print(f"CSV file not found: {input_filename}")
-    except ValueError as e:
-        print(f"Input file error: {e}")
+    print(f"Ranked lead positions written to {output_filename}")
+
+
+def cascade_recall_report(store, lexical_cutoffs=CASCADE_RECALL_CUTOFFS, top_k=CASCADE_TOP_K):
+    # Scores every lead row once, then replays the cascade at each cutoff to show
+    # how many model calls it saves and how many kept jobs it would lose
+    try:
+        rows = store.lead_jobs(only_unscored=False)
+        full_ranking = score_lead_positions(rows)
+        kept_urls = [row['Company Job URL'] for row in full_ranking if _passes_rank_threshold(row)]
+        top_urls = set(kept_urls[:10])
+        lexical_by_url = {row['Company Job URL']: row['Lexical Score'] for row in full_ranking}
+
+        print(f"Cascade recall against a full run over {len(rows)} rows ({len(kept_urls)} jobs kept):")
+        print(f"{'cutoff':>8} {'model calls':>12} {'recall':>8} {'top-10 recall':>14}")
+        lexical_scores = np.array([row['Lexical Score'] for row in full_ranking])
+        for cutoff in lexical_cutoffs:
+            candidates = select_cascade_candidates(lexical_scores, cutoff, top_k)
+            candidate_urls = {full_ranking[index]['Company Job URL'] for index in candidates}
+            recall = (sum(url in candidate_urls for url in kept_urls) / len(kept_urls)) if kept_urls else 1.0
+            top_recall = (len(top_urls & candidate_urls) / len(top_urls)) if top_urls else 1.0
+            print(f"{cutoff:>8.2f} {len(candidates):>12} {recall:>8.1%} {top_recall:>14.1%}")
+            missed = [url for url in kept_urls if url not in candidate_urls]
+            for url in missed[:5]:
+                print(f"    missed {url} (lexical score {lexical_by_url[url]:.3f})")
     except Exception as e:
-        print(f"Error while ranking lead positions: {e}")
+        print(f"Error while building cascade recall report: {e}")
+
+
+SIMILARITY_MODEL_NAME = 'paraphrase-mpnet-base-v2'
+ENCODE_BATCH_SIZE = 64
+EMBEDDING_CACHE_DIR = os.path.join('.naukri_cache', 'embeddings')
+EMBEDDING_CACHE_MAX_ENTRIES = 50000
+SCORING_WORKERS = 1
+SCORING_SHARD_SIZE = 256
+EMBEDDING_BACKEND = 'torch'
+EMBEDDING_BACKENDS = ['torch', 'torch-int8', 'onnx']
+EMBEDDING_ONNX_DIR = os.path.join('.naukri_cache', 'onnx')
+# sentence-transformers pooling config keys the ONNX backend reproduces
+ONNX_POOLING_MODES = {'pooling_mode_mean_tokens': 'mean', 'pooling_mode_cls_token': 'cls',
+                      'pooling_mode_max_tokens': 'max'}
+
+
+def embedding_model_key(model_name, backend=EMBEDDING_BACKEND):
+    # Names a model and backend pair for caches; backends give slightly different embeddings
+    name = os.path.basename(os.path.normpath(model_name)) if os.path.isdir(model_name) else model_name
+    return name if backend == 'torch' else f"{name}@{backend}"
+
+
+def load_embedding_model(model_name, backend=EMBEDDING_BACKEND):
+    # model_name is a sentence-transformers model name or a local model
+    # directory. Every backend returns an object whose encode() matches
+    # SentenceTransformer.encode.
+    if backend == 'onnx':
+        try:
+            return OnnxEmbeddingModel(model_name)
+        except (ImportError, ValueError) as e:
+            print(f"ONNX backend unavailable ({e}), using the torch backend")
+            backend = 'torch'
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(model_name, device='cpu')
+    if backend == 'torch-int8':
+        import torch
+        # Linear layers hold nearly all of the weights and compute; their int8 versions run on CPU only
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    elif backend != 'torch':
+        raise ValueError(f"Unknown embedding backend {backend}, expected one of {EMBEDDING_BACKENDS}")
+    return model
+
+
+def _hub_model_id(model_name):
+    if os.path.isdir(model_name) or '/' in model_name:
+        return model_name
+    return f"sentence-transformers/{model_name}"
+
+
+def _model_file(model_name, filename):
+    # Path of one file of a sentence-transformers model, or None when the model has no such file
+    if os.path.isdir(model_name):
+        path = os.path.join(model_name, filename)
+        return path if os.path.isfile(path) else None
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.utils import EntryNotFoundError
+    try:
+        return hf_hub_download(_hub_model_id(model_name), filename)
+    except EntryNotFoundError:
+        return None
+
+
+def _read_model_json(model_name, filename):
+    path = _model_file(model_name, filename)
+    if path is None:
+        return None
+    with open(path, mode='r') as file:
+        return json.load(file)
+
+
+def read_pooling_config(model_name):
+    # What has to follow the transformer to reproduce a sentence-transformers
+    # model: its token limit (None for the tokenizer's own), pooling mode and
+    # whether it normalizes, plus the config files this was read from. Raises
+    # ValueError for module stacks the ONNX backend cannot reproduce.
+    modules = _read_model_json(model_name, 'modules.json')
+    if modules is None:
+        # A plain transformers model, which sentence-transformers mean-pools
+        return {'max_seq_length': None, 'pooling': 'mean', 'normalize': False, 'files': []}
+    config = {'max_seq_length': None, 'pooling': None, 'normalize': False, 'files': ['modules.json']}
+    for module in modules:
+        module_type = module['type'].rsplit('.', 1)[-1]
+        if module_type == 'Transformer':
+            bert_config = _read_model_json(model_name, 'sentence_bert_config.json')
+            if bert_config is not None:
+                config['max_seq_length'] = bert_config.get('max_seq_length')
+                config['files'].append('sentence_bert_config.json')
+        elif module_type == 'Pooling':
+            pooling_file = f"{module['path']}/config.json"
+            pooling_config = _read_model_json(model_name, pooling_file) or {}
+            modes = [key for key, enabled in pooling_config.items() if key.startswith('pooling_mode_') and enabled]
+            if len(modes) != 1 or modes[0] not in ONNX_POOLING_MODES:
+                raise ValueError(f"{model_name} pools with {', '.join(modes) or 'no mode'}, "
+                                 f"the ONNX backend supports one of {', '.join(ONNX_POOLING_MODES)}")
+            config['pooling'] = ONNX_POOLING_MODES[modes[0]]
+            config['files'].append(pooling_file)
+        elif module_type == 'Normalize':
+            config['normalize'] = True
+        else:
+            raise ValueError(f"{model_name} has a {module_type} module, which the ONNX backend does not run")
+    if config['pooling'] is None:
+        raise ValueError(f"{model_name} has no pooling module for the ONNX backend to reproduce")
+    return config
+
+
+def export_onnx_model(model_name, output_dir, config_files=()):
+    # Exports the transformer of a sentence-transformers model to
+    # output_dir/model.onnx next to its tokenizer and the config_files that
+    # describe its pooling; pooling stays in Python
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    print(f"Exporting {model_name} to ONNX in {output_dir}")
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(_hub_model_id(model_name))
+    model = AutoModel.from_pretrained(_hub_model_id(model_name)).eval()
+    sample = tokenizer(['an example job title'], return_tensors='pt')
+    with torch.no_grad():
+        torch.onnx.export(
+            model, (sample['input_ids'], sample['attention_mask']), os.path.join(output_dir, 'model.onnx'),
+            input_names=['input_ids', 'attention_mask'], output_names=['last_hidden_state'],
+            dynamic_axes={'input_ids': {0: 'batch', 1: 'tokens'}, 'attention_mask': {0: 'batch', 1: 'tokens'},
+                          'last_hidden_state': {0: 'batch', 1: 'tokens'}},
+            opset_version=14)
+    tokenizer.save_pretrained(output_dir)
+    for filename in config_files:
+        os.makedirs(os.path.dirname(os.path.join(output_dir, filename)), exist_ok=True)
+        shutil.copyfile(_model_file(model_name, filename), os.path.join(output_dir, filename))
+
+
+class OnnxEmbeddingModel:
+    # Runs the exported transformer in ONNX Runtime, then truncates, pools and
+    # normalizes the way the model's sentence-transformers config says. The
+    # export is made on first use when the model directory has no model.onnx yet.
+
+    def __init__(self, model_name, onnx_dir=None):
+        import onnxruntime
+        import torch
+        from transformers import AutoTokenizer
+        if onnx_dir is None:
+            if os.path.isfile(os.path.join(model_name, 'model.onnx')):
+                onnx_dir = model_name
+            else:
+                onnx_dir = os.path.join(EMBEDDING_ONNX_DIR, embedding_model_key(model_name))
+        # Exports made before the config files were copied along read them from the model
+        config = read_pooling_config(onnx_dir if _model_file(onnx_dir, 'modules.json') else model_name)
+        if not os.path.isfile(os.path.join(onnx_dir, 'model.onnx')):
+            export_onnx_model(model_name, onnx_dir, config['files'])
+        self.max_seq_length = config['max_seq_length']
+        self.pooling = config['pooling']
+        self.normalize = config['normalize']
+        self.tokenizer = AutoTokenizer.from_pretrained(onnx_dir)
+        options = onnxruntime.SessionOptions()
+        # Follow the torch thread setting so scoring workers split the cores the same way
+        options.intra_op_num_threads = torch.get_num_threads()
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(os.path.join(onnx_dir, 'model.onnx'), options,
+                                                    providers=['CPUExecutionProvider'])
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, show_progress_bar=False):
+        sentences = list(sentences)
+        embeddings = []
+        for start in range(0, len(sentences), batch_size):
+            tokens = self.tokenizer(sentences[start:start + batch_size], padding=True, truncation=True,
+                                    max_length=self.max_seq_length, return_tensors='np')
+            attention_mask = tokens['attention_mask'].astype(np.int64)
+            token_embeddings = self.session.run(None, {'input_ids': tokens['input_ids'].astype(np.int64),
+                                                       'attention_mask': attention_mask})[0]
+            embeddings.append(self._pool(token_embeddings, attention_mask))
+        if not embeddings:
+            return np.zeros((0, 0), dtype=np.float32)
+        embeddings = np.concatenate(embeddings).astype(np.float32)
+        if self.normalize:
+            embeddings /= np.clip(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None)
+        return embeddings
+
+    def _pool(self, token_embeddings, attention_mask):
+        mask = attention_mask[:, :, None].astype(np.float32)
+        if self.pooling == 'cls':
+            return token_embeddings[:, 0]
+        if self.pooling == 'max':
+            return np.where(mask > 0, token_embeddings, -1e9).max(axis=1)
+        return (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+
+class MappedVectors:
+    # Float32 vectors of self.dim columns in the file at self.vectors_path,
+    # memory-mapped as self._vectors
+
+    def _grow_vectors(self, rows):
+        # Remaps the file with room for `rows` vectors, keeping the ones already in it.
+        # The old mapping is dropped first, files still mapped cannot be resized everywhere.
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        os.makedirs(os.path.dirname(self.vectors_path), exist_ok=True)
+        with open(self.vectors_path, mode='ab') as file:
+            file.truncate(rows * self.dim * 4)
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+', shape=(rows, self.dim))
+
+
+class EmbeddingCache(MappedVectors):
+    # Persistent text -> embedding store for one model. The index maps a hash of
+    # the text to a row of a memory-mapped float32 array; once max_entries rows
+    # are used the least recently used rows are overwritten.
+
+    def __init__(self, model_name, cache_dir=EMBEDDING_CACHE_DIR, max_entries=EMBEDDING_CACHE_MAX_ENTRIES):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.directory = os.path.join(cache_dir, model_name.replace('/', '__'))
+        self.index_path = os.path.join(self.directory, 'index.json')
+        self.vectors_path = os.path.join(self.directory, 'vectors.f32')
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._reset()
+        self._load()
+        self._flushed_tick = self._tick
+
+    def _reset(self):
+        self.dim = None
+        self._rows = 0
+        self._vectors = None
+        self._entries = {}  # text hash -> [row, last used tick]
+        self._tick = 0
+
+    @staticmethod
+    def text_key(text):
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, mode='r') as file:
+                index = json.load(file)
+            if index.get('model_name') != self.model_name:
+                print(f"Embedding cache at {self.directory} belongs to another model, ignoring it")
+                return
+            self.dim = index['dim']
+            self._rows = index['rows']
+            self._entries = index['entries']
+            self._tick = index['tick']
+            if self._rows:
+                self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+',
+                                          shape=(self._rows, self.dim))
+        except Exception as e:
+            print(f"Error while loading embedding cache, starting empty: {e}")
+            self._reset()
+
+    def _ensure_rows(self, rows_needed):
+        if rows_needed <= self._rows:
+            return
+        new_rows = min(self.max_entries, max(rows_needed, self._rows * 2, 1024))
+        self._grow_vectors(new_rows)
+        self._rows = new_rows
+
+    def get_many(self, texts):
+        # Returns one vector (or None on a miss) per text
+        found = []
+        for text in texts:
+            entry = self._entries.get(self.text_key(text))
+            if entry is None:
+                self.misses += 1
+                found.append(None)
+                continue
+            self.hits += 1
+            self._tick += 1
+            entry[1] = self._tick
+            found.append(np.array(self._vectors[entry[0]]))
+        return found
+
+    def put_many(self, texts, vectors):
+        if not len(texts):
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        # Never store more than the cache can hold in one go
+        texts = list(texts)[-self.max_entries:]
+        vectors = vectors[-self.max_entries:]
+
+        batch_keys = list(dict.fromkeys(self.text_key(text) for text in texts))
+        new_keys = [key for key in batch_keys if key not in self._entries]
+        used_rows = len(self._entries)
+        self._ensure_rows(min(self.max_entries, used_rows + len(new_keys)))
+
+        overflow = used_rows + len(new_keys) - self.max_entries
+        free_rows = iter(range(used_rows, self._rows))
+        if overflow > 0:
+            # Evict the least recently used entries and reuse their rows
+            batch_key_set = set(batch_keys)
+            candidates = [key for key in self._entries if key not in batch_key_set]
+            lru_keys = sorted(candidates, key=lambda key: self._entries[key][1])[:overflow]
+            evicted_rows = [self._entries.pop(key)[0] for key in lru_keys]
+            self.evictions += len(evicted_rows)
+            free_rows = iter(evicted_rows + list(range(used_rows, self._rows)))
+
+        for text, vector in zip(texts, vectors):
+            key = self.text_key(text)
+            self._tick += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = [next(free_rows), self._tick]
+                self._entries[key] = entry
+            entry[1] = self._tick
+            self._vectors[entry[0]] = vector
+
+    def flush(self):
+        # Hits only move the LRU ticks, so nothing needs writing when the tick has not moved
+        if self.dim is None or self._tick == self._flushed_tick:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if self._vectors is not None:
+            self._vectors.flush()
+        temp_path = self.index_path + '.tmp'
+        with open(temp_path, mode='w') as file:
+            json.dump({'model_name': self.model_name, 'dim': self.dim, 'rows': self._rows,
+                       'tick': self._tick, 'entries': self._entries}, file)
+        os.replace(temp_path, self.index_path)
+        self._flushed_tick = self._tick
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = (self.hits / lookups * 100) if lookups else 0.0
+        print(f"Embedding cache {self.model_name}: {self.hits} hits, {self.misses} misses "
+              f"({hit_rate:.1f}% hit rate), {self.evictions} evictions, {len(self._entries)} entries stored")
+
+
+class SimilarityEngine:
+    # Holds one loaded SentenceTransformer for the whole process and scores
+    # many resume/keyword texts against many job descriptions at once. With
+    # more than one worker the encoding runs in a ScoringPool instead and this
+    # process never loads the model.
+
+    def __init__(self, model_name=SIMILARITY_MODEL_NAME, batch_size=ENCODE_BATCH_SIZE, cache=None,
+                 workers=SCORING_WORKERS, backend=EMBEDDING_BACKEND):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache = cache
+        self.workers = workers
+        self.backend = backend
+        self._model = None
+        self._pool = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            print(f"Loading similarity model {self.model_name} ({self.backend} backend)")
+            self._model = load_embedding_model(self.model_name, self.backend)
+        return self._model
+
+    @timed('model_encode')
+    def _encode_with_model(self, texts):
+        if self.workers > 1:
+            if self._pool is None:
+                self._pool = ScoringPool(self.workers, self.model_name, self.batch_size, backend=self.backend)
+            return self._pool.encode(texts)
+        return self.model.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True,
+                                 show_progress_bar=False).astype(np.float32)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def encode(self, texts):
+        texts = list(texts)
+        if self.cache is None:
+            return self._encode_with_model(texts)
+
+        # Only run inference on texts the cache has never seen
+        embeddings = self.cache.get_many(texts)
+        missing_texts = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+        if missing_texts:
+            missing_embeddings = self._encode_with_model(missing_texts)
+            self.cache.put_many(missing_texts, missing_embeddings)
+            self.cache.flush()
+            encoded = dict(zip(missing_texts, missing_embeddings))
+            embeddings = [encoded[text] if embedding is None else embedding
+                          for text, embedding in zip(texts, embeddings)]
+        return np.stack(embeddings)
+
+    def score(self, resume_texts, job_descriptions, lexical_scores=None):
+        # Returns a len(resume_texts) x len(job_descriptions) grid of score dicts.
+        # lexical_scores can pass in (tfidf, jaccard) matrices already computed
+        # over a larger corpus, e.g. by the cascade prefilter.
+        resume_texts = list(resume_texts)
+        job_descriptions = list(job_descriptions)
+        if not resume_texts or not job_descriptions:
+            return [[] for _ in resume_texts]
+
+        resume_embeddings = self.encode(resume_texts)
+        job_embeddings = self.encode(job_descriptions)
+        from sentence_transformers import util
+        # 1. Cosine Similarity for every (resume, job) pair as one matrix product
+        cosine_matrix = util.pytorch_cos_sim(resume_embeddings, job_embeddings).cpu().tolist()
+        # 2. TF-IDF and Jaccard scores fitted once over the whole job corpus
+        if lexical_scores is None:
+            lexical_scores = LexicalScorer(resume_texts, job_descriptions).score()
+        tfidf_matrix, jaccard_matrix = lexical_scores
+
+        scores = []
+        for resume_index in range(len(resume_texts)):
+            resume_scores = []
+            for job_index in range(len(job_descriptions)):
+                resume_scores.append(_combine_similarity_scores(
+                    cosine_matrix[resume_index][job_index],
+                    float(jaccard_matrix[resume_index, job_index]),
+                    float(tfidf_matrix[resume_index, job_index]),
+                ))
+            scores.append(resume_scores)
+        return scores
+
+
+class ScoringPool:
+    # Worker processes that each load the model once and encode shards of
+    # texts. Torch threads are split between the workers so that together they
+    # use each core once instead of every worker starting a thread per core.
+
+    def __init__(self, workers, model_name=SIMILARITY_MODEL_NAME, batch_size=ENCODE_BATCH_SIZE,
+                 shard_size=SCORING_SHARD_SIZE, threads_per_worker=None, backend=EMBEDDING_BACKEND):
+        self.workers = workers
+        self.shard_size = shard_size
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        print(f"Starting {workers} scoring workers with {self.threads_per_worker} torch threads each")
+        # Forking a process that already runs torch threads can deadlock, so workers start fresh
+        self._executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_scoring_worker, initargs=(model_name, batch_size, self.threads_per_worker, backend))
+
+    def warm_up(self):
+        # Starts every worker and waits until each has loaded the model
+        list(self._executor.map(_encode_shard, [['warm up']] * self.workers))
+
+    def encode(self, texts):
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        shards = [texts[start:start + self.shard_size] for start in range(0, len(texts), self.shard_size)]
+        # Shards come back in order as the workers finish them
+        embeddings = []
+        for index, shard_embeddings in enumerate(self._executor.map(_encode_shard, shards), start=1):
+            embeddings.append(shard_embeddings)
+            logger.debug("Encoded shard %d of %d", index, len(shards))
+        return np.concatenate(embeddings)
+
+    def close(self):
+        self._executor.shutdown()
+
+
+_worker_engine = None
+
+
+def _init_scoring_worker(model_name, batch_size, threads, backend=EMBEDDING_BACKEND):
+    global _worker_engine
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    _worker_engine = SimilarityEngine(model_name, batch_size, cache=None, workers=1, backend=backend)
+    _worker_engine.model
+
+
+def _encode_shard(texts):
+    return _worker_engine.model.encode(texts, batch_size=_worker_engine.batch_size, convert_to_numpy=True,
+                                       show_progress_bar=False).astype(np.float32)
+
+
+class LexicalScorer:
+    # Fits the TF-IDF vocabulary and the keyword token ids once over the whole
+    # job corpus, then scores every job against every resume/keyword text with
+    # sparse matrix products instead of one vectorizer per pair.
+
+    def __init__(self, resume_texts, job_descriptions):
+        from sklearn.feature_extraction.text import TfidfVectorizer, CountVectorizer
+        self.resume_count = len(resume_texts)
+        self.job_count = len(job_descriptions)
+        corpus = list(resume_texts) + list(job_descriptions)
+
+        # TF-IDF rows are L2-normalised, so a dot product is their cosine similarity
+        try:
+            self.tfidf_rows = TfidfVectorizer().fit_transform(corpus)
+        except ValueError:
+            # Empty vocabulary, e.g. only blank job titles
+            self.tfidf_rows = None
+
+        # Keyword sets as binary sparse rows over a shared token id vocabulary,
+        # using the same lower().split() tokens as the per-pair version did
+        try:
+            self.token_rows = CountVectorizer(lowercase=True, tokenizer=str.split, token_pattern=None,
+                                              binary=True, dtype=np.int32).fit_transform(corpus).tocsr()
+            self.token_counts = np.asarray(self.token_rows.sum(axis=1)).ravel()
+        except ValueError:
+            self.token_rows = None
+
+    def score(self):
+        # Returns (tfidf cosine, jaccard) matrices of shape (resumes, jobs)
+        shape = (self.resume_count, self.job_count)
+        tfidf_matrix = np.zeros(shape)
+        jaccard_matrix = np.zeros(shape)
+
+        if self.tfidf_rows is not None:
+            resume_rows = self.tfidf_rows[:self.resume_count]
+            job_rows = self.tfidf_rows[self.resume_count:]
+            tfidf_matrix = (resume_rows @ job_rows.T).toarray()
+
+        if self.token_rows is not None:
+            resume_rows = self.token_rows[:self.resume_count]
+            job_rows = self.token_rows[self.resume_count:]
+            intersection = (resume_rows @ job_rows.T).toarray()
+            union = (self.token_counts[:self.resume_count, None] + self.token_counts[None, self.resume_count:]
+                     - intersection)
+            np.divide(intersection, union, out=jaccard_matrix, where=union > 0)
+
+        return tfidf_matrix, jaccard_matrix
+
+
+_similarity_engine = None
+
+
+def get_similarity_engine():
+    global _similarity_engine
+    if _similarity_engine is None:
+        try:
+            cache = EmbeddingCache(embedding_model_key(SIMILARITY_MODEL_NAME, EMBEDDING_BACKEND))
+        except Exception as e:
+            print(f"Embedding cache unavailable, encoding without it: {e}")
+            cache = None
+        _similarity_engine = SimilarityEngine(SIMILARITY_MODEL_NAME, cache=cache, workers=SCORING_WORKERS,
+                                              backend=EMBEDDING_BACKEND)
+    return _similarity_engine
+
+
+def _combine_similarity_scores(cosine_similarity_score, jaccard_similarity_score, tfidf_cosine_similarity_score):
+    # Relevance Score (converted to percentage from cosine similarity)
+    relevance_score = cosine_similarity_score * 100
+
+    # Additional Similarity Score
+    # Here, we use the same cosine similarity as an example of an additional similarity metric,
+    # but this can be replaced with another similarity metric as desired.
+    additional_similarity_score = cosine_similarity_score  # Reusing cosine similarity for demonstration
+
+    # Combine all scores with specified weights
+    combined_fit_score = (
+            0.4 * cosine_similarity_score +
+            0.2 * (relevance_score / 100) +  # Convert relevance back to scale of 0 to 1
+            0.15 * jaccard_similarity_score +
+            0.15 * tfidf_cosine_similarity_score +
+            0.1 * additional_similarity_score
+    )
+
+    return {
+        "cosine_similarity_score": cosine_similarity_score,
+        "relevance_score": relevance_score,
+        "jaccard_similarity_score": jaccard_similarity_score,
+        "tfidf_cosine_similarity_score": tfidf_cosine_similarity_score,
+        "additional_similarity_score": additional_similarity_score,
+        "combined_fit_score": combined_fit_score
+    }
 
 
 def calculate_similarity_scores(resume_text, job_description):
     try:
-        # Load the model for embedding-based similarity (e.g., 'paraphrase-mpnet-base-v2')
-        model = SentenceTransformer('paraphrase-mpnet-base-v2')
-
-        # Encode both texts for cosine similarity and relevance score
-        resume_embedding = model.encode(resume_text, convert_to_tensor=True)
-        job_embedding = model.encode(job_description, convert_to_tensor=True)
-
-        # 1. Cosine Similarity
-        cosine_similarity_score = util.pytorch_cos_sim(resume_embedding, job_embedding).item()
-
-        # 2. Relevance Score (converted to percentage from cosine similarity)
-        relevance_score = cosine_similarity_score * 100
-
-        # 3. Jaccard Similarity for Keywords
-        resume_keywords = set(resume_text.lower().split())  # Simplified keyword extraction for demonstration
-        job_keywords = set(job_description.lower().split())
-        jaccard_similarity_score = len(resume_keywords.intersection(job_keywords)) / len(
-            resume_keywords.union(job_keywords))
-
-        # 4. TF-IDF Weighted Cosine Similarity
-        vectorizer = TfidfVectorizer()
-        tfidf_matrix = vectorizer.fit_transform([resume_text, job_description])
-        tfidf_cosine_similarity_score = sklearn_cosine_similarity(tfidf_matrix[0], tfidf_matrix[1]).item()
-
-        # 5. Additional Similarity Score
-        # Here, we use the same cosine similarity as an example of an additional similarity metric,
-        # but this can be replaced with another similarity metric as desired.
-        additional_similarity_score = cosine_similarity_score  # Reusing cosine similarity for demonstration
-
-        # Combine all scores with specified weights
-        combined_fit_score = (
-                0.4 * cosine_similarity_score +
-                0.2 * (relevance_score / 100) +  # Convert relevance back to scale of 0 to 1
-                0.15 * jaccard_similarity_score +
-                0.15 * tfidf_cosine_similarity_score +
-                0.1 * additional_similarity_score
-        )
-
-        # Return results
-        return {
-            "cosine_similarity_score": cosine_similarity_score,
-            "relevance_score": relevance_score,
-            "jaccard_similarity_score": jaccard_similarity_score,
-            "tfidf_cosine_similarity_score": tfidf_cosine_similarity_score,
-            "additional_similarity_score": additional_similarity_score,
-            "combined_fit_score": combined_fit_score
-        }
-
+        return get_similarity_engine().score([resume_text], [job_description])[0][0]
     except Exception as e:
         return {"error": str(e)}
 
-def find_apply_type(driver):
-    print("writing apply types for normal job list")
-    date_str = datetime.now().strftime('%Y-%m-%d')
-    first_file = f"NAUKRI_job_links_{date_str}.csv"
-    first_out = f"NAUKRI_APPLY_0_job_links_{date_str}.csv"
+
+JOB_INDEX_DIR = os.path.join('.naukri_cache', 'job_index')
+JOB_INDEX_IVF_MIN_SIZE = 20000  # below this an exact search over every row is already fast
+JOB_INDEX_NPROBE = 8
+JOB_INDEX_RETRAIN_GROWTH = 2.0
+JOB_INDEX_KMEANS_ITERATIONS = 10
+MATCH_TOP_K = 20
+RESUME_CHUNK_WORDS = 100
+
+
+class JobVectorIndex(MappedVectors):
+    # Persistent index of normalized job embeddings for resume matching. The
+    # vectors live in a memory-mapped float32 array next to a JSON list of job
+    # URLs and text hashes, so an update only encodes new or changed jobs.
+    # synced_at is the store time up to which job changes are in the index.
+    # From JOB_INDEX_IVF_MIN_SIZE jobs on, an inverted file of spherical
+    # k-means lists limits each query to the rows of the nprobe closest lists.
+
+    def __init__(self, model_key, index_dir=JOB_INDEX_DIR):
+        self.model_key = model_key
+        self.directory = os.path.join(index_dir, model_key.replace('/', '__'))
+        self.meta_path = os.path.join(self.directory, 'index.json')
+        self.vectors_path = os.path.join(self.directory, 'vectors.f32')
+        self.ivf_path = os.path.join(self.directory, 'ivf.npz')
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self.dim = None
+        self.job_urls = []
+        self.text_hashes = []
+        self.centroids = None
+        self.assignments = np.zeros(0, dtype=np.int32)
+        self.trained_rows = 0
+        self.synced_at = None
+        self._capacity = 0
+        self._vectors = None
+        self._rows_by_url = {}
+        self._lists = None
+
+    def __len__(self):
+        return len(self.job_urls)
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            return
+        try:
+            with open(self.meta_path, mode='r') as file:
+                meta = json.load(file)
+            if meta.get('model_key') != self.model_key:
+                print(f"Job index at {self.directory} belongs to another model, rebuilding it")
+                return
+            self.dim = meta['dim']
+            self.job_urls = meta['job_urls']
+            self.text_hashes = meta['text_hashes']
+            self.trained_rows = meta['trained_rows']
+            self.synced_at = meta.get('synced_at')
+            self._capacity = meta['capacity']
+            if self._capacity:
+                self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode='r+',
+                                          shape=(self._capacity, self.dim))
+            if os.path.exists(self.ivf_path):
+                with np.load(self.ivf_path) as ivf:
+                    self.centroids = ivf['centroids'] if ivf['centroids'].size else None
+                    self.assignments = ivf['assignments']
+            self._rows_by_url = {job_url: row for row, job_url in enumerate(self.job_urls)}
+        except Exception as e:
+            print(f"Error while loading job index, rebuilding it: {e}")
+            self._reset()
+
+    def _ensure_capacity(self, rows_needed):
+        if rows_needed <= self._capacity:
+            return
+        new_capacity = max(rows_needed, self._capacity * 2, 1024)
+        self._grow_vectors(new_capacity)
+        self._capacity = new_capacity
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def update(self, jobs, encode):
+        # jobs are (job_url, text) pairs; encode maps a list of texts to vectors.
+        # Returns the number of jobs (re-)encoded.
+        pending = {}
+        for job_url, text in jobs:
+            text_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+            row = self._rows_by_url.get(job_url)
+            if row is None or self.text_hashes[row] != text_hash:
+                pending[job_url] = (text, text_hash)
+        if not pending:
+            return 0
+        job_urls = list(pending)
+        vectors = self._normalize(encode([pending[job_url][0] for job_url in job_urls]))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        new_urls = [job_url for job_url in job_urls if job_url not in self._rows_by_url]
+        self._ensure_capacity(len(self.job_urls) + len(new_urls))
+        for job_url in new_urls:
+            self._rows_by_url[job_url] = len(self.job_urls)
+            self.job_urls.append(job_url)
+            self.text_hashes.append(None)
+        rows = np.array([self._rows_by_url[job_url] for job_url in job_urls])
+        self._vectors[rows] = vectors
+        for job_url in job_urls:
+            self.text_hashes[self._rows_by_url[job_url]] = pending[job_url][1]
+
+        if len(self) >= JOB_INDEX_IVF_MIN_SIZE and (
+                self.centroids is None or len(self) >= self.trained_rows * JOB_INDEX_RETRAIN_GROWTH):
+            self.train()
+        elif self.centroids is not None:
+            assignments = np.resize(self.assignments, len(self)).astype(np.int32)
+            assignments[rows] = np.argmax(vectors @ self.centroids.T, axis=1)
+            self.assignments = assignments
+            self._lists = None
+        return len(job_urls)
+
+    def train(self):
+        # Spherical k-means on a sample, then every row goes to its closest centroid
+        vectors = self._vectors[:len(self)]
+        clusters = int(min(4096, max(16, np.sqrt(len(self)))))
+        print(f"Training job index lists: {clusters} lists over {len(self)} jobs")
+        rng = np.random.default_rng(0)
+        sample = np.asarray(vectors[np.sort(rng.choice(len(self), min(len(self), clusters * 64), replace=False))])
+        centroids = sample[rng.choice(len(sample), clusters, replace=False)].copy()
+        for _ in range(JOB_INDEX_KMEANS_ITERATIONS):
+            sample_assignments = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, sample_assignments, sample)
+            counts = np.bincount(sample_assignments, minlength=clusters)
+            # Empty lists keep their old centroid
+            centroids = np.where(counts[:, None] > 0, self._normalize(sums), centroids)
+        assignments = np.empty(len(self), dtype=np.int32)
+        for start in range(0, len(self), 10000):
+            assignments[start:start + 10000] = np.argmax(vectors[start:start + 10000] @ centroids.T, axis=1)
+        self.centroids = centroids.astype(np.float32)
+        self.assignments = assignments
+        self.trained_rows = len(self)
+        self._lists = None
+
+    def _inverted_lists(self):
+        if self._lists is None:
+            order = np.argsort(self.assignments, kind='stable')
+            counts = np.bincount(self.assignments, minlength=len(self.centroids))
+            self._lists = np.split(order, np.cumsum(counts)[:-1])
+        return self._lists
+
+    @timed('index_search')
+    def search(self, query_vector, top_k=MATCH_TOP_K, nprobe=JOB_INDEX_NPROBE):
+        # (job URL, cosine similarity) of the top_k closest jobs, best first
+        if not len(self):
+            return []
+        query = self._normalize(query_vector).reshape(-1)
+        if self.centroids is None:
+            rows = None
+            similarities = self._vectors[:len(self)] @ query
+        else:
+            lists = self._inverted_lists()
+            closest_lists = np.argsort(-(self.centroids @ query))[:nprobe]
+            rows = np.sort(np.concatenate([lists[index] for index in closest_lists]))
+            similarities = self._vectors[rows] @ query
+        top_k = min(top_k, len(similarities))
+        best = np.argpartition(-similarities, top_k - 1)[:top_k]
+        best = best[np.argsort(-similarities[best], kind='stable')]
+        return [(self.job_urls[index if rows is None else rows[index]], float(similarities[index])) for index in best]
+
+    def save(self):
+        if self.dim is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if self._vectors is not None:
+            self._vectors.flush()
+        np.savez(self.ivf_path, centroids=self.centroids if self.centroids is not None else np.zeros(0),
+                 assignments=self.assignments)
+        temp_path = self.meta_path + '.tmp'
+        with open(temp_path, mode='w') as file:
+            json.dump({'model_key': self.model_key, 'dim': self.dim, 'capacity': self._capacity,
+                       'trained_rows': self.trained_rows, 'synced_at': self.synced_at, 'job_urls': self.job_urls,
+                       'text_hashes': self.text_hashes}, file)
+        os.replace(temp_path, self.meta_path)
+
+
+def job_match_text(row):
+    # What a job is matched on: its title and company, plus the description when it was read
+    text = f"{row['job_position'] or ''} at {row['company_name'] or ''}"
+    if row['job_description']:
+        text += f". {row['job_description']}"
+    return text
+
+
+def update_job_index(store, index=None):
+    # Encodes the jobs the store stamped as new or changed since the last sync,
+    # so an up-to-date index costs one indexed query rather than a pass over every job
+    if index is None:
+        # Not `index or ...`: an empty index is falsy
+        index = JobVectorIndex(embedding_model_key(SIMILARITY_MODEL_NAME, EMBEDDING_BACKEND))
+    synced_at = _timestamp()
+    rows = store.jobs_for_matching(changed_since=index.synced_at)
+    if not rows:
+        return index
+    encoded = index.update(((row['job_url'], job_match_text(row)) for row in rows), get_similarity_engine().encode)
+    index.synced_at = synced_at
+    index.save()
+    print(f"Job index: {encoded} jobs encoded, {len(index)} jobs indexed")
+    return index
+
+
+def sync_job_index(store):
+    # Keeps a job index that an earlier --resume match built up to date as
+    # scraping stores new jobs and descriptions, so the next match only encodes
+    # the resume. A store never matched against builds its index on the first match.
+    index = JobVectorIndex(embedding_model_key(SIMILARITY_MODEL_NAME, EMBEDDING_BACKEND))
+    if index.dim is None:
+        return
     try:
-        with open(first_file, mode='r', encoding='ISO-8859-1') as infile, open(first_out, mode='w', newline='',encoding='ISO-8859-1') as outfile:
-            reader = csv.DictReader(infile)
-            writer = csv.writer(outfile)
-            writer.writerow(['Company Name', 'Job Position', 'Apply Type', 'Job URL'])
+        update_job_index(store, index)
+    except Exception as e:
+        print(f"Error while updating the job index: {e}")
 
 
-            for row in reader:
-                job_link = row['Job URL']
-                print(job_link)
-                driver.get(job_link)
-                time.sleep(1)
-                try:
-                    # Check for apply button container
-                    apply_containers = driver.find_elements(By.CLASS_NAME, 'styles_jhc__apply-button-container__5Bqnb')
-                    if not apply_containers:
-                        print("No apply container found.")
-                        continue
+def resume_chunks(resume_text, chunk_words=RESUME_CHUNK_WORDS):
+    # The model truncates long inputs, so a resume is encoded in pieces
+    words = resume_text.split()
+    return [' '.join(words[start:start + chunk_words]) for start in range(0, len(words), chunk_words)] or ['']
+
+
+def match_resume(store, resume_text, top_k=MATCH_TOP_K, index=None):
+    # Top-k stored jobs for a resume, from the mean of its normalized chunk embeddings
+    index = update_job_index(store, index)
+    chunk_vectors = JobVectorIndex._normalize(get_similarity_engine().encode(resume_chunks(resume_text)))
+    matches = index.search(chunk_vectors.mean(axis=0), top_k)
+    rows = store.jobs_by_url([job_url for job_url, _ in matches])
+    return [dict(rows.get(job_url, {'job_url': job_url}), similarity=similarity) for job_url, similarity in matches]
+
+
+def write_resume_matches(matches):
+    date_str = datetime.now().strftime('%Y-%m-%d')
+    csv_filename = f"NAUKRI_RESUME_MATCHES_{date_str}.csv"
+    with open(csv_filename, mode='w', newline='', encoding='ISO-8859-1', errors='replace') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Company Name', 'Job Position', 'Similarity', 'Apply Type', 'Job URL'])
+        for match in matches:
+            writer.writerow([match.get('company_name'), match.get('job_position'), f"{match['similarity']:.4f}",
+                             match.get('apply_type'), match['job_url']])
+    print(f"Resume matches written to {csv_filename}")
+
+HTTP_APPLY_TYPE_CONCURRENCY = 8
+HTTP_APPLY_TYPE_TIMEOUT = 30
+
+
+@timed('find_apply_type')
+def find_apply_type(driver, store, pool=None, http=False, http_concurrency=HTTP_APPLY_TYPE_CONCURRENCY):
+    print("writing apply types for normal job list")
+    try:
+        rows = store.jobs_needing_apply_type()
+        job_links = [row['Job URL'] for row in rows]
+        print(f"{len(job_links)} jobs need an apply type check")
+        if http:
+            job_pages = fetch_job_pages_over_http(job_links, export_session_cookies(driver),
+                                                  user_agent=driver.execute_script("return navigator.userAgent"),
+                                                  concurrency=http_concurrency)
+        else:
+            job_pages = [None] * len(job_links)
+
+        # Pages the raw HTML could not answer for still need a real browser
+        browser_indexes = [index for index, job_page in enumerate(job_pages) if job_page is None]
+        if http:
+            print(f"Apply type read over HTTP for {len(job_links) - len(browser_indexes)} of {len(job_links)} "
+                  f"jobs, falling back to the browser for {len(browser_indexes)}")
+        browser_job_pages = visit_pages(driver, [job_links[index] for index in browser_indexes],
+                                        _inspect_job_page, pool,
+                                        error_message="Exception while checking apply type for")
+        for index, job_page in zip(browser_indexes, browser_job_pages):
+            job_pages[index] = job_page
+
+        for job_link, job_page in zip(job_links, job_pages):
+            # Pages that failed to load are left unchecked and retried next run
+            if job_page is not None:
+                _record_job_page(store, job_link, job_page)
+        sync_job_index(store)
 
-                    applytype = ''
-
-                    for apply_container in apply_containers:
-                        # Check for different apply types
-                        if apply_container.find_elements(By.CLASS_NAME, "styles_apply-button__uJI3A"):
-                            print("Apply type: SIMPLE APPLY")
-                            applytype = 'SIMPLE APPLY'
-                        elif apply_container.find_elements(By.CLASS_NAME, "styles_company-site-button__C_2YK"):
-                            print("Apply type: COMPANY APPLY")
-                            applytype = 'COMPANY APPLY'
-                        elif apply_container.find_elements(By.CLASS_NAME, "styles_already-applied__4KDhw"):
-                            print("Apply type: ALREADY APPLIED")
-                            applytype = 'ALREADY APPLIED'
-                        else:
-                            print("No recognized apply type found.")
-
-                        writer.writerow([row['Company Name'], row['Job Position'], applytype, row['Job URL']])
-
-                except NoSuchElementException:
-                    print("Apply button container not found.")
-
-    except FileNotFoundError:
-        print(f"File not found: {first_file}")
     except Exception as e:
+        metrics.error('find_apply_type')
         print(f"Exception while adding apply type: {e}")
 
 
+def _record_job_page(store, job_link, job_page):
+    apply_types, job_description = job_page
+    store.record_apply_types(job_link, apply_types)
+    if job_description:
+        store.record_job_description(job_link, job_description)
+
+
+APPLY_CONTAINER_CLASS = 'styles_jhc__apply-button-container__5Bqnb'
+JOB_DESCRIPTION_CLASS = 'styles_JDC__dang-inner-html__h0K4t'
+APPLY_TYPE_CLASSES = [
+    ('styles_apply-button__uJI3A', 'SIMPLE APPLY'),
+    ('styles_company-site-button__C_2YK', 'COMPANY APPLY'),
+    ('styles_already-applied__4KDhw', 'ALREADY APPLIED'),
+]
+
+
+def _apply_type_for_classes(classes, applytype=''):
+    # Same precedence as the browser check; an unrecognised container keeps the previous type
+    for class_name, apply_type in APPLY_TYPE_CLASSES:
+        if class_name in classes:
+            return apply_type
+    return applytype
+
+
+@timed('apply_type_page')
+def _detect_apply_types(driver, job_link):
+    # Returns one apply type per apply button container on the job page
+    logger.debug("Checking apply type of %s", job_link)
+    load_page(driver, job_link)
+    # Wait until an apply container shows one of the known buttons; pages without one give up after the budget
+    waits.until(driver, 'job-apply-type', any_of(*(
+        EC.presence_of_element_located((By.CSS_SELECTOR, f".{APPLY_CONTAINER_CLASS} .{class_name}"))
+        for class_name, _ in APPLY_TYPE_CLASSES)), optional=True)
+    apply_types = []
+    try:
+        # Check for apply button container
+        apply_containers = driver.find_elements(By.CLASS_NAME, APPLY_CONTAINER_CLASS)
+        if not apply_containers:
+            logger.debug("No apply container found.")
+            return apply_types
+
+        applytype = ''
+
+        for apply_container in apply_containers:
+            # Check for different apply types
+            for class_name, apply_type in APPLY_TYPE_CLASSES:
+                if apply_container.find_elements(By.CLASS_NAME, class_name):
+                    logger.debug("Apply type: %s", apply_type)
+                    applytype = apply_type
+                    break
+            else:
+                logger.debug("No recognized apply type found.")
+
+            apply_types.append(applytype)
+
+    except NoSuchElementException:
+        logger.debug("Apply button container not found.")
+    return apply_types
+
+
+def _inspect_job_page(driver, job_link):
+    # (apply types, job description) of a job page; the description is read
+    # on the same visit so resume matching costs no extra page loads
+    apply_types = _detect_apply_types(driver, job_link)
+    job_description = ' '.join(element.text for element in driver.find_elements(By.CLASS_NAME, JOB_DESCRIPTION_CLASS))
+    return apply_types, ' '.join(job_description.split()) or None
+
+
+class ApplyContainerParser(ElementStackParser):
+    # Collects the set of class names found inside each apply button container
+    # of a raw job page
+
+    def __init__(self):
+        super().__init__()
+        self.containers = []
+
+    def start_element(self, tag, attrs, classes):
+        if APPLY_CONTAINER_CLASS in classes:
+            self.containers.append(set())
+            return 'container'
+        if self._in_role('container'):
+            self.containers[-1].update(classes)
+        return None
+
+
+def classify_apply_types(html):
+    # Apply types from raw job page HTML, or None when the page has no apply
+    # container and only a browser running its JavaScript can tell
+    parser = ApplyContainerParser()
+    parser.feed(html)
+    parser.close()
+    if not parser.containers:
+        return None
+    apply_types = []
+    applytype = ''
+    for container_classes in parser.containers:
+        applytype = _apply_type_for_classes(container_classes, applytype)
+        apply_types.append(applytype)
+    return apply_types
+
+
+class JobDescriptionParser(ElementStackParser):
+    # Collects the text inside the job description container of a raw job page
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+
+    def start_element(self, tag, attrs, classes):
+        return 'description' if JOB_DESCRIPTION_CLASS in classes else None
+
+    def handle_data(self, data):
+        if self._in_role('description'):
+            self.parts.append(data)
+
+
+def inspect_job_page_html(html, job_link=None):
+    # (apply types, job description) from raw job page HTML, or None when
+    # only a browser can tell the apply type
+    apply_types = classify_apply_types(html)
+    if apply_types is None:
+        return None
+    parser = JobDescriptionParser()
+    parser.feed(html)
+    parser.close()
+    return apply_types, ' '.join(' '.join(parser.parts).split()) or None
+
+
+def fetch_job_pages_over_http(job_links, cookies, user_agent=None, concurrency=HTTP_APPLY_TYPE_CONCURRENCY,
+                              timeout=HTTP_APPLY_TYPE_TIMEOUT):
+    # (apply types, job description) per job link, None where the browser has to be used instead
+    return fetch_pages_over_http(job_links, cookies, inspect_job_page_html, user_agent=user_agent,
+                                 concurrency=concurrency, timeout=timeout, operation='apply_type_http')
+
+
+def fetch_pages_over_http(urls, cookies, parse, user_agent=None, concurrency=HTTP_APPLY_TYPE_CONCURRENCY,
+                          timeout=HTTP_APPLY_TYPE_TIMEOUT, operation='page_http'):
+    # Fetches pages with the browser's session cookies over one pooled HTTP
+    # client, at most `concurrency` at a time. Returns parse(html, url) per
+    # URL, None where the page could not be fetched.
+    try:
+        import aiohttp
+    except ImportError:
+        print("aiohttp is not installed, reading these pages in the browser instead")
+        return [None] * len(urls)
+    return asyncio.run(_fetch_pages(aiohttp, urls, cookies, parse, user_agent, concurrency, timeout, operation))
+
+
+async def _fetch_pages(aiohttp, urls, cookies, parse, user_agent, concurrency, timeout, operation):
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {'User-Agent': user_agent} if user_agent else {}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, headers=headers,
+                                     cookies={cookie['name']: cookie['value'] for cookie in cookies},
+                                     timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+
+        async def fetch(url):
+            async with semaphore:
+                for attempt in range(governor.retries + 1):
+                    ticket = await governor.acquire_async()
+                    started = time.perf_counter()
+                    try:
+                        async with session.get(url) as response:
+                            status = response.status
+                            retry_after = response.headers.get('Retry-After', '')
+                            html = await response.text(errors='replace')
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        metrics.observe(operation, time.perf_counter() - started, error=True)
+                        governor.release(ticket, 'error')
+                        print(f"HTTP error for {url}: {e!r}")
+                        if attempt == governor.retries:
+                            return None
+                        await asyncio.sleep(governor.backoff_delay(attempt))
+                        continue
+                    outcome = governor.release(ticket, classify_response(status, html),
+                                               float(retry_after) if retry_after.isdigit() else None)
+                    metrics.observe(operation, time.perf_counter() - started, error=status != 200)
+                    if status == 200 and outcome in ('ok', 'slow'):
+                        break
+                    print(f"HTTP {status} for {url}")
+                    if outcome == 'ok' or attempt == governor.retries:
+                        # Client errors such as 404 are not retried
+                        return None
+                    if outcome == 'error':
+                        await asyncio.sleep(governor.backoff_delay(attempt))
+            result = parse(html, url)
+            if result is not None:
+                logger.debug("%s: %s", url, result)
+            return result
+
+        return await asyncio.gather(*(fetch(url) for url in urls))
+
+
 # def apply(driver, url):
 #     try:
 #         # Attempt to click the apply button within the container
@@ -429,33 +2901,55 @@ def find_apply_type(driver):
 #         print(f"Error while attempting to apply: {e}")
 #     return 0
 
-def apply(driver, url):
+APPLY_STATUSES = {1: 'APPLIED', 2: 'CHAT WINDOW', 3: 'ALREADY APPLIED'}  # any other result is FAILED
+CHAT_WINDOW_CLASS = 'chatbot_DrawerContentWrapper'
+CHAT_WINDOW_REMINDER = 5  # seconds between reminders while waiting for a human
+APPLY_MAX_PARKED_TABS = 10  # per browser; later chatbot jobs wait in the store for `apply --parked`
+
+
+def wait_for_chat_window(driver):
+    # Wait for the user to manually enter details in the chat window
+    while driver.find_elements(By.CLASS_NAME, CHAT_WINDOW_CLASS):
+        print("Chat window is still open. Please enter the required details.")
+        # Returns as soon as the window closes, reminding every few seconds
+        waits.until(driver, 'chat-window', element_absent((By.CLASS_NAME, CHAT_WINDOW_CLASS)),
+                    optional=True, timeout=CHAT_WINDOW_REMINDER)
+    print("Chat window closed, assuming details have been entered.")
+
+
+@timed('apply')
+def apply(driver, url, wait_for_chat=True):
+    # Returns 2 as soon as the chatbot opens when wait_for_chat is False,
+    # leaving the chat window open in the current tab. Raises when the browser
+    # itself died, so a driver pool can restart it and retry the job.
     try:
         # Attempt to click the apply button within the container
         if url is not None:
-            driver.get(url)
-            time.sleep(1)
+            load_page(driver, url)
+            waits.until(driver, 'job-page', any_of(
+                EC.presence_of_element_located((By.CLASS_NAME, "styles_apply-button__uJI3A")),
+                EC.presence_of_element_located((By.CLASS_NAME, "styles_already-applied__4KDhw")),
+            ), optional=True)
             try:
                 apply_button = driver.find_element(By.CLASS_NAME, "styles_apply-button__uJI3A")
                 apply_button.click()
-                time.sleep(1)  # Allow time for potential popups or redirects
+                # Allow time for potential popups or redirects
+                waits.until(driver, 'apply-response', any_of(
+                    EC.presence_of_element_located((By.CLASS_NAME, CHAT_WINDOW_CLASS)),
+                    EC.presence_of_element_located((By.CLASS_NAME, "styles_already-applied__4KDhw")),
+                    EC.staleness_of(apply_button),
+                ), optional=True)
 
                 # Check if the chatbot window opened
-                if driver.find_elements(By.CLASS_NAME, "chatbot_DrawerContentWrapper"):
-
-                    #REMOVE ME
-                    #return 2
-
+                if driver.find_elements(By.CLASS_NAME, CHAT_WINDOW_CLASS):
                     print("Chat window opened after applying.")
-                    # Wait for the user to manually enter details in the chat window
-                    while driver.find_elements(By.CLASS_NAME, "chatbot_DrawerContentWrapper"):
-                        print("Chat window is still open. Please enter the required details.")
-                        time.sleep(5)  # Check every 5 seconds if the chat window is still open
-                    print("Chat window closed, assuming details have been entered.")
+                    if wait_for_chat:
+                        wait_for_chat_window(driver)
                     return 2
 
                 print("Successfully applied to the job using SIMPLE APPLY.")
-                time.sleep(2)  # Wait for any potential redirects or follow-up actions
+                # Wait for any potential redirects or follow-up actions
+                waits.until(driver, 'apply-settle', network_idle(), optional=True)
                 return 1
             except NoSuchElementException:
                 # Check if the job is already applied to
@@ -465,39 +2959,167 @@ def apply(driver, url):
                 else:
                     print("Apply button not found within the container.")
     except Exception as e:
+        metrics.error('apply')
         print(f"Error while attempting to apply: {e}")
+        if isinstance(e, WebDriverException) and not DriverPool._is_alive(driver):
+            raise
     return 0
 
 
+class ApplyScheduler:
+    # Applies to jobs without waiting on the chatbot. A job whose apply opens
+    # the chatbot is recorded as CHAT WINDOW at once and its tab is parked: left
+    # open for a human to answer whenever they get to it, while the next job
+    # gets a new window. The human closes a parked tab once its chat is
+    # answered; between jobs the scheduler only lists the open handles, never
+    # switching into a parked tab, and records a vanished one as CHAT CLOSED.
+    # Chatbot jobs still parked when the browser goes away stay CHAT WINDOW,
+    # the parked queue `apply --parked` works through later. With a driver pool
+    # every browser takes jobs from the same queue and parks its own tabs.
+
+    def __init__(self, store, outfile, max_parked_tabs=APPLY_MAX_PARKED_TABS, wait_for_parked=False):
+        self.store = store
+        self.outfile = outfile
+        self.writer = csv.writer(outfile)
+        self.max_parked_tabs = max_parked_tabs
+        self.wait_for_parked = wait_for_parked
+        self.outcomes = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, row, status):
+        # Written to the store and the CSV as soon as the outcome is known
+        with self._lock:
+            self.store.record_apply_status(row['Job URL'], status)
+            self.writer.writerow([row['Company Name'], row['Job Position'], row['Apply Type'], status,
+                                  row['Job URL']])
+            self.outfile.flush()
+            self.outcomes[status] += 1
+        logger.info("%s: %s", status, row['Job URL'])
+
+    def run(self, driver, rows, pool=None):
+        work_queue = queue.Queue()
+        for row in rows:
+            work_queue.put(row)
+        if pool is None:
+            self._worker(work_queue, lambda task, row: task(driver, row), lambda: driver)
+        else:
+            pool.run_workers(lambda slot, dead_slots: self._pool_worker(pool, slot, work_queue, dead_slots),
+                             work_queue, range(min(pool.size, work_queue.qsize())))
+        return self.outcomes
+
+    def _pool_worker(self, pool, slot, work_queue, dead_slots):
+        try:
+            self._worker(work_queue,
+                         lambda task, row: pool.run(slot, task, row, error_message="Error while applying to"),
+                         lambda: pool.drivers[slot])
+        except Exception as e:
+            print(f"Pool driver {slot} is unavailable: {e}")
+            dead_slots.add(slot)
+
+    def _worker(self, work_queue, run, current_driver):
+        parked = []
+        parked_in = [None]  # the driver the parked tabs belong to
+
+        def apply_next(driver, row):
+            if driver is not parked_in[0]:
+                # A restarted browser has none of the parked tabs; their chats
+                # were never answered and stay in the parked queue
+                parked.clear()
+                parked_in[0] = driver
+            logger.info("Applying to %s", row['Job URL'])
+            status = APPLY_STATUSES.get(apply(driver, str(row['Job URL']), wait_for_chat=False), 'FAILED')
+            self.record(row, status)
+            if status == 'CHAT WINDOW':
+                self._park(driver, row, parked)
+            self.check_parked(driver, parked)
+            return status
+
+        while True:
+            try:
+                row = work_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                status = run(apply_next, row)
+            except Exception:
+                # This browser is gone; leave the job to the other browsers
+                work_queue.put(row)
+                raise
+            if status is None:
+                # The browser failed before the outcome was known
+                self.record(row, 'FAILED')
+        driver = current_driver()
+        if driver is not None and parked:
+            self._finish(driver, parked)
+
+    def _park(self, driver, row, parked):
+        if len(parked) >= self.max_parked_tabs:
+            print(f"{len(parked)} tabs are parked already, {row['Job URL']} waits for `apply --parked`")
+            return
+        try:
+            parked.append((driver.current_window_handle, row))
+            # A new window rather than a tab, so the parked chat stays the
+            # visible tab of its own window while the next jobs load elsewhere
+            driver.switch_to.new_window('window')
+            print(f"Parked {row['Job URL']}, close its tab once the chat is answered ({len(parked)} waiting)")
+        except WebDriverException as e:
+            print(f"Error while opening a new tab: {e}")
+
+    def check_parked(self, driver, parked):
+        if not parked:
+            return
+        try:
+            open_handles = set(driver.window_handles)
+        except WebDriverException:
+            # The browser was restarted; its tabs are gone and their jobs stay in the parked queue
+            parked.clear()
+            return
+        for handle, row in list(parked):
+            if handle not in open_handles:
+                parked.remove((handle, row))
+                self.record(row, 'CHAT CLOSED')
+
+    def _finish(self, driver, parked):
+        if not self.wait_for_parked:
+            print(f"{len(parked)} chatbot jobs left in the parked queue, run `apply --parked` to answer them")
+            return
+        while parked:
+            print(f"{len(parked)} parked chat windows are still open. Please enter the required details and close them.")
+            waits.until(driver, 'parked-chats', lambda d: self._parked_closed(d, parked),
+                        optional=True, timeout=CHAT_WINDOW_REMINDER)
+            self.check_parked(driver, parked)
+
+    def _parked_closed(self, driver, parked):
+        # True as soon as any parked tab is gone, or the browser with them
+        try:
+            open_handles = set(driver.window_handles)
+        except WebDriverException:
+            return True
+        return any(handle not in open_handles for handle, row in parked)
+
 
-def filter_simple_apply_jobs(driver):
-    date_str = datetime.now().strftime('%Y-%m-%d')
+@timed('filter_simple_apply_jobs')
+def filter_simple_apply_jobs(driver, store, pool=None, parked=False, wait_for_parked=False):
+    # parked works through the chatbot jobs of earlier runs one at a time,
+    # waiting for the human to answer each chat window
     date_time_str = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-    input_file = f"NAUKRI_APPLY_0_job_links_{date_str}.csv"
     output_file = f"NAUKRI_APPLY_1_job_links_{date_time_str}.csv"
     try:
-        with open(input_file, mode='r', encoding='ISO-8859-1') as infile, open(output_file, mode='w', newline='', encoding='ISO-8859-1') as outfile:
-            reader = csv.DictReader(infile)
-            writer = csv.writer(outfile)
-            writer.writerow(['Company Name', 'Job Position', 'Apply Type', 'Status', 'Job URL'])
-
-            for row in reader:
-                if row['Apply Type'] == 'SIMPLE APPLY':
-                    print(row['Job URL'])
-                    apply_status = apply(driver,str(row['Job URL']))
-                    if apply_status == 1:
-                        writer.writerow([row['Company Name'], row['Job Position'],"APPLIED", row['Apply Type'], row['Job URL']])
-                    elif apply_status == 2:
-                        writer.writerow(
-                            [row['Company Name'], row['Job Position'], "CHAT WINDOW", row['Apply Type'], row['Job URL']])
-                    else:
-                        writer.writerow(
-                            [row['Company Name'], row['Job Position'], "FAILED", row['Apply Type'], row['Job URL']])
-
-        print(f"Filtered SIMPLE APPLY jobs written to {output_file}")
-    except FileNotFoundError:
-        print(f"File not found: {input_file}")
+        with open(output_file, mode='w', newline='', encoding='ISO-8859-1') as outfile:
+            csv.writer(outfile).writerow(['Company Name', 'Job Position', 'Apply Type', 'Status', 'Job URL'])
+            scheduler = ApplyScheduler(store, outfile, wait_for_parked=wait_for_parked)
+            if parked:
+                for row in store.parked_apply_jobs():
+                    logger.info("Answering the chatbot for %s", row['Job URL'])
+                    status = APPLY_STATUSES.get(apply(driver, str(row['Job URL'])), 'FAILED')
+                    scheduler.record(row, 'CHAT CLOSED' if status == 'CHAT WINDOW' else status)
+            else:
+                scheduler.run(driver, store.simple_apply_jobs(), pool)
+
+        print(f"Filtered SIMPLE APPLY jobs written to {output_file}: "
+              f"{', '.join(f'{count} {status}' for status, count in scheduler.outcomes.items()) or 'none'}")
     except Exception as e:
+        metrics.error('filter_simple_apply_jobs')
         print(f"Error while filtering SIMPLE APPLY jobs: {e}")
 
 
@@ -505,47 +3127,438 @@ def filter_simple_apply_jobs(driver):
 
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--user', required=True, help='Username for login')
-    parser.add_argument('--word', required=True, help='Password for login')
-    args = parser.parse_args()
 
-    job_portal_url = 'https://www.naukri.com'
-    # jobs_urls = [
-    #     "https://www.naukri.com/senior-data-engineer-jobs?k=senior+data+engineer&nignbevent_src=jobsearchDeskGNB&wfhType=2",
-    #     "https://www.naukri.com/senior-data-engineer-jobs-2?k=senior+data+engineer&nignbevent_src=jobsearchDeskGNB&wfhType=2",
-    #     "https://www.naukri.com/senior-data-engineer-jobs-3?k=senior+data+engineer&nignbevent_src=jobsearchDeskGNB&wfhType=2",
-    #     "https://www.naukri.com/senior-data-engineer-jobs-4?k=senior+data+engineer&nignbevent_src=jobsearchDeskGNB&wfhType=2",
-    #     "https://www.naukri.com/senior-data-engineer-jobs-5?k=senior+data+engineer&nignbevent_src=jobsearchDeskGNB&wfhType=2"
-    #
-    # ]
-    jobs_urls = [
-        "https://www.naukri.com/senior-data-engineer-jobs?k=senior+data+engineer&nignbevent_src=jobsearchDeskGNB&wfhType=2"
-    ]
+PIPELINE_QUEUE_SIZE = 200
+PIPELINE_SCORE_BATCH_SIZE = 32
+PIPELINE_APPLY_TYPE_BATCH_SIZE = 16
+PIPELINE_BATCH_WAIT = 2.0  # seconds a partial batch waits for more items
+_PIPELINE_END = object()
 
-    driver = configure_driver()
-    try:
-        login(driver, job_portal_url, args.user, args.word)
-        all_job_links = search_jobs(driver, jobs_urls)
-        print("Final collected job links:", all_job_links)
-        csv_filename = write_to_csv(all_job_links)
-        navigate_to_company_sites(driver, csv_filename)
-        filter_lead_positions()
-        rank_lead_positions()
-        #login(driver, job_portal_url, args.user, args.word)
-        find_apply_type(driver)
-        link = "https://www.naukri.com/job-listings-senior-data-engineer-pune-rudder-analytics-rudder-analytics-pune-3-to-6-years-311024003925"
-        filter_simple_apply_jobs(driver)
 
+def _queue_items(source):
+    # Iterates a pipeline queue until its producer sends the end marker
+    while True:
+        item = source.get()
+        if item is _PIPELINE_END:
+            return
+        yield item
 
 
+def _queue_batches(source, batch_size, max_wait=PIPELINE_BATCH_WAIT):
+    # Groups queue items into batches, handing over a partial batch when no new
+    # item arrives for max_wait seconds so slow producers do not hold results back
+    batch = []
+    while True:
+        try:
+            item = source.get(timeout=max_wait if batch else None)
+        except queue.Empty:
+            yield batch
+            batch = []
+            continue
+        if item is _PIPELINE_END:
+            if batch:
+                yield batch
+            return
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+
+
+def _run_pipeline_stage(name, work, inputs, outputs):
+    # Runs one stage; its consumers always get the end marker, even after an
+    # error, and a failed stage keeps draining its inputs so producers never block
+    def target():
+        try:
+            work()
+        except Exception as e:
+            print(f"Pipeline stage {name} failed: {e}")
+            for source in inputs:
+                for _ in _queue_items(source):
+                    pass
+        finally:
+            for output in outputs:
+                output.put(_PIPELINE_END)
+    thread = threading.Thread(target=target, name=f"pipeline-{name}", daemon=True)
+    thread.start()
+    return thread
+
+
+def run_streaming_pipeline(driver, store, jobs_urls, job_portal_url, cascade=False,
+                           lexical_cutoff=CASCADE_LEXICAL_CUTOFF, top_k=CASCADE_TOP_K, http=False,
+                           http_concurrency=HTTP_APPLY_TYPE_CONCURRENCY, queue_size=PIPELINE_QUEUE_SIZE,
+                           max_pages=SEARCH_MAX_PAGES):
+    # collect -> company expansion -> lead filter -> score, with collect also
+    # feeding apply-type. Stages run in their own threads joined by bounded
+    # queues, so a full queue slows its producer down instead of growing memory.
+    # The search pages use the logged-in driver; company expansion and the
+    # browser apply-type check each get their own browser with copied cookies.
+    print("start streaming pipeline")
+    cookies = export_session_cookies(driver)
+    user_agent = driver.execute_script("return navigator.userAgent") if http else None
+    stage_drivers = DriverPool(2, job_portal_url, cookies=cookies, name='stage')
+    company_slot, apply_type_slot = 0, 1
+
+    search_to_company = queue.Queue(maxsize=queue_size)
+    search_to_apply_type = queue.Queue(maxsize=queue_size)
+    company_to_score = queue.Queue(maxsize=queue_size)
+    started = time.time()
+
+    def collect():
+        seen_job_ids = set()
+        for jobs_url in jobs_urls:
+            if jobs_url is None:
+                continue
+            # Each page's jobs go downstream as soon as the page is read
+            for job_links in iter_search_pages(driver, jobs_url, max_pages=max_pages, seen_job_ids=seen_job_ids):
+                store.add_search_jobs(job_links)
+                for job_link in job_links:
+                    search_to_company.put(job_link)
+                    search_to_apply_type.put(job_link)
+
+    def expand_companies():
+        visited = set()
+        queued_job_urls = set()
+        for company_name, job_position, job_url, company_url in _queue_items(search_to_company):
+            if company_url is None or company_url in visited:
+                continue
+            visited.add(company_url)
+            if not store.company_needs_expansion(company_url):
+                # Expanded recently: its cached jobs count as seen and were scored back then
+                store.touch_jobs(store.cached_company_job_urls(company_url))
+                continue
+            company_job_links = stage_drivers.run(company_slot, _collect_company_page, company_url,
+                                                  error_message="Error while navigating to company site")
+            if company_job_links is None:
+                continue
+            store.add_company_jobs(company_job_links)
+            store.record_company_jobs({company_url: [job_url for _, _, job_url in company_job_links]})
+            for company_job_link in company_job_links:
+                # A job listed under several companies is scored once
+                if company_job_link[2] not in queued_job_urls:
+                    queued_job_urls.add(company_job_link[2])
+                    company_to_score.put(company_job_link)
+
+    def lead_positions(batches):
+        # Lead filter between company expansion and scoring
+        for batch in batches:
+            leads = {job_url: {'Company Name': company_name, 'Job Position': job_position,
+                               'Company Job URL': job_url}
+                     for company_name, job_position, job_url in batch if 'lead' in (job_position or '').lower()}
+            unscored = store.unscored_job_urls(leads, lexical_cutoff=lexical_cutoff if cascade else None)
+            rows = [row for job_url, row in leads.items() if job_url in unscored]
+            if rows:
+                yield rows
+
+    def score():
+        # Each batch is scored on its own: TF-IDF weights are fit per batch, and
+        # the lexical cutoff judges rows against those. main() rejects a cascade
+        # top-k here, which would only pick the best rows of each batch.
+        for rows in lead_positions(_queue_batches(company_to_score, PIPELINE_SCORE_BATCH_SIZE)):
+            scored_jobs = score_and_record_leads(store, rows, cascade=cascade, lexical_cutoff=lexical_cutoff,
+                                                 top_k=top_k)
+            for row in scored_jobs:
+                if _passes_rank_threshold(row):
+                    logger.info("[%.1fs] Ranked: %s, %s, fit %.3f, %s", time.time() - started, row['Company Name'],
+                                row['Job Position'], row['Fit Score'], row['Company Job URL'])
+
+    def check_apply_types():
+        for batch in _queue_batches(search_to_apply_type, PIPELINE_APPLY_TYPE_BATCH_SIZE):
+            pending = store.job_urls_needing_apply_type(job_url for _, _, job_url, _ in batch)
+            job_links = [job_url for _, _, job_url, _ in batch if job_url in pending]
+            if not job_links:
+                continue
+            if http:
+                job_pages = fetch_job_pages_over_http(job_links, cookies, user_agent=user_agent,
+                                                      concurrency=http_concurrency)
+            else:
+                job_pages = [None] * len(job_links)
+            for job_link, job_page in zip(job_links, job_pages):
+                if job_page is None:
+                    job_page = stage_drivers.run(apply_type_slot, _inspect_job_page, job_link,
+                                                 error_message="Exception while checking apply type for")
+                if job_page is not None:
+                    _record_job_page(store, job_link, job_page)
+
+    try:
+        stages = [
+            _run_pipeline_stage('collect', collect, [], [search_to_company, search_to_apply_type]),
+            _run_pipeline_stage('company', expand_companies, [search_to_company], [company_to_score]),
+            _run_pipeline_stage('score', score, [company_to_score], []),
+            _run_pipeline_stage('apply-type', check_apply_types, [search_to_apply_type], []),
+        ]
+        for stage in stages:
+            stage.join()
+        # Not from the apply-type stage itself: the score stage shares the embedding cache
+        sync_job_index(store)
+        write_ranked_lead_positions(store)
+        print(f"Streaming pipeline finished in {time.time() - started:.1f}s")
+    finally:
+        stage_drivers.close()
+
 
+JOB_PORTAL_URL = 'https://www.naukri.com'
+# SEARCH_URLS = [
+#     "https://www.naukri.com/senior-data-engineer-jobs?k=senior+data+engineer&nignbevent_src=jobsearchDeskGNB&wfhType=2",
+#     "https://www.naukri.com/senior-data-engineer-jobs-2?k=senior+data+engineer&nignbevent_src=jobsearchDeskGNB&wfhType=2",
+#     "https://www.naukri.com/senior-data-engineer-jobs-3?k=senior+data+engineer&nignbevent_src=jobsearchDeskGNB&wfhType=2",
+#     "https://www.naukri.com/senior-data-engineer-jobs-4?k=senior+data+engineer&nignbevent_src=jobsearchDeskGNB&wfhType=2",
+#     "https://www.naukri.com/senior-data-engineer-jobs-5?k=senior+data+engineer&nignbevent_src=jobsearchDeskGNB&wfhType=2"
+#
+# ]
+# Later pages of each search are found by search_jobs
+SEARCH_URLS = [
+    "https://www.naukri.com/senior-data-engineer-jobs?k=senior+data+engineer&nignbevent_src=jobsearchDeskGNB&wfhType=2"
+]
+COMMANDS = ['scrape', 'expand', 'rank', 'apply-type', 'apply', 'all']
+# Commands that log in and drive a browser; rank works on the job store alone
+BROWSER_COMMANDS = ['scrape', 'expand', 'apply-type', 'apply', 'all']
+RANK_COMMANDS = ['rank', 'all']
+
+
+def _since_timestamp(value):
+    try:
+        return _timestamp(datetime.fromisoformat(value))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a date or time: {value}")
+
+
+def build_parser():
+    # Options are grouped by the stage that reads them, and every subcommand
+    # takes the groups of the stages it runs
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--store', default=JOB_STORE_PATH, help='SQLite job store shared between runs')
+    common.add_argument('--since', type=_since_timestamp, default=None, metavar='TIME',
+                        help='Jobs seen from this time on, e.g. "2024-11-02 09:00", make up the current run '
+                             f'(default: the last {CURRENT_RUN_WINDOW.total_seconds() / 3600:g} hours)')
+    common.add_argument('--export-csv', action='store_true',
+                        help="Also write the dated job, company, lead and apply type CSVs for this run's jobs")
+    common.add_argument('--log-level', default='INFO', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help='DEBUG also logs every job tuple and apply type as it is read')
+    common.add_argument('--profile', nargs='+', default=[], choices=PROFILE_STAGES, metavar='STAGE',
+                        help=f"Run these stages under cProfile: {', '.join(PROFILE_STAGES)}")
+    common.add_argument('--run-report', default=RUN_REPORT_PATH, help='Where to write the JSON run report')
+    common.add_argument('--prometheus-textfile', default=PROMETHEUS_TEXTFILE_PATH,
+                        help='Where to write the metrics in Prometheus textfile format')
+    common.add_argument('--metrics-interval', type=float, default=METRICS_EXPORT_INTERVAL,
+                        help='Seconds between live rewrites of the Prometheus textfile during the run; 0 disables')
+    common.add_argument('--request-rate', type=float, default=GOVERNOR_RATE,
+                        help='Requests/s to the portal to start from; raised while the portal keeps up')
+    common.add_argument('--max-request-rate', type=float, default=GOVERNOR_MAX_RATE,
+                        help='Requests/s to the portal never exceeded')
+    common.add_argument('--max-concurrency', type=int, default=GOVERNOR_MAX_CONCURRENCY,
+                        help='Requests to the portal in flight at most, across browsers and HTTP')
+
+    browser = argparse.ArgumentParser(add_help=False)
+    browser.add_argument('--user', required=True, help='Username for login')
+    browser.add_argument('--word', required=True, help='Password for login')
+    browser.add_argument('--browser-profile', choices=['default', 'fast'], default=BROWSER_PROFILE,
+                         help='fast runs headless with eager page loads and blocks images, media, fonts and trackers')
+    browser.add_argument('--no-session-cache', action='store_true',
+                         help='Always run the login flow instead of restoring the saved session')
+
+    drivers = argparse.ArgumentParser(add_help=False)
+    drivers.add_argument('--drivers', type=int, default=DRIVER_POOL_SIZE,
+                         help='Number of browsers used to visit search, company and job pages in parallel')
+
+    http = argparse.ArgumentParser(add_help=False)
+    http.add_argument('--http-concurrency', type=int, default=HTTP_APPLY_TYPE_CONCURRENCY,
+                      help='Maximum concurrent page requests in --http-apply-type and --http-companies mode')
+
+    search = argparse.ArgumentParser(add_help=False)
+    search.add_argument('--query', action='append', default=[],
+                        help='Search for these keywords too, e.g. --query "senior data engineer"; can be repeated')
+    search.add_argument('--max-pages', type=int, default=SEARCH_MAX_PAGES,
+                        help='Results pages to read per search at most; pagination stops earlier at the last page')
+    search.add_argument('--page-concurrency', type=int, default=SEARCH_PAGE_CONCURRENCY,
+                        help='Results pages of one search loaded at once, up to --drivers')
+
+    companies = argparse.ArgumentParser(add_help=False)
+    companies.add_argument('--http-companies', action='store_true',
+                           help='Read company pages over plain HTTP first, using the browser only when that fails')
+
+    apply_type = argparse.ArgumentParser(add_help=False)
+    apply_type.add_argument('--http-apply-type', action='store_true',
+                            help='Check apply types over plain HTTP with the browser session cookies')
+
+    applying = argparse.ArgumentParser(add_help=False)
+    applying.add_argument('--wait-parked', action='store_true',
+                          help='Before exiting, wait for the chat windows of parked chatbot jobs to be answered')
+
+    rank = argparse.ArgumentParser(add_help=False)
+    rank.add_argument('--cascade', action='store_true',
+                      help='Only send lead rows that pass the lexical prefilter to the embedding model')
+    rank.add_argument('--lexical-cutoff', type=float, default=CASCADE_LEXICAL_CUTOFF,
+                      help='Minimum lexical score for a row to reach the embedding model in cascade mode')
+    rank.add_argument('--cascade-top-k', type=int, default=CASCADE_TOP_K,
+                      help='Send at most this many rows, best lexical score first, to the embedding model')
+    rank.add_argument('--workers', type=int, default=SCORING_WORKERS,
+                      help='Processes encoding job positions in parallel, each with its own copy of the model')
+    rank.add_argument('--embedding-backend', choices=EMBEDDING_BACKENDS, default=EMBEDDING_BACKEND,
+                      help='torch (fp32), torch-int8 (dynamically quantized) or onnx (ONNX Runtime)')
+    rank.add_argument('--model-dir', default=None,
+                      help=f"Local sentence-transformers model directory to load instead of {SIMILARITY_MODEL_NAME}")
+    rank.add_argument('--resume', default=None,
+                      help='Plain-text resume to match against every stored job after ranking')
+    rank.add_argument('--match-top-k', type=int, default=MATCH_TOP_K, help='Job matches to list for --resume')
+    rank.add_argument('--recall-report', action='store_true',
+                      help='Compare cascade output with a full scoring run after ranking')
+
+    parser = argparse.ArgumentParser(
+        description='Runs the whole pipeline when no subcommand is given; '
+                    'each stage reads what the previous ones left in the job store')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('scrape', parents=[common, browser, drivers, search],
+                          help='Collect job links from the search results pages')
+    subparsers.add_parser('expand', parents=[common, browser, drivers, http, companies],
+                          help='Collect the jobs listed on the company pages of scraped jobs')
+    subparsers.add_parser('rank', parents=[common, rank],
+                          help='Score the stored lead positions against the resume keywords; no browser needed')
+    subparsers.add_parser('apply-type', parents=[common, browser, drivers, http, apply_type],
+                          help='Record the apply type and description of each stored job')
+    apply_jobs = subparsers.add_parser('apply', parents=[common, browser, drivers, applying],
+                                       help='Apply to the stored simple apply jobs; chatbot jobs are parked, not waited on')
+    apply_jobs.add_argument('--parked', action='store_true',
+                            help='Only apply to parked chatbot jobs of earlier runs, waiting at each chat window')
+    run_all = subparsers.add_parser('all', parents=[common, browser, drivers, http, search, companies, apply_type, rank,
+                                                    applying],
+                                    help='Run every stage in order')
+    run_all.add_argument('--stream', action='store_true',
+                         help='Run scraping, company expansion, ranking and apply-type checks as overlapping '
+                              f'stages. Leads are scored in batches of {PIPELINE_SCORE_BATCH_SIZE}, each with its own '
+                              'TF-IDF weights, so lexical scores and --lexical-cutoff differ slightly from `rank`; '
+                              '--cascade-top-k is not available')
+    run_all.set_defaults(parked=False)
+    return parser
+
+
+def run_scrape(args, store, driver, pool):
+    jobs_urls = SEARCH_URLS + [search_query_url(query, JOB_PORTAL_URL) for query in args.query]
+    all_job_links = search_jobs(driver, jobs_urls, pool, max_pages=args.max_pages, concurrency=args.page_concurrency)
+    logger.debug("Final collected job links: %s", all_job_links)
+    store.add_search_jobs(all_job_links)
+
+
+def run_expand(args, store, driver, pool):
+    navigate_to_company_sites(driver, store, pool, http=args.http_companies, http_concurrency=args.http_concurrency)
+
+
+def run_rank(args, store, driver, pool):
+    rank_lead_positions(store, cascade=args.cascade, lexical_cutoff=args.lexical_cutoff, top_k=args.cascade_top_k)
+    run_rank_reports(args, store)
+
+
+def run_rank_reports(args, store):
+    if args.recall_report:
+        cascade_recall_report(store, top_k=args.cascade_top_k)
+    if args.resume:
+        with open(args.resume, mode='r', encoding='utf-8', errors='replace') as file:
+            matches = match_resume(store, file.read(), top_k=args.match_top_k)
+        for match in matches:
+            print(f"{match['similarity']:.3f}  {match.get('company_name')}, {match.get('job_position')}, "
+                  f"{match['job_url']}")
+        write_resume_matches(matches)
+
+
+def run_apply_type(args, store, driver, pool):
+    find_apply_type(driver, store, pool, http=args.http_apply_type, http_concurrency=args.http_concurrency)
+
+
+def run_apply(args, store, driver, pool):
+    filter_simple_apply_jobs(driver, store, pool, parked=args.parked, wait_for_parked=args.wait_parked)
+
+
+def run_all(args, store, driver, pool):
+    if args.stream:
+        jobs_urls = SEARCH_URLS + [search_query_url(query, JOB_PORTAL_URL) for query in args.query]
+        run_streaming_pipeline(driver, store, jobs_urls, JOB_PORTAL_URL, cascade=args.cascade,
+                               lexical_cutoff=args.lexical_cutoff, top_k=args.cascade_top_k,
+                               http=args.http_apply_type, http_concurrency=args.http_concurrency,
+                               max_pages=args.max_pages)
+        run_rank_reports(args, store)
+    else:
+        run_scrape(args, store, driver, pool)
+        run_expand(args, store, driver, pool)
+        run_rank(args, store, driver, pool)
+        #login(driver, job_portal_url, args.user, args.word)
+        run_apply_type(args, store, driver, pool)
+    run_apply(args, store, driver, pool)
+
+
+COMMAND_RUNNERS = {
+    'scrape': run_scrape,
+    'expand': run_expand,
+    'rank': run_rank,
+    'apply-type': run_apply_type,
+    'apply': run_apply,
+    'all': run_all,
+}
+
+
+def main(argv=None):
+    global BROWSER_PROFILE, SCORING_WORKERS, EMBEDDING_BACKEND, SIMILARITY_MODEL_NAME, governor
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if not argv or argv[0] not in COMMANDS + ['-h', '--help']:
+        # Without a subcommand the whole pipeline runs, as it did before subcommands existed
+        argv = ['all'] + argv
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'stream', False) and args.cascade_top_k is not None:
+        # A top-k over a batch is not the top-k over all candidates
+        parser.error('--cascade-top-k cannot be combined with --stream')
+
+    if args.command in BROWSER_COMMANDS:
+        BROWSER_PROFILE = args.browser_profile
+    if args.command in RANK_COMMANDS:
+        SCORING_WORKERS = args.workers
+        EMBEDDING_BACKEND = args.embedding_backend
+        if args.model_dir:
+            SIMILARITY_MODEL_NAME = args.model_dir
+    logging.basicConfig(level=args.log_level, format='%(message)s')
+    profiled_stages.update(args.profile)
+    governor = RequestGovernor(rate=min(args.request_rate, args.max_request_rate), max_rate=args.max_request_rate,
+                               concurrency=min(GOVERNOR_CONCURRENCY, args.max_concurrency),
+                               max_concurrency=args.max_concurrency)
+    if args.metrics_interval > 0:
+        metrics.start_export(args.prometheus_textfile, args.metrics_interval)
+
+    store = JobStore(args.store, seen_since=args.since)
+    driver = None
+    pool = None
+    try:
+        if args.command in BROWSER_COMMANDS:
+            driver = configure_driver()
+            if args.no_session_cache:
+                login(driver, JOB_PORTAL_URL, args.user, args.word)
+            else:
+                SessionManager(JOB_PORTAL_URL, args.user, args.word).ensure_login(driver)
+            if getattr(args, 'drivers', 1) > 1:
+                # Extra browsers reuse the session of the first login instead of logging in again
+                pool = DriverPool(args.drivers, JOB_PORTAL_URL, cookies=export_session_cookies(driver))
+        COMMAND_RUNNERS[args.command](args, store, driver, pool)
+        if args.export_csv:
+            store.export_csvs()
     finally:
-        driver.quit()
+        if pool is not None:
+            pool.close()
+        if driver is not None:
+            driver.quit()
+        store.close()
+        waits.report()
+        waits.save()
+        if _similarity_engine is not None:
+            _similarity_engine.close()
+            if _similarity_engine.cache is not None:
+                # Saves the LRU ticks of this run's hits, which no miss flushed
+                _similarity_engine.cache.flush()
+                _similarity_engine.cache.report()
+        metrics.stop_export()
+        metrics.print_summary()
+        metrics.write_json(args.run_report)
+        metrics.write_prometheus(args.prometheus_textfile)
 
 
 if __name__ == "__main__":
     main()
     #runtime params
-    #--user username --word password
+    #[scrape|expand|rank|apply-type|apply|all] --user username --word password
@@ -1,6 +1,481 @@
+import os
+import json
+import time
+import zlib
+import socket
+import tempfile
+import urllib.request
+
+import numpy as np
+
+import bench
+import naukri
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+SEARCH_URL = 'https://www.naukri.com/data-engineer-jobs'
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as file:
+        return file.read()
+
+
+def job_tuples(jobs):
+    return [(job['company_name'], job['job_position'], job['job_href'], job['company_href']) for job in jobs]
+
+
+def test_parse_search_results():
+    # The second tuple has relative links, resolved against the page URL
+    jobs = naukri.parse_job_tuples(read_fixture('search_results.html'), SEARCH_URL)
+    assert [job['job_id'] for job in jobs] == ['311024003925', '281024501234', '301024998877']
+    assert job_tuples(jobs) == [
+        ('Rudder Analytics', 'Senior Data Engineer',
+         'https://www.naukri.com/job-listings-senior-data-engineer-rudder-analytics-pune-3-to-6-years-311024003925',
+         'https://www.naukri.com/rudder-analytics-jobs-careers-1234567'),
+        ('Acme Corp', 'Lead Data Engineer & Architect',
+         'https://www.naukri.com/job-listings-lead-data-engineer-architect-acme-bengaluru-8-to-12-years-281024501234',
+         'https://www.naukri.com/acme-corp-jobs-careers-7654321'),
+        ('DataWise', 'GenAI Tech Lead',
+         'https://www.naukri.com/job-listings-genai-tech-lead-datawise-hyderabad-10-to-15-years-301024998877',
+         'https://www.naukri.com/datawise-jobs-careers-1122334'),
+    ]
+    # Without a base URL the relative links are left as they are
+    jobs = naukri.parse_job_tuples(read_fixture('search_results.html'))
+    assert jobs[1]['job_href'] == '/job-listings-lead-data-engineer-architect-acme-bengaluru-8-to-12-years-281024501234'
+    assert jobs[1]['company_href'] == '/acme-corp-jobs-careers-7654321'
+
+
+def test_parse_company_jobs():
+    jobs = naukri.parse_job_tuples(read_fixture('company_jobs.html'), 'https://www.naukri.com/rudder-analytics-jobs')
+    assert [job['job_id'] for job in jobs] == ['311024003925', '311024003926']
+    assert job_tuples(jobs) == [
+        ('Rudder Analytics', 'Senior Data Engineer',
+         'https://www.naukri.com/job-listings-senior-data-engineer-rudder-analytics-pune-3-to-6-years-311024003925',
+         'https://www.naukri.com/rudder-analytics-jobs-careers-1234567'),
+        ('Rudder Analytics', 'Data Engineering Lead',
+         'https://www.naukri.com/job-listings-data-engineering-lead-rudder-analytics-pune-6-to-10-years-311024003926',
+         'https://www.naukri.com/rudder-analytics-jobs-careers-1234567'),
+    ]
+
+
+def job_page(button_class):
+    return read_fixture('job_page.html').replace('styles_apply-button__uJI3A', button_class)
+
+
+def unused_url():
+    # Nothing listens on a port the OS just handed out and took back
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    return f"http://127.0.0.1:{port}/job"
+
+
+def test_classify_apply_types():
+    assert naukri.classify_apply_types(read_fixture('job_page.html')) == ['SIMPLE APPLY']
+    assert naukri.classify_apply_types(job_page('styles_company-site-button__C_2YK')) == ['COMPANY APPLY']
+    assert naukri.classify_apply_types(job_page('styles_already-applied__4KDhw')) == ['ALREADY APPLIED']
+    assert naukri.classify_apply_types(read_fixture('search_results.html')) is None
+    apply_types, job_description = naukri.inspect_job_page_html(read_fixture('job_page.html'))
+    assert apply_types == ['SIMPLE APPLY']
+    assert job_description.startswith('Build and run batch and streaming data pipelines on Spark and Airflow,')
+    assert naukri.inspect_job_page_html(read_fixture('search_results.html')) is None
+
+
+def test_fetch_job_pages_over_http():
+    # Pages from a stub portal; no retries so the failing ones come back at once
+    portal = bench.StubPortal(routes={
+        '/simple': bench.html_route(read_fixture('job_page.html')),
+        '/company': bench.html_route(job_page('styles_company-site-button__C_2YK')),
+        '/applied': bench.html_route(job_page('styles_already-applied__4KDhw')),
+        '/no-container': bench.html_route(read_fixture('search_results.html')),
+        '/server-error': lambda handler: (500, {'Content-Type': 'text/plain'}, 'error'),
+    })
+    saved_governor = naukri.governor
+    naukri.governor = bench.unpaced_governor()
+    try:
+        with portal:
+            paths = ['/simple', '/company', '/applied', '/no-container', '/missing', '/server-error']
+            results = naukri.fetch_job_pages_over_http([portal.url + path for path in paths] + [unused_url()],
+                                                       [{'name': 'nauk_at', 'value': 'test'}], timeout=5)
+    finally:
+        naukri.governor = saved_governor
+    assert [result and result[0] for result in results] == [
+        ['SIMPLE APPLY'], ['COMPANY APPLY'], ['ALREADY APPLIED'], None, None, None, None]
+    assert results[0][1].startswith('Build and run batch')
+    assert portal.requests['/server-error'] == 1
+
+
+class HttpWebDriver(bench.FakeWebDriver):
+    # A FakeWebDriver that loads its pages from a stub portal, sending its
+    # cookies along like a browser would
+    def __init__(self):
+        super().__init__({})
+        self.cookies = {}
+        self.local_storage = {}
+
+    def get(self, url):
+        cookie_header = '; '.join(f"{name}={value}" for name, value in self.cookies.items())
+        with urllib.request.urlopen(urllib.request.Request(url, headers={'Cookie': cookie_header})) as response:
+            self.page_source = response.read().decode('utf-8')
+        self.current_url = url
+        self.pages_served += 1
+
+    def refresh(self):
+        self.get(self.current_url)
+
+    def get_cookies(self):
+        return [{'name': name, 'value': value} for name, value in self.cookies.items()]
+
+    def add_cookie(self, cookie):
+        self.cookies[cookie['name']] = cookie['value']
+
+    def delete_all_cookies(self):
+        self.cookies.clear()
+
+    def execute_script(self, script, *args):
+        if 'localStorage.setItem' in script:
+            self.local_storage.update(args[0])
+            return None
+        if 'window.localStorage' in script:
+            return dict(self.local_storage)
+        return super().execute_script(script, *args)
+
+
+def test_session_restore():
+    # Fresh browsers restoring a saved session never reach the login flow
+    portal = bench.StubPortal(routes={
+        '/': bench.stub_home,
+        '/login': lambda handler: (200, {'Content-Type': 'application/json'}, '{}'),
+    })
+    saved_governor, saved_login = naukri.governor, naukri.login
+    logins = []
+    naukri.governor = bench.unpaced_governor()
+    naukri.login = lambda *args: logins.append(args)
+    try:
+        with portal, tempfile.TemporaryDirectory() as directory:
+            manager = naukri.SessionManager(portal.url + '/', 'user', 'password',
+                                            path=os.path.join(directory, 'session.bin'))
+            logged_in = HttpWebDriver()
+            name, value = bench.STUB_LOGIN_COOKIE.split('=')
+            logged_in.add_cookie({'name': name, 'value': value})
+            logged_in.local_storage['profile'] = 'stub'
+            manager.save(logged_in)
+            for _ in range(3):
+                driver = HttpWebDriver()
+                manager.ensure_login(driver)
+                assert driver.cookies[name] == value and driver.local_storage == {'profile': 'stub'}
+                assert naukri.SessionManager.is_logged_in(driver)
+            assert portal.requests['/login'] == 0 and not logins
+            # A session the portal no longer accepts is not taken for a login
+            stale = HttpWebDriver()
+            assert not manager.restore(stale, {'cookies': [{'name': name, 'value': 'expired-token'}]})
+    finally:
+        naukri.governor, naukri.login = saved_governor, saved_login
+
+
+def test_governor_aimd():
+    governor = naukri.RequestGovernor(rate=8.0, min_rate=2.0, max_rate=10.0, burst=2, concurrency=4,
+                                      max_concurrency=4)
+    ticket = governor.acquire()
+    governor.release(ticket, 'ok')
+    assert governor.rate == 8.0 + 1 / 8.0 and governor.concurrency == 4
+    # A throttled response halves both limits and pauses for its Retry-After
+    first, second = governor.acquire(), governor.acquire()
+    assert governor.release(first, 'throttled', retry_after=0.5) == 'throttled'
+    assert governor.rate == (8.0 + 1 / 8.0) / 2 and governor.concurrency == 2
+    # The other request was already in flight before the cut and does not cut again
+    governor.release(second, 'error')
+    assert governor.rate == (8.0 + 1 / 8.0) / 2 and governor.concurrency == 2
+    started = time.monotonic()
+    governor.release(governor.acquire(), 'ok')
+    assert time.monotonic() - started >= 0.45
+    # Slow responses count as congestion and the rate never falls under min_rate
+    governor.slow_response = 0
+    for _ in range(3):
+        assert governor.release(governor.acquire(), 'ok') == 'slow'
+    assert governor.rate == 2.0 and governor.concurrency == 1
+    assert governor.outcomes == {'ok': 2, 'throttled': 1, 'error': 1, 'slow': 3}
+
+
+class RecordingRoute(bench.RateLimitedRoute):
+    # Remembers when each response was sent and with which status
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.responses = []
+
+    def __call__(self, handler):
+        status, headers, body = super().__call__(handler)
+        self.responses.append((time.monotonic(), status))
+        return status, headers, body
+
+
+def test_governor_against_rate_limited_portal():
+    # One request at a time against a portal allowing 5 requests/s: the
+    # governor backs off after the 429s, waits out each Retry-After and still
+    # fetches every page
+    route = RecordingRoute(5, '429', retry_after=1)
+    saved_governor = naukri.governor
+    naukri.governor = naukri.RequestGovernor(rate=20.0, max_rate=20.0, burst=4, concurrency=1, max_concurrency=1,
+                                             retries=5)
+    try:
+        with bench.StubPortal({'/job-listings-*': route}) as portal:
+            urls = [f"{portal.url}/job-listings-{index}" for index in range(20)]
+            results = naukri.fetch_pages_over_http(urls, [], lambda html, url: len(html), concurrency=1)
+        governor = naukri.governor
+    finally:
+        naukri.governor = saved_governor
+    assert all(result is not None for result in results)
+    assert route.throttled and governor.outcomes['throttled'] == route.throttled
+    assert governor.rate < 20.0
+    for (throttled_at, status), (next_at, _) in zip(route.responses, route.responses[1:]):
+        if status == 429:
+            assert next_at - throttled_at >= 0.95
+
+
+def test_embedding_cache_lru():
+    vectors = {text: [float(index), 1.0, 2.0] for index, text in enumerate('abcde')}
+    with tempfile.TemporaryDirectory() as directory:
+        cache = naukri.EmbeddingCache('model', cache_dir=directory, max_entries=3)
+        cache.put_many(['a', 'b', 'c'], [vectors[text] for text in 'abc'])
+        # Using a makes b the least recently used entry, so d takes its row
+        assert cache.get_many(['a'])[0].tolist() == vectors['a']
+        cache.put_many(['d'], [vectors['d']])
+        assert cache.evictions == 1
+        assert [vector is not None for vector in cache.get_many(['a', 'b', 'c', 'd'])] == [True, False, True, True]
+        cache.flush()
+
+        # A new process sees the same entries and recency
+        cache = naukri.EmbeddingCache('model', cache_dir=directory, max_entries=3)
+        assert [vector.tolist() for vector in cache.get_many(['d', 'a'])] == [vectors['d'], vectors['a']]
+        cache.put_many(['e'], [vectors['e']])
+        assert cache.get_many(['c', 'e'])[0] is None and cache.get_many(['e'])[0].tolist() == vectors['e']
+        cache.flush()
+
+        # A cache written for another model is ignored
+        assert naukri.EmbeddingCache('other-model', cache_dir=directory)._entries == {}
+        os.rename(os.path.join(directory, 'model'), os.path.join(directory, 'other-model'))
+        assert naukri.EmbeddingCache('other-model', cache_dir=directory).get_many(['e']) == [None]
+
+
+def search_links(pages, jobs_url, max_pages=10, seen_job_ids=None):
+    # Job links iter_search_pages yields from fake results pages, and the pages it loaded
+    driver = bench.FakeWebDriver(pages)
+    saved_governor, saved_waits = naukri.governor, naukri.waits
+    naukri.governor = bench.unpaced_governor()
+    # Pages past the end of the results wait for tuples only briefly
+    naukri.waits = naukri.WaitEngine(default_timeout=0.2, path=None)
+    try:
+        links = [job_href for job_links in naukri.iter_search_pages(driver, jobs_url, max_pages=max_pages,
+                                                                     seen_job_ids=seen_job_ids)
+                 for _, _, job_href, _ in job_links]
+    finally:
+        naukri.governor, naukri.waits = saved_governor, saved_waits
+    return links, driver.pages_served
+
+
+def test_search_pagination_stops():
+    corpus = bench.synthetic_corpus(50)
+    corpus_links = [job['job_href'] for job in corpus]
+    pages = bench.search_pages(corpus)
+    jobs_url = bench.FAKE_PORTAL_URL + '/synthetic-jobs'
+    # Three pages of results, then a page without job tuples
+    assert search_links(pages, jobs_url) == (corpus_links, 4)
+    # The portal repeats its last page for every page number past the end
+    repeating = dict(pages, **{'/synthetic-jobs-*': pages['/synthetic-jobs-3']})
+    del repeating['/synthetic-jobs-3']
+    assert search_links(repeating, jobs_url) == (corpus_links, 4)
+    assert search_links(pages, jobs_url, max_pages=2) == (corpus_links[:40], 2)
+    # A search starting on a later page
+    assert search_links(pages, jobs_url + '-2') == (corpus_links[20:], 3)
+    # A second search whose first page only has jobs the first search yielded
+    # still goes on to its own new jobs, without yielding the shared ones again
+    seen_job_ids = set()
+    search_links(pages, jobs_url, max_pages=1, seen_job_ids=seen_job_ids)
+    assert search_links(pages, jobs_url, seen_job_ids=seen_job_ids) == (corpus_links[20:], 4)
+
+
+def bag_of_words(texts, dim=64):
+    # A stand-in text encoder: texts sharing words get similar vectors
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in text.lower().split():
+            vectors[row, zlib.crc32(word.encode('utf-8')) % dim] += 1
+    return vectors
+
+
+class CountingEncoder:
+    # Records every text it is asked to encode
+    def __init__(self):
+        self.texts = []
+
+    def encode(self, texts):
+        self.texts.extend(texts)
+        return bag_of_words(texts)
+
+
+def test_job_vector_index():
+    jobs = [('https://x/data', 'lead data engineer spark airflow'),
+            ('https://x/genai', 'genai tech lead llm retrieval'),
+            ('https://x/frontend', 'frontend developer react css')]
+    with tempfile.TemporaryDirectory() as directory:
+        encoder = CountingEncoder()
+        index = naukri.JobVectorIndex('model', index_dir=directory)
+        assert index.update(jobs, encoder.encode) == 3
+        assert [job_url for job_url, _ in index.search(bag_of_words(['spark data engineer'])[0], 2)] == [
+            'https://x/data', 'https://x/genai']
+        # Only new or changed texts are encoded again
+        assert index.update(jobs, encoder.encode) == 0
+        assert index.update([('https://x/frontend', 'frontend lead react')], encoder.encode) == 1
+        assert len(encoder.texts) == 4 and len(index) == 3
+        index.synced_at = '2024-11-02 09:00:00'
+        index.save()
+
+        index = naukri.JobVectorIndex('model', index_dir=directory)
+        assert len(index) == 3 and index.synced_at == '2024-11-02 09:00:00'
+        (job_url, similarity), = index.search(bag_of_words(['frontend lead react'])[0], 1)
+        assert job_url == 'https://x/frontend' and abs(similarity - 1.0) < 1e-5
+        assert index.update(jobs[:2], encoder.encode) == 0
+
+
+def test_job_vector_index_lists():
+    # Past JOB_INDEX_IVF_MIN_SIZE jobs a query only scans its closest lists,
+    # and probing every list gives the exact search
+    rng = np.random.default_rng(0)
+    words = [f"word{number}" for number in range(200)]
+    jobs = [(f"https://x/{number}", ' '.join(rng.choice(words, 8))) for number in range(400)]
+    saved_min_size = naukri.JOB_INDEX_IVF_MIN_SIZE
+    naukri.JOB_INDEX_IVF_MIN_SIZE = 100
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            index = naukri.JobVectorIndex('model', index_dir=directory)
+            index.update(jobs[:300], bag_of_words)
+            assert index.centroids is not None and index.trained_rows == 300
+            index.update(jobs[300:], bag_of_words)
+            assert len(index.assignments) == 400
+            for job_url, text in jobs[::40]:
+                query = bag_of_words([text])[0]
+                assert index.search(query, 1)[0][0] == job_url
+                # Compared by similarity, the bag of words gives many ties
+                exact = np.sort(index._vectors[:len(index)] @ index._normalize(query))[::-1][:5]
+                probed = [similarity for _, similarity in index.search(query, 5, nprobe=len(index.centroids))]
+                assert np.allclose(probed, exact)
+    finally:
+        naukri.JOB_INDEX_IVF_MIN_SIZE = saved_min_size
+
+
+def test_update_job_index():
+    # The index only reads the jobs the store stamped as changed since its last sync
+    encoder = CountingEncoder()
+    saved_engine = naukri._similarity_engine
+    naukri._similarity_engine = encoder
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            store = naukri.JobStore(os.path.join(directory, 'jobs.db'))
+            store.add_search_jobs([('Acme', f'Data Engineer {number}', f'https://x/{number}', None)
+                                   for number in range(5)])
+            index = naukri.update_job_index(store, naukri.JobVectorIndex('model', index_dir=directory))
+            assert len(index) == 5 and len(encoder.texts) == 5
+            # Pretend the sync happened a while ago, then change one job
+            index.synced_at = '2000-01-01 00:00:00'
+            store._write("UPDATE jobs SET match_text_changed_at = ?", [('1999-01-01 00:00:00',)])
+            store.record_job_description('https://x/3', 'Spark pipelines')
+            store.record_job_description('https://x/3', 'Spark pipelines')
+            naukri.update_job_index(store, index)
+            assert encoder.texts[5:] == ['Data Engineer 3 at Acme. Spark pipelines']
+            store.close()
+    finally:
+        naukri._similarity_engine = saved_engine
+
+
+def write_model_config(directory, modules, pooling=None, max_seq_length=None):
+    # The sentence-transformers config files of a local model directory
+    with open(os.path.join(directory, 'modules.json'), mode='w') as file:
+        json.dump([{'idx': index, 'name': str(index), 'path': path, 'type': f"sentence_transformers.models.{kind}"}
+                   for index, (kind, path) in enumerate(modules)], file)
+    if max_seq_length is not None:
+        with open(os.path.join(directory, 'sentence_bert_config.json'), mode='w') as file:
+            json.dump({'max_seq_length': max_seq_length, 'do_lower_case': False}, file)
+    if pooling is not None:
+        os.makedirs(os.path.join(directory, '1_Pooling'), exist_ok=True)
+        with open(os.path.join(directory, '1_Pooling', 'config.json'), mode='w') as file:
+            json.dump(dict({'word_embedding_dimension': 768, 'pooling_mode_cls_token': False,
+                            'pooling_mode_mean_tokens': False, 'pooling_mode_max_tokens': False}, **pooling), file)
+
+
+def test_read_pooling_config():
+    with tempfile.TemporaryDirectory() as directory:
+        # A plain transformers model is mean-pooled at the tokenizer's own limit
+        assert naukri.read_pooling_config(directory) == {'max_seq_length': None, 'pooling': 'mean',
+                                                        'normalize': False, 'files': []}
+        write_model_config(directory, [('Transformer', ''), ('Pooling', '1_Pooling')],
+                           {'pooling_mode_mean_tokens': True}, max_seq_length=512)
+        assert naukri.read_pooling_config(directory) == {
+            'max_seq_length': 512, 'pooling': 'mean', 'normalize': False,
+            'files': ['modules.json', 'sentence_bert_config.json', '1_Pooling/config.json']}
+        write_model_config(directory, [('Transformer', ''), ('Pooling', '1_Pooling'), ('Normalize', '2_Normalize')],
+                           {'pooling_mode_cls_token': True}, max_seq_length=256)
+        config = naukri.read_pooling_config(directory)
+        assert (config['max_seq_length'], config['pooling'], config['normalize']) == (256, 'cls', True)
+        # Models whose vectors the ONNX backend would get wrong are rejected
+        for modules, pooling in [
+                ([('Transformer', ''), ('Pooling', '1_Pooling')], {'pooling_mode_weightedmean_tokens': True}),
+                ([('Transformer', ''), ('Pooling', '1_Pooling')],
+                 {'pooling_mode_mean_tokens': True, 'pooling_mode_max_tokens': True}),
+                ([('Transformer', ''), ('Pooling', '1_Pooling'), ('Dense', '2_Dense')],
+                 {'pooling_mode_mean_tokens': True}),
+                ([('Transformer', '')], None)]:
+            write_model_config(directory, modules, pooling)
+            try:
+                naukri.read_pooling_config(directory)
+            except ValueError:
+                continue
+            raise AssertionError(f"{modules} {pooling} was accepted")
+
+
+class DeadDriver:
+    # A browser that crashed: every call fails
+    @property
+    def current_url(self):
+        raise naukri.WebDriverException('chrome not reachable')
+
+    def quit(self):
+        pass
+
+
+class LiveDriver:
+    current_url = 'about:blank'
+
+    def quit(self):
+        pass
+
+
+def test_driver_pool_dead_slot():
+    # The dead slot only gives its page back after the live one found the
+    # queue empty; the page must still be visited
+    def visit(driver, item):
+        if isinstance(driver, DeadDriver):
+            time.sleep(0.3)
+            raise naukri.WebDriverException('chrome not reachable')
+        return item * 2
+
+    drivers = [LiveDriver(), DeadDriver()]
+    pool = naukri.DriverPool(2, 'https://x', driver_factory=drivers.pop, max_restarts=0)
+    assert pool.map(visit, range(5)) == [0, 2, 4, 6, 8]
+    pool = naukri.DriverPool(1, 'https://x', driver_factory=DeadDriver, max_restarts=1)
+    assert pool.map(visit, range(2)) == [None, None] and pool.restarts == [1]
+
+
+TESTS = [test_parse_search_results, test_parse_company_jobs, test_classify_apply_types, test_fetch_job_pages_over_http,
+         test_session_restore, test_governor_aimd, test_governor_against_rate_limited_portal,
+         test_embedding_cache_lru, test_search_pagination_stops,
+         test_job_vector_index, test_job_vector_index_lists, test_update_job_index,
+         test_read_pooling_config, test_driver_pool_dead_slot]
+
 
 def main():
-    print("naukri")
+    for test in TESTS:
+        test()
+        print(f"{test.__name__}: ok")
 
 if __name__ =='__main__':
-    main()
\ No newline at end of file
+    main()